@@ -1,11 +1,34 @@
 import datetime
-import os
 import statistics
 from datetime import timedelta, timezone
 
-import yaml
-
-from database.models import ActiveListing, SoldListing, get_session
+from sqlalchemy import (
+    Boolean,
+    Float,
+    bindparam,
+    cast,
+    column,
+    or_,
+    true,
+    update,
+    values,
+)
+
+from analyzer.blacklist import BlacklistIndex, get_blacklist_index
+from analyzer.comp_engine import summarize_groups
+from database.comp_window import COMP_WINDOW_DAYS, read_comp_windows
+from database.models import (
+    ActiveListing,
+    Card,
+    SoldListing,
+    cache_comps,
+    chunked,
+    current_utc_time,
+    get_cached_comps,
+    get_session,
+    is_sqlite,
+)
+from database.sketches import read_window_sketches
 
 
 def fetch_sales_history(
@@ -42,10 +65,47 @@ def fetch_sales_history(
         session.close()
 
 
+def fetch_sales_histories(keys, historical_days):
+    """
+    Fetch recent sales for many (card_id, grade, grading_company) keys at once.
+    Sales are read with one query per chunk of card ids and grouped in memory.
+    Returns {key: [{"sale_price", "sale_date"}, ...]} with an entry per key.
+    """
+    histories = {key: [] for key in keys}
+    card_ids = sorted({key[0] for key in histories})
+    cutoff_date = datetime.datetime.now(timezone.utc) - timedelta(days=historical_days)
+    session = get_session()
+    try:
+        for start in range(0, len(card_ids), COMP_QUERY_CHUNK_SIZE):
+            sales = session.query(
+                SoldListing.card_id,
+                SoldListing.grade,
+                SoldListing.grading_company,
+                SoldListing.sale_price,
+                SoldListing.sale_date,
+            ).filter(
+                SoldListing.card_id.in_(
+                    card_ids[start : start + COMP_QUERY_CHUNK_SIZE]
+                ),
+                SoldListing.sale_date >= cutoff_date,
+            )
+            for card_id, grade, grading_company, sale_price, sale_date in sales:
+                history = histories.get((card_id, grade, grading_company))
+                if history is not None:
+                    history.append({"sale_price": sale_price, "sale_date": sale_date})
+    finally:
+        session.close()
+    return histories
+
+
 # --- Constants ---
 DEFAULT_HISTORICAL_DAYS = 90
 MIN_COMPS_FOR_RELIABLE_AVG = 3
 DEFAULT_UNDERVALUE_THRESHOLD = 0.85
+# Card ids per comp query in the batch analyzer
+COMP_QUERY_CHUNK_SIZE = 1000
+# Listings per UPDATE ... FROM (VALUES ...) statement when writing results
+ANALYSIS_WRITE_CHUNK_SIZE = 5000
 
 
 def calculate_comp_stats(sales_history):
@@ -98,7 +158,12 @@ def analyze_listing(
         listing_details
     )
 
-    if is_blacklisted(card_id, grade):
+    blacklist = load_blacklist()
+    player = listing_details.get("player_name")
+    card_set = listing_details.get("card_set")
+    if blacklist.needs_card_details and not (player or card_set):
+        player, card_set = fetch_card_details([card_id]).get(card_id, (None, None))
+    if is_blacklisted(card_id, grade, blacklist, grading_company, player, card_set):
         analysis_result["message"] = (
             "Suppressed: This card/grade is blacklisted for deal alerts."
         )
@@ -106,25 +171,220 @@ def analyze_listing(
         return analysis_result
     if is_raw_card(grade, analysis_result):
         return analysis_result
-    sales_history = fetch_sales_history(
-        card_id, grade, grading_company, historical_days, analysis_result
+    comp_key = (card_id, grade, grading_company, historical_days)
+    summary = get_cached_comps(comp_key)
+    if summary is None:
+        summary = load_window_summaries([comp_key[:3]], historical_days).get(
+            comp_key[:3]
+        )
+        if summary is not None:
+            cache_comps(comp_key, summary)
+    if summary is None:
+        sales_history = fetch_sales_history(
+            card_id, grade, grading_company, historical_days, analysis_result
+        )
+        if sales_history is None:
+            return analysis_result
+        summary = summarize_comps(sales_history)
+        cache_comps(comp_key, summary)
+    comp_stats = evaluate_comps(
+        summary,
+        listing_price,
+        undervalue_threshold,
+        dynamic_threshold,
+        analysis_result,
     )
-    if sales_history is None:
-        return analysis_result
+
+    update_active_listing_with_analysis(
+        listing_details, comp_stats, analysis_result["is_potentially_undervalued"]
+    )
+    return analysis_result
+
+
+def analyze_listings(
+    listings,
+    historical_days=DEFAULT_HISTORICAL_DAYS,
+    undervalue_threshold=DEFAULT_UNDERVALUE_THRESHOLD,
+    dynamic_threshold=True,
+    seen_before=None,
+):
+    """
+    Batch version of analyze_listing. Blacklisted listings are dropped with
+    index lookups before any comp query runs, comps for
+    all distinct (card_id, grade, grading_company) keys missing from the comp
+    cache are fetched together and summarized in one vectorized pass, and
+    every listing that carries its ActiveListing "id" or "source_item_id"
+    gets comp_value, is_undervalued and one shared analyzed_at written back
+    in a single transaction (see write_analysis_results for `seen_before`).
+    Returns the analysis results in input order.
+    """
+    results, updates = analyze_batch(
+        listings, historical_days, undervalue_threshold, dynamic_threshold
+    )
+    write_analysis_results(updates, seen_before=seen_before)
+    return results
+
+
+def analyze_batch(
+    listings,
+    historical_days=DEFAULT_HISTORICAL_DAYS,
+    undervalue_threshold=DEFAULT_UNDERVALUE_THRESHOLD,
+    dynamic_threshold=True,
+):
+    """
+    analyze_listings without the write-back. Returns (results, updates),
+    where updates are the write_analysis_results rows for listings that
+    carry a key. A failed sales history query is raised, not turned into
+    per-listing messages, so a batch run never passes for a finished one.
+    """
+    blacklist = load_blacklist()
+    results, valid = [], []
+    for listing_details in listings:
+        analysis_result = initialize_analysis_result(
+            listing_details, historical_days, undervalue_threshold
+        )
+        results.append(analysis_result)
+        if validate_listing_details(listing_details, analysis_result):
+            valid.append((listing_details, analysis_result))
+    card_details = {}
+    if blacklist.needs_card_details:
+        card_details = fetch_card_details(
+            {
+                listing_details["card_id"]
+                for listing_details, _ in valid
+                if not (
+                    listing_details.get("player_name")
+                    or listing_details.get("card_set")
+                )
+            }
+        )
+
+    pending = []
+    for listing_details, analysis_result in valid:
+        card_id, grade, grading_company, listing_price = extract_listing_details(
+            listing_details
+        )
+        player, card_set = card_details.get(
+            card_id,
+            (listing_details.get("player_name"), listing_details.get("card_set")),
+        )
+        if is_blacklisted(card_id, grade, blacklist, grading_company, player, card_set):
+            analysis_result["message"] = (
+                "Suppressed: This card/grade is blacklisted for deal alerts."
+            )
+            continue
+        if is_raw_card(grade, analysis_result):
+            continue
+        pending.append((listing_details, analysis_result, listing_price))
+
+    if not pending:
+        return results, []
+    summaries, misses = {}, set()
+    for key in {extract_listing_details(p[0])[:3] for p in pending}:
+        summary = get_cached_comps((*key, historical_days))
+        if summary is None:
+            misses.add(key)
+        else:
+            summaries[key] = summary
+    if misses:
+        for key, summary in load_window_summaries(misses, historical_days).items():
+            cache_comps((*key, historical_days), summary)
+            summaries[key] = summary
+            misses.discard(key)
+    histories = fetch_sales_histories(misses, historical_days) if misses else {}
+    fetched = summarize_groups(
+        histories, DEFAULT_UNDERVALUE_THRESHOLD, DEFAULT_HISTORICAL_DAYS
+    )
+    for key, summary in fetched.items():
+        cache_comps((*key, historical_days), summary)
+    summaries.update(fetched)
+
+    updates = []
+    for listing_details, analysis_result, listing_price in pending:
+        comp_stats = evaluate_comps(
+            summaries[extract_listing_details(listing_details)[:3]],
+            listing_price,
+            undervalue_threshold,
+            dynamic_threshold,
+            analysis_result,
+        )
+        keyed = analysis_update(
+            listing_details, comp_stats, analysis_result["is_potentially_undervalued"]
+        )
+        if keyed is not None:
+            updates.append(keyed)
+    return results, updates
+
+
+def load_window_summaries(keys, historical_days=COMP_WINDOW_DAYS):
+    """
+    Comp summaries for (card_id, grade, grading_company) keys without
+    scanning sales: from the rolling comp windows for the default window,
+    otherwise by merging the daily sketches of the last historical_days.
+    Sketch medians are exact for small windows and within the t-digest's
+    rank error (well under 1%) for busy ones. Keys with nothing stored are
+    left out so callers fall back to fetching the sales.
+    """
+    session = get_session()
+    try:
+        if historical_days == COMP_WINDOW_DAYS:
+            stats = {
+                key: (window["comp_stats"], window["stdev"])
+                for key, window in read_comp_windows(session, keys).items()
+            }
+        else:
+            sketches = read_window_sketches(session, keys, historical_days)
+            stats = {
+                key: (sketch.comp_stats(), sketch.stdev())
+                for key, sketch in sketches.items()
+            }
+    except Exception as e:
+        print(f"Error reading stored comps, falling back to sales scan: {e}")
+        return {}
+    finally:
+        session.close()
+    return {
+        key: {
+            "comp_stats": comp_stats,
+            "dynamic_threshold": threshold_from_stats(comp_stats, stdev),
+        }
+        for key, (comp_stats, stdev) in stats.items()
+    }
+
+
+def summarize_comps(sales_history):
+    """
+    Reduce a sales history to what the comparison needs: the comp stats and
+    the dynamic undervalue threshold. This is the value the comp cache holds.
+    """
     comp_stats = calculate_comp_stats(sales_history)
+    return {
+        "comp_stats": comp_stats,
+        "dynamic_threshold": get_dynamic_undervalue_threshold(
+            comp_stats, sales_history
+        ),
+    }
+
+
+def evaluate_comps(
+    summary,
+    listing_price,
+    undervalue_threshold,
+    dynamic_threshold,
+    analysis_result,
+):
+    """
+    Compare a listing against a comp summary from summarize_comps and record
+    the verdict in analysis_result. Returns the comp stats.
+    """
+    comp_stats = dict(summary["comp_stats"])
     analysis_result["comp_stats"] = comp_stats
 
     if dynamic_threshold:
-        undervalue_threshold = get_dynamic_undervalue_threshold(
-            comp_stats, sales_history
-        )
+        undervalue_threshold = summary["dynamic_threshold"]
     analysis_result["undervalue_threshold"] = undervalue_threshold
     perform_comparison(comp_stats, listing_price, undervalue_threshold, analysis_result)
-
-    update_active_listing_with_analysis(
-        card_id, comp_stats, analysis_result["is_potentially_undervalued"]
-    )
-    return analysis_result
+    return comp_stats
 
 
 def initialize_analysis_result(listing_details, historical_days, undervalue_threshold):
@@ -229,36 +489,65 @@ def validate_listing_details(listing_details, analysis_result):
     return True
 
 
-def is_blacklisted(card_id, grade):
+def load_blacklist():
     """
-    Checks if a card/grade combination is blacklisted.
+    The compiled blacklist from config/blacklist.yaml. The file is parsed
+    again only after it changes; a missing or unreadable file is empty.
     """
-    blacklist_path = os.path.join(
-        os.path.dirname(os.path.dirname(__file__)), "config", "blacklist.yaml"
-    )
+    return get_blacklist_index()
+
+
+def is_blacklisted(
+    card_id, grade, blacklist=None, grading_company=None, player=None, card_set=None
+):
+    """
+    Checks if a card/grade combination is blacklisted. `blacklist` is a
+    BlacklistIndex from load_blacklist() or a list of raw entries; player
+    and card_set are only needed for player/set rules.
+    """
+    if blacklist is None:
+        blacklist = load_blacklist()
+    elif not isinstance(blacklist, BlacklistIndex):
+        blacklist = BlacklistIndex(blacklist)
+    return blacklist.matches(card_id, grade, grading_company, player, card_set)
+
+
+def fetch_card_details(card_ids):
+    """{card_id: (player, set_name)} for the blacklist's player/set rules."""
+    card_ids = sorted(card_ids)
+    details = {}
+    session = get_session()
     try:
-        with open(blacklist_path, "r", encoding="utf-8") as f:
-            bl = yaml.safe_load(f) or []
-        for entry in bl:
-            if (
-                entry.get("card_id") == card_id
-                and entry.get("grade", "").lower() == (grade or "").lower()
-            ):
-                return True
-    except Exception:
-        pass
-    return False
+        for start in range(0, len(card_ids), COMP_QUERY_CHUNK_SIZE):
+            rows = session.query(Card.id, Card.player, Card.set_name).filter(
+                Card.id.in_(card_ids[start : start + COMP_QUERY_CHUNK_SIZE])
+            )
+            for card_id, player, set_name in rows:
+                details[card_id] = (player, set_name)
+    finally:
+        session.close()
+    return details
 
 
 def get_dynamic_undervalue_threshold(comp_stats, sales_history):
     """
     Calculates a dynamic undervalue threshold based on sales data.
     """
-    base = DEFAULT_UNDERVALUE_THRESHOLD
     if not sales_history or comp_stats["sales_count"] < 3:
-        return base
+        return DEFAULT_UNDERVALUE_THRESHOLD
     prices = [s["sale_price"] for s in sales_history]
     stddev = statistics.stdev(prices) if len(prices) > 1 else 0
+    return threshold_from_stats(comp_stats, stddev)
+
+
+def threshold_from_stats(comp_stats, stddev):
+    """
+    The dynamic undervalue threshold from precomputed comp stats and the
+    sample standard deviation of the comp prices.
+    """
+    base = DEFAULT_UNDERVALUE_THRESHOLD
+    if comp_stats["sales_count"] < 3:
+        return base
     velocity = comp_stats["sales_count"] / DEFAULT_HISTORICAL_DAYS
     if stddev > 0.2 * comp_stats["median_price"]:
         return min(base + 0.1, 0.95)
@@ -267,23 +556,130 @@ def get_dynamic_undervalue_threshold(comp_stats, sales_history):
     return base
 
 
-def update_active_listing_with_analysis(card_id, comp_stats, is_undervalued):
+def analysis_update(listing_details, comp_stats, is_undervalued):
+    """
+    The write_analysis_results row for a listing, keyed by its ActiveListing
+    "id" or, failing that, "source_item_id". None if it carries neither.
+    """
+    row = {
+        "comp_value": comp_stats.get("median_price"),
+        "is_undervalued": is_undervalued,
+    }
+    if listing_details.get("id") is not None:
+        return {"id": listing_details["id"], **row}
+    if listing_details.get("source_item_id"):
+        return {"source_item_id": listing_details["source_item_id"], **row}
+    return None
+
+
+def update_active_listing_with_analysis(listing_details, comp_stats, is_undervalued):
     """
     Update the ActiveListing table with comp_value and is_undervalued.
+    Listings without an id or source_item_id cannot be told apart from
+    others of the same card and price, so they are skipped.
+    """
+    keyed = analysis_update(listing_details, comp_stats, is_undervalued)
+    if keyed is None:
+        print(
+            "Skipping analysis update for a listing without an id or "
+            f"source_item_id (card_id {listing_details.get('card_id')})"
+        )
+        return
+    try:
+        write_analysis_results([keyed])
+    except Exception:
+        # Already logged; a single listing's verdict is still returned
+        return
+
+
+def _analysis_update_statements(session, key, rows, analyzed_at, seen_before=None):
+    """UPDATE statements (with executemany params, or None) for one chunk."""
+    listings = ActiveListing.__table__
+    key_column = listings.c[key]
+    # Listings seen again after seen_before may have a new price; their
+    # verdict is stale, so they keep analyzed_at cleared for the next run
+    unchanged = (
+        or_(
+            listings.c.last_seen_at.is_(None),
+            listings.c.last_seen_at <= seen_before,
+        )
+        if seen_before is not None
+        else true()
+    )
+    if is_sqlite(session):
+        # SQLite cannot name the columns of a VALUES list; executemany of
+        # a keyed UPDATE is cheap on an embedded database
+        stmt = (
+            update(listings)
+            .where(key_column == bindparam("b_key"), unchanged)
+            .values(
+                comp_value=bindparam("b_comp_value"),
+                is_undervalued=bindparam("b_is_undervalued"),
+                analyzed_at=analyzed_at,
+            )
+        )
+        return stmt, [
+            {
+                "b_key": row[key],
+                "b_comp_value": row["comp_value"],
+                "b_is_undervalued": row["is_undervalued"],
+            }
+            for row in rows
+        ]
+    results = values(
+        column(key, key_column.type),
+        column("comp_value", Float()),
+        column("is_undervalued", Boolean()),
+        name="results",
+    ).data([(row[key], row["comp_value"], row["is_undervalued"]) for row in rows])
+    # The casts type VALUES columns that only hold NULLs
+    stmt = (
+        update(listings)
+        .where(key_column == results.c[key], unchanged)
+        .values(
+            comp_value=cast(results.c.comp_value, Float),
+            is_undervalued=cast(results.c.is_undervalued, Boolean),
+            analyzed_at=analyzed_at,
+        )
+    )
+    return stmt, None
+
+
+def write_analysis_results(updates, analyzed_at=None, seen_before=None):
+    """
+    Write comp_value and is_undervalued for many listings, keyed by
+    ActiveListing "id" or "source_item_id". Each chunk is one
+    UPDATE ... FROM (VALUES ...) joined on the key, and all chunks commit
+    together with one analyzed_at, so readers see a run's results at once.
+    With `seen_before` (the run's start), listings seen again since then
+    are skipped, since their verdict may be for an old price.
+    Returns the number of listings updated; a failed write is rolled back
+    and raised.
     """
+    if not updates:
+        return 0
+    analyzed_at = analyzed_at or current_utc_time()
+    by_key = {"id": [], "source_item_id": []}
+    for row in updates:
+        by_key["id" if row.get("id") is not None else "source_item_id"].append(row)
+    written = 0
     session = get_session()
     try:
-        listing = session.query(ActiveListing).filter_by(card_id=card_id).first()
-        if listing:
-            listing.comp_value = comp_stats.get("median_price")
-            listing.is_undervalued = is_undervalued
-            session.add(listing)
-            session.commit()
+        for key, rows in by_key.items():
+            for chunk in chunked(rows, ANALYSIS_WRITE_CHUNK_SIZE):
+                stmt, params = _analysis_update_statements(
+                    session, key, chunk, analyzed_at, seen_before
+                )
+                result = session.connection().execute(stmt, params)
+                written += result.rowcount
+        session.commit()
     except Exception as e:
         session.rollback()
-        print(f"Error updating ActiveListing for card_id {card_id}: {e}")
+        print(f"Error writing analysis results for {len(updates)} listings: {e}")
+        raise
     finally:
         session.close()
+    return written
 
 
 # --- Example Usage ---
@@ -0,0 +1,161 @@
+# analyzer/blacklist.py
+"""
+Compiled index over config/blacklist.yaml.
+
+Entries are compiled once into hash lookups keyed by their scope, so each
+check costs a handful of dict probes instead of a scan of the list, and the
+file is re-read only when its modification time or size changes.
+
+An entry's scope is any combination of `card_id`, `player` and `set`; all
+given fields must match the listing's card, and entries with none of them
+are ignored. Its grade condition is either
+an exact `grade`, a numeric range with `min_grade` and/or `max_grade`
+(optionally restricted to one `grading_company`), or nothing, which only
+matches listings without a grade (so `card_id: 123` alone does not hide
+the card's graded copies):
+
+    - card_id: 123
+      grade: PSA 10
+    - player: Mike Trout
+      max_grade: 7
+    - set: 2011 Topps Update
+      grading_company: BGS
+      min_grade: 9
+      max_grade: 9.5
+"""
+import logging
+import os
+import re
+import threading
+
+import yaml
+
+BLACKLIST_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "config", "blacklist.yaml"
+)
+
+_GRADE_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize_grade(grade):
+    """Case- and whitespace-insensitive form of a grade ("psa 10")."""
+    return " ".join(str(grade).split()).lower() if grade else ""
+
+
+def _normalize_name(value):
+    return " ".join(str(value).split()).lower() if value else None
+
+
+def grade_number(grade):
+    """The numeric part of a grade ("PSA 9.5" -> 9.5), or None."""
+    match = _GRADE_NUMBER.search(str(grade or ""))
+    return float(match.group()) if match else None
+
+
+class _ScopeRules:
+    __slots__ = ("grades", "ranges")
+
+    def __init__(self):
+        self.grades = set()  # normalized grades; "" for no grade
+        self.ranges = []  # (grading_company or None, low, high)
+
+    def matches(self, grade, grading_company):
+        norm = normalize_grade(grade)
+        if norm in self.grades:
+            return True
+        if not self.ranges:
+            return False
+        number = grade_number(grade)
+        if number is None:
+            return False
+        company = _normalize_name(grading_company) or norm.split(" ")[0]
+        return any(
+            low <= number <= high and (want is None or want == company)
+            for want, low, high in self.ranges
+        )
+
+
+class BlacklistIndex:
+    """Blacklist entries compiled into per-scope hash lookups."""
+
+    def __init__(self, entries=()):
+        self._rules = {}
+        self.needs_card_details = False
+        for entry in entries or ():
+            try:
+                self._add(entry)
+            except (AttributeError, TypeError, ValueError) as e:
+                logging.warning(f"Ignoring malformed blacklist entry {entry!r}: {e}")
+
+    def __len__(self):
+        return len(self._rules)
+
+    def _add(self, entry):
+        scope = (
+            entry.get("card_id"),
+            _normalize_name(entry.get("player")),
+            _normalize_name(entry.get("set")),
+        )
+        if scope == (None, None, None):
+            raise ValueError("needs a card_id, player or set")
+        if scope[1] or scope[2]:
+            self.needs_card_details = True
+        low, high = entry.get("min_grade"), entry.get("max_grade")
+        grade_range = None
+        if not entry.get("grade") and (low is not None or high is not None):
+            grade_range = (
+                _normalize_name(entry.get("grading_company")),
+                float("-inf") if low is None else float(low),
+                float("inf") if high is None else float(high),
+            )
+        rules = self._rules.setdefault(scope, _ScopeRules())
+        if grade_range is not None:
+            rules.ranges.append(grade_range)
+        else:
+            rules.grades.add(normalize_grade(entry.get("grade")))
+
+    def matches(self, card_id, grade, grading_company=None, player=None, card_set=None):
+        """True if any entry suppresses this card/grade."""
+        if not self._rules:
+            return False
+        player, card_set = _normalize_name(player), _normalize_name(card_set)
+        for scope_card in (card_id, None):
+            for scope_player in (player, None) if player else (None,):
+                for scope_set in (card_set, None) if card_set else (None,):
+                    rules = self._rules.get((scope_card, scope_player, scope_set))
+                    if rules is not None and rules.matches(grade, grading_company):
+                        return True
+        return False
+
+
+_loaded = {}
+_load_lock = threading.Lock()
+
+
+def get_blacklist_index(path=BLACKLIST_PATH):
+    """
+    The compiled blacklist for `path`, rebuilt only when the file's mtime
+    or size changes. A missing or unreadable file is an empty blacklist.
+    """
+    try:
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        version = None
+    cached = _loaded.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _load_lock:
+        cached = _loaded.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        entries = []
+        if version is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entries = yaml.safe_load(f) or []
+            except Exception as e:
+                logging.warning(f"Could not read blacklist {path}: {e}")
+        index = BlacklistIndex(entries if isinstance(entries, list) else [])
+        _loaded[path] = (version, index)
+        return index
@@ -0,0 +1,144 @@
+# analyzer/comp_engine.py
+"""
+Vectorized comp statistics for many card/grade groups at once.
+
+Sales for all groups are laid out as one flat price array plus group
+offsets: group i owns prices[offsets[i]:offsets[i + 1]]. Every statistic is
+computed for all groups together with array operations, so summarizing the
+whole catalog costs a few NumPy passes instead of one interpreter loop per
+group. Results match calculate_comp_stats and
+get_dynamic_undervalue_threshold in analyzer.analyzer.
+"""
+import numpy as np
+
+
+def group_sales(histories):
+    """
+    Flatten {key: [{"sale_price": ...}, ...]} into (keys, prices, offsets).
+    Sales without a price are dropped.
+    """
+    keys = list(histories)
+    counts = np.zeros(len(keys), dtype=np.int64)
+    flat = []
+    for i, key in enumerate(keys):
+        prices = [
+            sale["sale_price"]
+            for sale in histories[key]
+            if sale.get("sale_price") is not None
+        ]
+        counts[i] = len(prices)
+        flat.extend(prices)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return keys, np.asarray(flat, dtype=np.float64), offsets
+
+
+def compute_group_stats(prices, offsets, velocity_days):
+    """
+    Compute count, mean, median, min, max, sample stdev and velocity (sales
+    per day over `velocity_days`) for every group. Returns a dict of arrays
+    with one entry per group; statistics of empty groups are NaN.
+    """
+    counts = np.diff(offsets)
+    n_groups = len(counts)
+    nonempty = counts > 0
+    nan = np.full(n_groups, np.nan)
+    if len(prices) == 0:
+        return {
+            "count": counts,
+            "mean": nan,
+            "median": nan,
+            "min": nan,
+            "max": nan,
+            "stdev": np.zeros(n_groups),
+            "velocity": counts / velocity_days,
+        }
+
+    group_ids = np.repeat(np.arange(n_groups), counts)
+    # Sort by group, then price, so each group's slice is in order
+    ordered = prices[np.lexsort((prices, group_ids))]
+    top = len(ordered) - 1
+    starts = np.minimum(offsets[:-1], top)
+    last = np.clip(offsets[1:] - 1, 0, top)
+    mid = np.minimum(offsets[:-1] + counts // 2, top)
+    below_mid = np.maximum(mid - 1, 0)
+    median = np.where(
+        counts % 2 == 1, ordered[mid], (ordered[below_mid] + ordered[mid]) / 2
+    )
+
+    mean = np.bincount(group_ids, weights=prices, minlength=n_groups) / np.maximum(
+        counts, 1
+    )
+    squared = np.bincount(
+        group_ids, weights=(prices - mean[group_ids]) ** 2, minlength=n_groups
+    )
+    stdev = np.where(counts > 1, np.sqrt(squared / np.maximum(counts - 1, 1)), 0.0)
+
+    return {
+        "count": counts,
+        "mean": np.where(nonempty, mean, nan),
+        "median": np.where(nonempty, median, nan),
+        "min": np.where(nonempty, ordered[starts], nan),
+        "max": np.where(nonempty, ordered[last], nan),
+        "stdev": stdev,
+        "velocity": counts / velocity_days,
+    }
+
+
+def dynamic_thresholds(stats, base_threshold, min_comps=3):
+    """
+    Vectorized get_dynamic_undervalue_threshold: volatile groups get a
+    looser threshold, slow-moving ones a slightly looser one.
+    """
+    count = stats["count"]
+    return np.select(
+        [
+            count < min_comps,
+            stats["stdev"] > 0.2 * np.nan_to_num(stats["median"]),
+            stats["velocity"] < 0.05,
+        ],
+        [
+            base_threshold,
+            min(base_threshold + 0.1, 0.95),
+            min(base_threshold + 0.05, 0.9),
+        ],
+        default=base_threshold,
+    )
+
+
+def comp_stats_at(stats, i):
+    """The comp_stats dict for group i, in calculate_comp_stats' format."""
+    if stats["count"][i] == 0:
+        return {
+            "median_price": None,
+            "average_price": None,
+            "min_price": None,
+            "max_price": None,
+            "sales_count": 0,
+        }
+    return {
+        "median_price": float(stats["median"][i]),
+        "average_price": float(stats["mean"][i]),
+        "min_price": float(stats["min"][i]),
+        "max_price": float(stats["max"][i]),
+        "sales_count": int(stats["count"][i]),
+    }
+
+
+def summarize_groups(histories, base_threshold, velocity_days, min_comps=3):
+    """
+    Summarize many sales histories at once. Returns {key: summary} with the
+    same shape as analyzer.summarize_comps.
+    """
+    keys, prices, offsets = group_sales(histories)
+    if not keys:
+        return {}
+    stats = compute_group_stats(prices, offsets, velocity_days)
+    thresholds = dynamic_thresholds(stats, base_threshold, min_comps)
+    return {
+        key: {
+            "comp_stats": comp_stats_at(stats, i),
+            "dynamic_threshold": float(thresholds[i]),
+        }
+        for i, key in enumerate(keys)
+    }
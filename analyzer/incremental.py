@@ -0,0 +1,179 @@
+# analyzer/incremental.py
+"""
+Incremental analysis: re-evaluate only the listings that changed.
+
+A listing is dirty when it has never been analyzed or when its price,
+grade or grading company changed since it was (bulk_upsert_active_listings
+clears analyzed_at on such a change), or when its card/grade/company got
+new sales or lost expired ones since the last finished run. Comp changes
+are found through the updated_at of the rolling comp windows and daily
+sketches, which sold ingest and expiry keep current. Every run is recorded
+in analyzer_runs; its start time is the watermark for the next one, so
+sales that arrive during a run are picked up by the following run.
+"""
+from sqlalchemy import func, or_, select, update
+
+from analyzer.analyzer import DEFAULT_HISTORICAL_DAYS, DEFAULT_UNDERVALUE_THRESHOLD
+from analyzer.parallel import DEFAULT_ANALYZE_WORKERS, analyze_listings_parallel
+from database.comp_window import expire_comp_windows
+from database.models import (
+    ActiveListing,
+    AnalyzerRun,
+    CompWindowAggregate,
+    SoldListingDailySketch,
+    chunked,
+    current_utc_time,
+    get_session,
+    key_condition,
+)
+
+# Keys per listing lookup when collecting listings with changed comps
+DIRTY_KEY_CHUNK_SIZE = 500
+# Listing ids per analyzed_at stamp
+STAMP_CHUNK_SIZE = 5000
+
+_LISTING_KEY = (
+    ActiveListing.card_id,
+    ActiveListing.grade,
+    ActiveListing.grading_company,
+)
+
+
+def last_watermark(session):
+    """Start of the last finished analyzer run, or None before the first."""
+    return session.execute(
+        select(func.max(AnalyzerRun.started_at)).where(
+            AnalyzerRun.finished_at.is_not(None)
+        )
+    ).scalar()
+
+
+def changed_comp_keys(session, since):
+    """(card_id, grade, grading_company) keys whose comps changed after `since`."""
+    keys = set()
+    for model in (CompWindowAggregate, SoldListingDailySketch):
+        keys.update(
+            session.execute(
+                select(model.card_id, model.grade, model.grading_company)
+                .where(model.updated_at > since)
+                .distinct()
+            ).all()
+        )
+    return keys
+
+
+def dirty_listings(session, since):
+    """
+    Active listings to re-analyze: unanalyzed or changed ones, plus those
+    whose comps changed after `since`. All listings when `since` is None.
+    """
+    if since is None:
+        return session.query(ActiveListing).all()
+    listings = {
+        listing.id: listing
+        for listing in session.query(ActiveListing).filter(
+            ActiveListing.analyzed_at.is_(None)
+        )
+    }
+    keys = sorted(changed_comp_keys(session, since), key=repr)
+    for chunk in chunked(keys, DIRTY_KEY_CHUNK_SIZE):
+        for listing in session.query(ActiveListing).filter(
+            key_condition(_LISTING_KEY, chunk)
+        ):
+            listings[listing.id] = listing
+    return list(listings.values())
+
+
+def listing_details(listing):
+    """The analyzer's listing dict for an ActiveListing row."""
+    return {
+        "id": listing.id,
+        "card_id": listing.card_id,
+        "listing_price": listing.listing_price,
+        "grade": listing.grade,
+        "grading_company": listing.grading_company,
+        "source_url": listing.source_url,
+        "source": listing.source,
+    }
+
+
+def record_run(started_at, full, listings_analyzed):
+    """Record a finished analyzer run; its start is the next watermark."""
+    session = get_session()
+    try:
+        session.add(
+            AnalyzerRun(
+                started_at=started_at,
+                finished_at=current_utc_time(),
+                full=full,
+                listings_analyzed=listings_analyzed,
+            )
+        )
+        session.commit()
+    finally:
+        session.close()
+
+
+def run_analysis(
+    full=False,
+    workers=DEFAULT_ANALYZE_WORKERS,
+    historical_days=DEFAULT_HISTORICAL_DAYS,
+    undervalue_threshold=DEFAULT_UNDERVALUE_THRESHOLD,
+    dynamic_threshold=True,
+):
+    """
+    Analyze the dirty listings (every listing when `full` or on the first
+    run) and record the run. Returns (listings, results) for the listings
+    that were analyzed. If the comps cannot be read or the verdicts cannot
+    be written, the error is raised before anything is stamped or
+    recorded, so the next run retries the same listings.
+    """
+    started_at = current_utc_time()
+    # Aged-out sales leave the comp windows first; the windows they touch
+    # are then dirty for this run
+    expire_comp_windows()
+    session = get_session()
+    try:
+        since = None if full else last_watermark(session)
+        listings = dirty_listings(session, since)
+    finally:
+        session.close()
+
+    results = analyze_listings_parallel(
+        [listing_details(listing) for listing in listings],
+        workers,
+        historical_days,
+        undervalue_threshold,
+        dynamic_threshold,
+        seen_before=started_at,
+    )
+    session = get_session()
+    try:
+        # Raw and blacklisted listings get no verdict; stamp them anyway so
+        # they are not dirty forever. Listings seen again during the run
+        # got no verdict either (see the verdict write) and may be dirty for
+        # comps that the next watermark is past, so their stamp is cleared.
+        analyzed_at = current_utc_time()
+        seen_during_run = ActiveListing.last_seen_at > started_at
+        for chunk in chunked([listing.id for listing in listings], STAMP_CHUNK_SIZE):
+            session.execute(
+                update(ActiveListing)
+                .where(
+                    ActiveListing.id.in_(chunk),
+                    ActiveListing.analyzed_at.is_(None),
+                    or_(ActiveListing.last_seen_at.is_(None), ~seen_during_run),
+                )
+                .values(analyzed_at=analyzed_at)
+                .execution_options(synchronize_session=False)
+            )
+            session.execute(
+                update(ActiveListing)
+                .where(ActiveListing.id.in_(chunk), seen_during_run)
+                .values(analyzed_at=None)
+                .execution_options(synchronize_session=False)
+            )
+        session.commit()
+    finally:
+        session.close()
+    record_run(started_at, since is None, len(listings))
+    return listings, results
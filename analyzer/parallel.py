@@ -0,0 +1,102 @@
+# analyzer/parallel.py
+"""
+Process-pool analyzer for full-catalog runs.
+
+Listings are sharded by a hash of card_id, so every card's comps are
+fetched and summarized by exactly one worker. Each worker runs
+analyze_batch on its shard with its own engine (database.models resets the
+engine in forked children) and sends back compact (comp_stats, flag,
+message) tuples plus the write-back rows. The parent writes every shard's
+rows in one write_analysis_results call, so a run still lands as one
+transaction.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from analyzer.analyzer import (
+    DEFAULT_HISTORICAL_DAYS,
+    DEFAULT_UNDERVALUE_THRESHOLD,
+    analyze_batch,
+    analyze_listings,
+    initialize_analysis_result,
+    write_analysis_results,
+)
+
+DEFAULT_ANALYZE_WORKERS = int(os.getenv("ANALYZE_WORKERS", 1))
+
+
+def shard_listings(listings, workers):
+    """
+    Split listings into `workers` shards by card_id. Returns one list of
+    (position, listing) pairs per shard, so results can be put back in
+    input order.
+    """
+    shards = [[] for _ in range(workers)]
+    for position, listing in enumerate(listings):
+        shards[hash(listing.get("card_id")) % workers].append((position, listing))
+    return shards
+
+
+def _analyze_shard(shard, historical_days, undervalue_threshold, dynamic_threshold):
+    results, updates = analyze_batch(
+        [listing for _, listing in shard],
+        historical_days,
+        undervalue_threshold,
+        dynamic_threshold,
+    )
+    compact = [
+        (r["comp_stats"], r["is_potentially_undervalued"], r["message"])
+        for r in results
+    ]
+    return [position for position, _ in shard], compact, updates
+
+
+def analyze_listings_parallel(
+    listings,
+    workers=DEFAULT_ANALYZE_WORKERS,
+    historical_days=DEFAULT_HISTORICAL_DAYS,
+    undervalue_threshold=DEFAULT_UNDERVALUE_THRESHOLD,
+    dynamic_threshold=True,
+    seen_before=None,
+):
+    """
+    analyze_listings spread over `workers` processes. Returns the analysis
+    results in input order.
+    """
+    listings = list(listings)
+    if workers <= 1 or len(listings) < 2:
+        return analyze_listings(
+            listings,
+            historical_days,
+            undervalue_threshold,
+            dynamic_threshold,
+            seen_before,
+        )
+    shards = [shard for shard in shard_listings(listings, workers) if shard]
+    results, updates = [None] * len(listings), []
+    with ProcessPoolExecutor(max_workers=len(shards)) as pool:
+        futures = [
+            pool.submit(
+                _analyze_shard,
+                shard,
+                historical_days,
+                undervalue_threshold,
+                dynamic_threshold,
+            )
+            for shard in shards
+        ]
+        for future in futures:
+            positions, shard_results, shard_updates = future.result()
+            for position, (comp_stats, flagged, message) in zip(
+                positions, shard_results
+            ):
+                result = initialize_analysis_result(
+                    listings[position], historical_days, undervalue_threshold
+                )
+                result["comp_stats"] = comp_stats
+                result["is_potentially_undervalued"] = flagged
+                result["message"] = message
+                results[position] = result
+            updates.extend(shard_updates)
+    write_analysis_results(updates, seen_before=seen_before)
+    return results
@@ -0,0 +1,212 @@
+# analyzer/pushdown.py
+"""
+SQL push-down analyzer for PostgreSQL.
+
+Comp stats for every (card_id, grade, grading_company) with an active
+listing are computed inside the database with percentile_cont, avg,
+stddev_samp, min, max and count over the comp window. The dynamic
+threshold and the undervalue rule run in the same statement, which also
+writes comp_value, is_undervalued and analyzed_at back to active_listings.
+Only the flagged listings (with their comp stats) and the number of
+listings analyzed come back to Python, instead of every sale in the window.
+
+The rules mirror analyze_batch and run_analysis: raw cards and listings
+the blacklist suppresses get no verdict (their stored comp_value and
+is_undervalued are left alone) but are stamped analyzed, and the dynamic
+threshold follows threshold_from_stats. The blacklist is evaluated in
+Python over the graded listings' keys, only when it has entries, and the
+suppressed ids go into the statement.
+"""
+import datetime
+from datetime import timedelta, timezone
+
+from sqlalchemy import ARRAY, Integer, bindparam, text
+
+from analyzer.analyzer import (
+    DEFAULT_HISTORICAL_DAYS,
+    DEFAULT_UNDERVALUE_THRESHOLD,
+    MIN_COMPS_FOR_RELIABLE_AVG,
+    fetch_card_details,
+    initialize_analysis_result,
+    is_blacklisted,
+    load_blacklist,
+    perform_comparison,
+)
+from database.models import current_utc_time, get_engine
+
+_ANALYZE_SQL = text(
+    """
+WITH candidates AS (
+    SELECT id, card_id, grade, grading_company
+    FROM active_listings
+    WHERE card_id IS NOT NULL AND grade IS NOT NULL AND lower(grade) <> 'raw'
+      AND id <> ALL(:suppressed)
+),
+targets AS (
+    SELECT DISTINCT card_id, grade, grading_company FROM candidates
+),
+comps AS (
+    SELECT s.card_id, s.grade, s.grading_company,
+           count(*) AS sales_count,
+           avg(s.sale_price) AS average_price,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY s.sale_price)
+               AS median_price,
+           min(s.sale_price) AS min_price,
+           max(s.sale_price) AS max_price,
+           coalesce(stddev_samp(s.sale_price), 0) AS stdev
+    FROM sold_listings s
+    JOIN targets t
+      ON s.card_id = t.card_id
+     AND s.grade = t.grade
+     AND s.grading_company IS NOT DISTINCT FROM t.grading_company
+    WHERE s.sale_date >= :cutoff AND s.sale_price IS NOT NULL
+    GROUP BY s.card_id, s.grade, s.grading_company
+),
+verdicts AS (
+    SELECT a.id, c.sales_count, c.average_price, c.median_price,
+           c.min_price, c.max_price,
+           CASE
+               WHEN NOT :dynamic THEN :threshold
+               WHEN coalesce(c.sales_count, 0) < :min_comps THEN :base
+               WHEN c.stdev > 0.2 * c.median_price THEN least(:base + 0.1, 0.95)
+               WHEN c.sales_count::float / :velocity_days < 0.05
+                   THEN least(:base + 0.05, 0.9)
+               ELSE :base
+           END AS undervalue_threshold
+    FROM candidates a
+    LEFT JOIN comps c
+      ON a.card_id = c.card_id
+     AND a.grade = c.grade
+     AND a.grading_company IS NOT DISTINCT FROM c.grading_company
+),
+updated AS (
+    UPDATE active_listings a
+    SET comp_value = v.median_price,
+        is_undervalued = coalesce(
+            a.listing_price < v.median_price * v.undervalue_threshold, false
+        ),
+        analyzed_at = :analyzed_at
+    FROM verdicts v
+    WHERE a.id = v.id
+    RETURNING a.id, a.card_id, a.grade, a.grading_company, a.listing_price,
+              a.source, a.source_url, a.is_undervalued,
+              v.sales_count, v.average_price, v.median_price,
+              v.min_price, v.max_price, v.undervalue_threshold
+),
+stamped AS (
+    UPDATE active_listings a
+    SET analyzed_at = :analyzed_at
+    WHERE NOT EXISTS (SELECT 1 FROM verdicts v WHERE v.id = a.id)
+)
+SELECT totals.analyzed, flagged.*
+FROM (SELECT count(*) AS analyzed FROM updated) totals
+LEFT JOIN (SELECT * FROM updated WHERE is_undervalued) flagged ON true
+ORDER BY flagged.id
+"""
+).bindparams(bindparam("suppressed", type_=ARRAY(Integer)))
+
+_GRADED_SQL = text(
+    """
+SELECT id, card_id, grade, grading_company
+FROM active_listings
+WHERE card_id IS NOT NULL AND grade IS NOT NULL AND lower(grade) <> 'raw'
+"""
+)
+
+
+def analyze_in_database(
+    historical_days=DEFAULT_HISTORICAL_DAYS,
+    undervalue_threshold=DEFAULT_UNDERVALUE_THRESHOLD,
+    dynamic_threshold=True,
+    engine=None,
+):
+    """
+    Analyze every active listing inside PostgreSQL.
+    Returns {"analyzed": count, "flagged": [analysis_result, ...]} with
+    analysis results shaped like analyze_listing's.
+    """
+    engine = engine or get_engine()
+    if engine.dialect.name != "postgresql":
+        raise ValueError("SQL push-down analysis needs PostgreSQL")
+    cutoff = datetime.datetime.now(timezone.utc) - timedelta(days=historical_days)
+    analyzed_at = current_utc_time()
+    blacklist = load_blacklist()
+    with engine.begin() as conn:
+        suppressed = _suppressed_ids(conn, blacklist)
+        rows = (
+            conn.execute(
+                _ANALYZE_SQL,
+                {
+                    "cutoff": cutoff,
+                    "dynamic": dynamic_threshold,
+                    "threshold": undervalue_threshold,
+                    "base": DEFAULT_UNDERVALUE_THRESHOLD,
+                    "min_comps": MIN_COMPS_FOR_RELIABLE_AVG,
+                    "velocity_days": DEFAULT_HISTORICAL_DAYS,
+                    "analyzed_at": analyzed_at,
+                    "suppressed": suppressed,
+                },
+            )
+            .mappings()
+            .all()
+        )
+    analyzed = rows[0]["analyzed"] if rows else 0
+    flagged = [
+        _analysis_result(row, historical_days) for row in rows if row["id"] is not None
+    ]
+    return {"analyzed": analyzed, "flagged": flagged}
+
+
+def _suppressed_ids(conn, blacklist):
+    """Ids of the graded listings the blacklist suppresses."""
+    if not len(blacklist):
+        return []
+    listings = conn.execute(_GRADED_SQL).all()
+    card_details = {}
+    if blacklist.needs_card_details:
+        card_details = fetch_card_details({row.card_id for row in listings})
+    return [
+        row.id
+        for row in listings
+        if is_blacklisted(
+            row.card_id,
+            row.grade,
+            blacklist,
+            row.grading_company,
+            *card_details.get(row.card_id, (None, None)),
+        )
+    ]
+
+
+def _analysis_result(row, historical_days):
+    """An analyze_listing-shaped result for one flagged row."""
+    listing_details = {
+        key: row[key]
+        for key in (
+            "id",
+            "card_id",
+            "grade",
+            "grading_company",
+            "listing_price",
+            "source",
+            "source_url",
+        )
+    }
+    comp_stats = {
+        "median_price": row["median_price"],
+        "average_price": row["average_price"],
+        "min_price": row["min_price"],
+        "max_price": row["max_price"],
+        "sales_count": row["sales_count"],
+    }
+    analysis_result = initialize_analysis_result(
+        listing_details, historical_days, row["undervalue_threshold"]
+    )
+    analysis_result["comp_stats"] = comp_stats
+    perform_comparison(
+        comp_stats,
+        row["listing_price"],
+        row["undervalue_threshold"],
+        analysis_result,
+    )
+    return analysis_result
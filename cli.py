@@ -1,10 +1,13 @@
 import asyncio
-import os
 
 import click
 
 from collector.adapters.ebay import fetch_cards
-from database.models import add_active_listing_to_db, add_card_definition, get_session
+from database.models import (
+    bulk_upsert_active_listings,
+    get_session,
+    resolve_card_ids,
+)
 
 
 @click.group()
@@ -18,47 +21,155 @@ def cli():
 def crawl(query, limit):
     """Fetch listings from eBay based on a query."""
     click.echo(f"Fetching up to {limit} items for query: '{query}'...")
-    if not os.getenv("EBAY_ACCESS_TOKEN"):
-        click.echo("Error: EBAY_ACCESS_TOKEN environment variable not set.", err=True)
-        click.echo(
-            "Pls generate a token (see README) and add it to your .env file.", err=True
-        )
-        return
     try:
         cards = asyncio.run(fetch_cards(query, limit=limit))
         click.echo(f"Successfully fetched {len(cards)} items from eBay.")
-        for card in cards:
-            card_id = add_card_definition(card)
-            add_active_listing_to_db(get_session(), card_id, card)
+        card_ids = resolve_card_ids(cards)
+        rows = [{**card, "card_id": card_id} for card, card_id in zip(cards, card_ids)]
+        session = get_session()
+        try:
+            counts = bulk_upsert_active_listings(session, rows)
+        finally:
+            session.close()
+        click.echo(
+            f"Stored {counts['inserted']} new and {counts['updated']} updated listings."
+        )
     except Exception as e:
         click.echo(f"Error during crawl: {e}", err=True)
 
 
 @cli.command()
-def analyze():
+def migrate():
+    """Create missing tables and apply pending schema migrations."""
+    from database.migrations import current_version
+    from database.models import init_db
+
+    from_version = current_version()
+    init_db()
+    click.echo(f"Schema migrated from version {from_version} to {current_version()}.")
+
+
+@cli.command()
+@click.option(
+    "--horizon-days",
+    default=None,
+    type=int,
+    help="Roll up raw sales older than this many days (default SOLD_RETENTION_DAYS).",
+)
+def compact(horizon_days):
+    """Roll up old sold listings into daily summaries and drop the raw rows."""
+    from database.comp_window import expire_comp_windows
+    from database.partitions import (
+        SOLD_RETENTION_DAYS,
+        compact_sold_listings,
+        ensure_sold_listing_partitions,
+    )
+    from database.sketches import prune_daily_sketches
+
+    created = ensure_sold_listing_partitions()
+    if created:
+        click.echo(f"Created {len(created)} sold_listings partition(s).")
+    result = compact_sold_listings(horizon_days or SOLD_RETENTION_DAYS)
+    click.echo(
+        f"Compacted {result['rows_compacted']} sold rows and dropped "
+        f"{len(result['partitions_dropped'])} partition(s)."
+    )
+    click.echo(f"Expired sales from {expire_comp_windows()} comp window(s).")
+    click.echo(f"Pruned {prune_daily_sketches()} old daily sketch(es).")
+
+
+@cli.command()
+@click.argument("files", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option(
+    "--format",
+    "file_format",
+    type=click.Choice(["csv", "jsonl"]),
+    default=None,
+    help="Input format (default: guessed from the file extension).",
+)
+@click.option(
+    "--checkpoint",
+    default="backfill_checkpoint.json",
+    help="File that records load progress for resuming.",
+)
+@click.option("--batch-size", default=None, type=int, help="Rows per COPY batch.")
+@click.option("--source", default="backfill", help="Source for rows without one.")
+def backfill(files, file_format, checkpoint, batch_size, source):
+    """Bulk-load historical sold listings from CSV or JSONL files."""
+    from collector.backfill import BACKFILL_BATCH_SIZE, backfill_file
+
+    for path in files:
+        stats = backfill_file(
+            path,
+            checkpoint_path=checkpoint,
+            batch_size=batch_size or BACKFILL_BATCH_SIZE,
+            source=source,
+            file_format=file_format,
+        )
+        click.echo(
+            f"{path}: {stats['read']} read, {stats['inserted']} inserted, "
+            f"{stats['skipped']} skipped."
+        )
+
+
+@cli.command()
+@click.option(
+    "--workers",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Processes to shard the listings across (default: ANALYZE_WORKERS or 1).",
+)
+@click.option(
+    "--pushdown",
+    is_flag=True,
+    help="Compute comps and verdicts inside PostgreSQL; only deals are fetched.",
+)
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Re-analyze every listing, not only those changed since the last run.",
+)
+def analyze(workers, pushdown, full):
     """Analyze fetched data to find deals."""
     click.echo("Analyzer stub")  # Add this line to satisfy the test
-    from analyzer.analyzer import analyze_listing
-    from database.models import ActiveListing, get_session
+    from analyzer.incremental import record_run, run_analysis
+    from analyzer.parallel import DEFAULT_ANALYZE_WORKERS
+    from database.models import comp_cache_info, current_utc_time
+
+    if pushdown:
+        from analyzer.pushdown import analyze_in_database
+
+        started_at = current_utc_time()
+        try:
+            outcome = analyze_in_database()
+        except ValueError as e:
+            click.echo(f"{e}; analyzing in Python instead.")
+        else:
+            for result in outcome["flagged"]:
+                listing = result["listing_details"]
+                click.echo("\n--- DEAL FOUND ---")
+                click.echo(
+                    f"Card ID:{listing['card_id']} | "
+                    f"Price: ${listing['listing_price']:.2f} | "
+                    f"Grade: {listing['grade']} | Source: {listing['source']}"
+                )
+                click.echo(f"URL: {listing['source_url']}")
+                click.echo(f"Reason: {result['message']}")
+            click.echo(
+                f"\nAnalysis complete. {outcome['analyzed']} listing(s) analyzed, "
+                f"{len(outcome['flagged'])} deal(s) found."
+            )
+            record_run(started_at, True, outcome["analyzed"])
+            return
 
-    session = get_session()
-    listings = session.query(ActiveListing).all()
+    listings, results = run_analysis(full, workers or DEFAULT_ANALYZE_WORKERS)
     if not listings:
-        click.echo("No active listings found in the database.")
+        click.echo("No new or changed active listings to analyze.")
         return
 
-    click.echo(f"Analyzing {len(listings)} active listings...")
+    click.echo(f"Analyzed {len(listings)} new or changed active listings...")
     deals_found = 0
-    for listing in listings:
-        listing_dict = {
-            "card_id": listing.card_id,
-            "listing_price": listing.listing_price,
-            "grade": listing.grade,
-            "grading_company": listing.grading_company,
-            "source_url": listing.source_url,
-            "source": listing.source,
-        }
-        result = analyze_listing(listing_dict)
+    for listing, result in zip(listings, results):
         if result.get("is_potentially_undervalued"):
             deals_found += 1
             click.echo("\n--- DEAL FOUND ---")
@@ -72,6 +183,8 @@ def analyze():
                 f"Card ID: {listing.card_id} | Price: ${listing.listing_price:.2f} | Grade: {listing.grade} | Not a deal."
             )
     click.echo(f"\nAnalysis complete. {deals_found} deal(s) found.")
+    cache = comp_cache_info()
+    click.echo(f"Comp cache: {cache['hits']} hits, {cache['misses']} misses.")
 
 
 if __name__ == "__main__":
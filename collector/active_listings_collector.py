@@ -7,7 +7,11 @@ from datetime import datetime
 
 import requests
 
-from database.models import add_active_listing_to_db, add_card_definition, get_session
+from database.models import (
+    bulk_upsert_active_listings,
+    get_session,
+    resolve_card_ids,
+)
 
 # Load configuration file
 CONFIG_FILE = "sites_config.json"
@@ -79,34 +83,21 @@ def process_site(site_config):
             module = importlib.import_module(module_name)
             collect_function = getattr(module, function_name)
 
-            print(
-                f"DEBUG: Collector function {function_name} returned: {list(collect_function())}"
-            )
+            listings = list(collect_function())
+            print(f"DEBUG: Collector function {function_name} returned: {listings}")
 
-            for listing in collect_function():
-                print(f"DEBUG: Processing listing: {listing}")
-                player_name = listing.get("player_name")
-                card_year = listing.get("card_year")
-                card_set = listing.get("card_set")
-                card_number = listing.get("card_number")
-                attributes = listing.get("attributes")
-
-                card_id = add_card_definition(
-                    {
-                        "player_name": player_name,
-                        "card_year": card_year,
-                        "card_set": card_set,
-                        "card_number": card_number,
-                        "attributes": attributes,
-                    }
-                )
-
-                print(f"DEBUG: Adding listing to DB: {listing} (card_id={card_id})")
-
-                add_active_listing_to_db(session, card_id, listing)
-        session.commit()
+            card_ids = resolve_card_ids(listings)
+            rows = [
+                {**listing, "card_id": card_id}
+                for listing, card_id in zip(listings, card_ids)
+            ]
+
+            counts = bulk_upsert_active_listings(session, rows)
+            log_progress(
+                f"{site_config.get('name')}/{function_name}: "
+                f"{counts['inserted']} inserted, {counts['updated']} updated"
+            )
     except Exception as e:
-        session.rollback()
         log_error(f"Error processing site {site_config.get('name')}: {e}")
     finally:
         session.close()
@@ -1,12 +1,21 @@
 # collector/adapters/ebay.py
 import asyncio
 import os
+from datetime import datetime, timezone
 
 import aiohttp
 import requests
 from aiohttp import ClientSession
-from tenacity import retry, stop_after_attempt, wait_exponential
-from database.models import get_session
+from tenacity import retry, stop_after_attempt, wait_random_exponential
+
+from collector.rate_limit import (
+    BROWSE_ITEM,
+    BROWSE_SEARCH,
+    get_rate_limiter,
+    retry_after_seconds,
+)
+from collector.tokens import TokenRefreshException  # noqa: F401 (re-exported)
+from collector.tokens import get_token_manager
 
 
 # Placeholder function for parsing raw titles
@@ -33,65 +42,52 @@ def parse_raw_title(title: str) -> dict:
 
 
 EBAY_API = "https://api.ebay.com/buy/browse/v1/item_summary/search"
-# Update HEADERS to dynamically fetch the token from .env
-HEADERS = {"Authorization": f"Bearer {os.getenv('EBAY_ACCESS_TOKEN')}"}
 
-# Add a delay to respect eBay's rate limits
-RATE_LIMIT_DELAY = float(os.getenv("EBAY_RATE_LIMIT_DELAY", 0.1))
+# The Browse API returns at most 200 items per page and only the first
+# 10,000 results of a search
+MAX_PAGE_SIZE = 200
+MAX_RESULT_WINDOW = 10000
+EBAY_PAGE_SIZE = min(int(os.getenv("EBAY_PAGE_SIZE", 50)), MAX_PAGE_SIZE)
+# Search pages fetched at once per query
+EBAY_PAGE_CONCURRENCY = int(os.getenv("EBAY_PAGE_CONCURRENCY", 4))
 
 
 class RateLimitException(Exception):
     """Custom exception for rate-limiting errors."""
 
 
-class TokenRefreshException(Exception):
-    """Custom exception for token refresh errors."""
-
-
 def refresh_ebay_token():
-    """Refresh the eBay OAuth access token."""
-    client_id = os.getenv("EBAY_APP_ID")
-    client_secret = os.getenv("EBAY_CLIENT_SECRET")
-    refresh_token = os.getenv("EBAY_OAUTH_REFRESH_TOKEN")
-
-    url = "https://api.ebay.com/identity/v1/oauth2/token"
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    data = {
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-        "scope": "https://api.ebay.com/oauth/api_scope/buy.*",
-    }
+    """Force a refresh of the eBay OAuth access token outside an event loop."""
+    manager = get_token_manager()
+    return asyncio.run(manager.refresh(force=True))
 
-    response = requests.post(
-        url, headers=headers, data=data, auth=(client_id, client_secret)
-    )
-    if response.status_code != 200:
-        print("Failed to refresh token. Response:", response.text)
-    response.raise_for_status()
-
-    new_access_token = response.json().get("access_token")
-    if new_access_token:
-        # Update the global HEADERS with the new token
-        HEADERS["Authorization"] = f"Bearer {new_access_token}"
-        print("Access token refreshed successfully.")
-    else:
-        raise TokenRefreshException("Failed to refresh eBay access token.")
 
-
-@retry(wait=wait_exponential(multiplier=1, max=60), stop=stop_after_attempt(5))
+# Requests wait for the shared rate limiter; a 429 pauses the endpoint for
+# every caller and is retried with jittered exponential back-off
+@retry(wait=wait_random_exponential(multiplier=1, max=60), stop=stop_after_attempt(5))
 async def _call(session, params):
+    limiter, tokens = get_rate_limiter(), get_token_manager()
+    token = None
     try:
-        async with session.get(EBAY_API, headers=HEADERS, params=params) as r:
+        token = await tokens.get_token(session)
+        await limiter.acquire_async(BROWSE_SEARCH)
+        headers = {"Authorization": f"Bearer {token}"}
+        async with session.get(EBAY_API, headers=headers, params=params) as r:
             if r.status == 429:
+                await limiter.block_async(BROWSE_SEARCH, retry_after_seconds(r.headers))
                 raise RateLimitException("rate-limited")
             r.raise_for_status()
             return await r.json()
     except aiohttp.ClientResponseError as e:
         if e.status == 401:  # Unauthorized
             print("Access token expired. Refreshing token...")
-            refresh_ebay_token()
+            # Concurrent 401s for the same token share one refresh
+            headers = {
+                "Authorization": f"Bearer {await tokens.refresh(session, token)}"
+            }
             # Retry the request with the new token
-            async with session.get(EBAY_API, headers=HEADERS, params=params) as r:
+            await limiter.acquire_async(BROWSE_SEARCH)
+            async with session.get(EBAY_API, headers=headers, params=params) as r:
                 r.raise_for_status()
                 return await r.json()
         else:
@@ -102,77 +98,193 @@ async def _call(session, params):
         raise
 
 
-async def fetch_cards(query: str, limit: int = 100):
+def _card_from_item(item):
+    """Standardized card dictionary for one Browse API item summary."""
+    parsed_data = parse_raw_title(item.get("title", ""))
+
+    card_dict = {
+        "player_name": parsed_data.get("player_name"),
+        "card_year": parsed_data.get("card_year"),
+        "card_set": parsed_data.get("set_name"),
+        "card_number": parsed_data.get("card_number"),
+        "attributes": parsed_data.get("attributes"),
+        "grade": parsed_data.get("grade"),
+        "grading_company": parsed_data.get("grading_company"),
+        "source": "eBay",
+        "source_item_id": item.get("itemId"),
+        "listing_price": float(item.get("price", {}).get("value", 0)),
+        "currency": item.get("price", {}).get("currency", "USD"),
+        "listing_date": item.get("itemCreationDate"),
+        "source_url": item.get("itemWebUrl"),
+    }
+
+    return {k: v if v is not None else "" for k, v in card_dict.items()}
+
+
+async def _fetch_page(session, semaphore, query, page_size, offset, sort=None):
+    """One search page's payload, or None if the page could not be read."""
+    params = dict(q=query, limit=page_size, offset=offset)
+    if sort:
+        params["sort"] = sort
+    async with semaphore:
+        try:
+            return await _call(session, params)
+        except Exception as e:
+            print(f"Error fetching cards for '{query}' at offset {offset}: {e}")
+            return None
+
+
+async def fetch_cards(
+    query: str,
+    limit: int = 100,
+    page_size: int = EBAY_PAGE_SIZE,
+    concurrency: int = EBAY_PAGE_CONCURRENCY,
+    session: ClientSession = None,
+    semaphore: asyncio.Semaphore = None,
+    sort: str = None,
+):
     """
     Fetch cards from eBay's API and return standardized card dictionaries.
 
+    Pages that fail are left out; use fetch_card_pages to find out whether
+    the result is complete.
+
     Args:
         query (str): The search query.
         limit (int): The maximum number of cards to fetch.
+        page_size (int): Items per page, at most MAX_PAGE_SIZE.
+        concurrency (int): The maximum number of pages in flight.
+        session (ClientSession): A session to reuse; one is opened if None.
+        semaphore (asyncio.Semaphore): Shared cap on requests in flight
+            across queries, used instead of `concurrency` when given.
+        sort (str): Browse API sort order, e.g. "newlyListed"; best match
+            when None.
 
     Returns:
         list: A list of standardized card dictionaries.
     """
-    items, offset = [], 0
-
-    async with ClientSession() as session:
-        while len(items) < limit:
-            try:
-                payload = await _call(
-                    session,
-                    dict(
-                        q=query,
-                        limit=50,
-                        offset=offset,
-                    ),
-                )
-                for item in payload.get("itemSummaries", []):
-                    parsed_data = parse_raw_title(item.get("title", ""))
-
-                    card_dict = {
-                        "player_name": parsed_data.get("player_name"),
-                        "card_year": parsed_data.get("card_year"),
-                        "card_set": parsed_data.get("set_name"),
-                        "card_number": parsed_data.get("card_number"),
-                        "attributes": parsed_data.get("attributes"),
-                        "grade": parsed_data.get("grade"),
-                        "grading_company": parsed_data.get("grading_company"),
-                        "source": "eBay",
-                        "source_item_id": item.get("itemId"),
-                        "listing_price": float(item.get("price", {}).get("value", 0)),
-                        "currency": item.get("price", {}).get("currency", "USD"),
-                        "listing_date": item.get("itemCreationDate"),
-                        "source_url": item.get("itemWebUrl"),
-                    }
-
-                    card_dict = {
-                        k: v if v is not None else "" for k, v in card_dict.items()
-                    }
-                    items.append(card_dict)
-
-                if "next" not in payload.get("href", ""):
-                    break
-                offset += 50
-                await asyncio.sleep(RATE_LIMIT_DELAY)
-            except RateLimitException:
-                print("Rate limit hit. Retrying after delay...")
-                await asyncio.sleep(60)  # Wait before retrying
-            except Exception as e:
-                print(f"Error fetching cards: {e}")
-                break
-
-    session = get_session()
+    cards, _ = await fetch_card_pages(
+        query, limit, page_size, concurrency, session, semaphore, sort
+    )
+    return cards
+
+
+async def fetch_card_pages(
+    query: str,
+    limit: int = 100,
+    page_size: int = EBAY_PAGE_SIZE,
+    concurrency: int = EBAY_PAGE_CONCURRENCY,
+    session: ClientSession = None,
+    semaphore: asyncio.Semaphore = None,
+    sort: str = None,
+):
+    """
+    fetch_cards, also reporting whether every page was read.
+
+    The first page reports the total number of matches; the remaining pages
+    up to `limit` are then fetched concurrently, at most `concurrency` at a
+    time. Items keep the API's order and are de-duplicated by itemId, since
+    listings can shift between pages while they are being read.
+
+    Returns:
+        tuple: (cards, complete), where complete is False if any page failed
+            after its retries, i.e. some matching listings may be missing.
+    """
+    if session is None:
+        async with ClientSession() as session:
+            return await fetch_card_pages(
+                query, limit, page_size, concurrency, session, semaphore, sort
+            )
+
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    semaphore = semaphore or asyncio.Semaphore(max(1, concurrency))
+
+    payload = await _fetch_page(session, semaphore, query, page_size, 0, sort)
+    if payload is None:
+        return [], False
+    pages = [payload]
+    total = payload.get("total")
+    if total is None:
+        # No total reported: only a "next" link says there is more
+        total = limit if payload.get("next") else 0
+    last_offset = min(total, limit, MAX_RESULT_WINDOW)
+    pages += await asyncio.gather(
+        *[
+            _fetch_page(session, semaphore, query, page_size, offset, sort)
+            for offset in range(page_size, last_offset, page_size)
+        ]
+    )
+
+    items, seen = [], set()
+    for page in pages:
+        for item in (page or {}).get("itemSummaries", []):
+            item_id = item.get("itemId")
+            if item_id is not None:
+                if item_id in seen:
+                    continue
+                seen.add(item_id)
+            items.append(_card_from_item(item))
+
+    # Callers store the listings (see async_bulk_upsert_active_listings), so
+    # no blocking database work happens inside the event loop here.
+    return items[:limit], all(page is not None for page in pages)
+
+
+def _listed_at(item):
+    """An item summary's creation time as an aware datetime, or None."""
     try:
-        for card in items[:limit]:
-            session.add(card)  # Add each card to the database session
-        session.commit()  # Commit the session after adding all cards
-    except Exception as e:
-        session.rollback()
-        print(f"Error saving cards to the database: {e}")
-    finally:
-        session.close()
+        listed_at = datetime.fromisoformat(item["itemCreationDate"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return listed_at if listed_at.tzinfo else listed_at.replace(tzinfo=timezone.utc)
 
-    return items[:limit]
+
+async def fetch_new_cards(
+    query: str,
+    since: datetime,
+    limit: int = 100,
+    page_size: int = EBAY_PAGE_SIZE,
+    session: ClientSession = None,
+    semaphore: asyncio.Semaphore = None,
+):
+    """
+    Fetch only the cards listed after `since`, newest first.
+
+    Pages are read in order with sort=newlyListed until one reaches an item
+    listed at or before `since`, so a query with no new listings costs one
+    request. Price changes on older listings are not seen; callers run an
+    occasional full fetch_cards sweep for those.
+
+    Returns:
+        tuple: (cards, complete), where complete is False if a page failed
+            before `since` was reached, i.e. some new listings may be missing.
+    """
+    if session is None:
+        async with ClientSession() as session:
+            return await fetch_new_cards(
+                query, since, limit, page_size, session, semaphore
+            )
+
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    semaphore = semaphore or asyncio.Semaphore(1)
+    items, seen = [], set()
+    for offset in range(0, min(limit, MAX_RESULT_WINDOW), page_size):
+        payload = await _fetch_page(
+            session, semaphore, query, page_size, offset, "newlyListed"
+        )
+        if payload is None:
+            return items, False
+        for item in payload.get("itemSummaries", []):
+            listed_at = _listed_at(item)
+            if listed_at is not None and listed_at <= since:
+                return items[:limit], True
+            if item.get("itemId") not in seen:
+                seen.add(item.get("itemId"))
+                items.append(_card_from_item(item))
+        if offset + page_size >= payload.get("total", 0):
+            return items[:limit], True
+    # Stopped at `limit` with new listings still left
+    return items[:limit], False
 
 
 async def fetch_item_details(session: ClientSession, item_id: str):
@@ -188,10 +300,18 @@ async def fetch_item_details(session: ClientSession, item_id: str):
     """
     # Corrected endpoint for fetching a single item by its ID using Browse API
     url = f"https://api.ebay.com/buy/browse/v1/item/{item_id}"
+    limiter = get_rate_limiter()
     try:
-        async with session.get(url, headers=HEADERS) as response:
+        headers = await get_token_manager().headers(session)
+        await limiter.acquire_async(BROWSE_ITEM)
+        async with session.get(url, headers=headers) as response:
             if response.status == 200:
                 return await response.json()
+            elif response.status == 429:
+                await limiter.block_async(
+                    BROWSE_ITEM, retry_after_seconds(response.headers)
+                )
+                response.raise_for_status()
             elif response.status == 404:
                 print(f"Item {item_id} not found.")
                 return None
@@ -215,11 +335,12 @@ def collect_ebay_listings():
     """
     API_ENDPOINT = "https://api.ebay.com/buy/browse/v1/item_summary/search"
     HEADERS = {
-        "Authorization": f"Bearer {os.getenv('EBAY_ACCESS_TOKEN')}",
+        **get_token_manager().headers_sync(),
         "Content-Type": "application/json",
     }
     PARAMS = {"q": "sports cards", "limit": 50}
 
+    get_rate_limiter().acquire(BROWSE_SEARCH)
     response = requests.get(API_ENDPOINT, headers=HEADERS, params=PARAMS)
     response.raise_for_status()
     data = response.json()
@@ -3,6 +3,7 @@ import os
 import requests
 
 from collector.adapters import parse_raw_title  # Import the parser
+from collector.rate_limit import FINDING, get_rate_limiter, retry_after_seconds
 
 
 def fetch_sold_items(config):
@@ -30,7 +31,11 @@ def fetch_sold_items(config):
         params["itemFilter(1).name"] = "EndTimeFrom"
         params["itemFilter(1).value"] = last_run
 
+    limiter = get_rate_limiter()
+    limiter.acquire(FINDING)
     resp = requests.get(url, headers=headers, params=params)
+    if resp.status_code == 429:
+        limiter.block(FINDING, retry_after_seconds(resp.headers))
     resp.raise_for_status()
     data = resp.json()
     # Navigate to items
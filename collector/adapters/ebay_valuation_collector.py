@@ -1,8 +1,9 @@
-import os
 from datetime import datetime
 
 import requests
 
+from collector.tokens import get_token_manager
+
 
 def fetch_valuations(config):
     """
@@ -16,7 +17,7 @@ def fetch_valuations(config):
         "https://api.ebay.com/valuation/endpoint"  # Replace with actual endpoint
     )
     HEADERS = {
-        "Authorization": f"Bearer {os.getenv('EBAY_ACCESS_TOKEN')}",
+        **get_token_manager().headers_sync(),
         "Content-Type": "application/json",
     }
     PARAMS = {"category": "sports cards", "limit": 50}
@@ -0,0 +1,266 @@
+# collector/backfill.py
+"""
+Bulk historical loader for sold listings.
+
+Streams CSV or JSONL sale files, parses titles with parse_raw_title,
+resolves card ids in bulk and loads each batch through PostgreSQL COPY
+into a temporary staging table, followed by one set-based merge into
+sold_listings; partitions for the batch's months are created first.
+Progress is checkpointed by byte offset after every batch, so an
+interrupted multi-GB load resumes where it stopped. A sale is stored once
+per source_item_id. New sales are added to the rolling comp windows and
+daily sketches in the same transaction. On SQLite, batches go through
+bulk_add_sold_listings instead of COPY.
+
+Each record needs a title ("raw_title" or "title"), "sale_price",
+"sale_date" and "source_item_id"; "source", "source_url", "currency",
+"grade" and "grading_company" are optional. Grade fields parsed from the
+title are used when the record has none. CSV records must fit on one line.
+"""
+import csv
+import json
+import logging
+import os
+from datetime import datetime
+
+from collector.adapters import parse_raw_title
+from database.comp_window import record_window_sales
+from database.models import (
+    bulk_add_sold_listings,
+    get_engine,
+    get_session,
+    invalidate_comps,
+    resolve_card_ids,
+)
+from database.partitions import ensure_sold_listing_partitions
+from database.sketches import record_daily_sketches
+
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", 10_000))
+DEFAULT_CHECKPOINT_PATH = "backfill_checkpoint.json"
+
+_STAGING_COLUMNS = (
+    "card_id",
+    "sale_price",
+    "currency",
+    "sale_date",
+    "source",
+    "source_item_id",
+    "source_url",
+    "grade",
+    "grading_company",
+)
+
+# Columns of merged rows that feed the comp windows
+_WINDOW_COLUMNS = ("card_id", "grade", "grading_company", "sale_price", "sale_date")
+
+_CREATE_STAGING_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS sold_listings_staging (
+    card_id INTEGER,
+    sale_price DOUBLE PRECISION,
+    currency VARCHAR,
+    sale_date TIMESTAMP,
+    source VARCHAR,
+    source_item_id VARCHAR,
+    source_url VARCHAR,
+    grade VARCHAR,
+    grading_company VARCHAR
+) ON COMMIT DELETE ROWS
+"""
+
+# An item already stored, or repeated in the batch, is the same sale even
+# when its sale_date differs, so duplicates are skipped by source_item_id
+_MERGE_SQL = f"""
+INSERT INTO sold_listings ({", ".join(_STAGING_COLUMNS)})
+SELECT DISTINCT ON (source_item_id) {", ".join(_STAGING_COLUMNS)}
+FROM sold_listings_staging staged
+WHERE NOT EXISTS (
+    SELECT 1 FROM sold_listings s WHERE s.source_item_id = staged.source_item_id
+)
+ORDER BY source_item_id, sale_date
+ON CONFLICT (source_item_id, sale_date) DO NOTHING
+RETURNING {", ".join(_WINDOW_COLUMNS)}
+"""
+
+
+def load_checkpoint(checkpoint_path):
+    if not os.path.exists(checkpoint_path):
+        return {}
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    # Write then rename, so a crash never leaves a half-written checkpoint
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def _detect_format(path):
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def iter_records(path, start_offset=0, file_format=None):
+    """
+    Yield (record, end_offset) pairs from a CSV or JSONL file, starting at
+    byte `start_offset`. end_offset is where the next record begins.
+    Lines that cannot be decoded yield None as the record.
+    """
+    file_format = file_format or _detect_format(path)
+    with open(path, "rb") as f:
+        header = None
+        if file_format == "csv":
+            header = next(csv.reader([f.readline().decode("utf-8-sig")]))
+        if start_offset > f.tell():
+            f.seek(start_offset)
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            text = line.decode("utf-8", errors="replace").strip()
+            if not text:
+                continue
+            try:
+                if file_format == "csv":
+                    record = dict(zip(header, next(csv.reader([text]))))
+                else:
+                    record = json.loads(text)
+            except (csv.Error, json.JSONDecodeError):
+                record = None
+            yield record, f.tell()
+
+
+def to_sold_listing(record, default_source):
+    """
+    Map a raw sale record to a sold listing dict with parsed card fields.
+    Returns None when the record cannot be loaded.
+    """
+    if not isinstance(record, dict):
+        return None
+    raw_title = record.get("raw_title") or record.get("title")
+    try:
+        sale_price = float(record["sale_price"])
+        sale_date = datetime.fromisoformat(str(record["sale_date"]))
+        source_item_id = str(record["source_item_id"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not raw_title or not source_item_id:
+        return None
+    parsed = parse_raw_title(raw_title)
+    return {
+        "raw_title": raw_title,
+        "player_name": parsed.get("player_name"),
+        "card_year": parsed.get("card_year"),
+        "card_set": parsed.get("set_name"),
+        "card_number": parsed.get("card_number"),
+        "attributes": parsed.get("attributes"),
+        "grade": record.get("grade") or parsed.get("grade"),
+        "grading_company": record.get("grading_company")
+        or parsed.get("grading_company"),
+        "sale_price": sale_price,
+        "currency": record.get("currency") or "USD",
+        "sale_date": sale_date,
+        "source": record.get("source") or default_source,
+        "source_item_id": source_item_id,
+        "source_url": record.get("source_url"),
+    }
+
+
+def _copy_batch(conn, sales):
+    """COPY a batch into staging and merge it. Returns rows inserted."""
+    card_ids = resolve_card_ids(sales)
+    ensure_sold_listing_partitions(days={sale["sale_date"].date() for sale in sales})
+    with conn.begin():
+        with conn.connection.dbapi_connection.cursor() as cursor:
+            cursor.execute(_CREATE_STAGING_SQL)
+            with cursor.copy(
+                f"COPY sold_listings_staging ({', '.join(_STAGING_COLUMNS)}) "
+                "FROM STDIN"
+            ) as copy:
+                for sale, card_id in zip(sales, card_ids):
+                    copy.write_row(
+                        (
+                            card_id,
+                            *[sale[c] for c in _STAGING_COLUMNS if c != "card_id"],
+                        )
+                    )
+            cursor.execute(_MERGE_SQL)
+            new_sales = [dict(zip(_WINDOW_COLUMNS, row)) for row in cursor]
+        record_window_sales(conn, new_sales)
+        record_daily_sketches(conn, new_sales)
+    if new_sales:
+        invalidate_comps(
+            (sale["card_id"], sale["grade"], sale["grading_company"])
+            for sale in new_sales
+        )
+    return len(new_sales)
+
+
+def _insert_batch(sales):
+    """Merge a batch without COPY. Returns rows inserted."""
+    card_ids = resolve_card_ids(sales)
+    rows = [{**sale, "card_id": card_id} for sale, card_id in zip(sales, card_ids)]
+    session = get_session()
+    try:
+        return bulk_add_sold_listings(session, rows)
+    finally:
+        session.close()
+
+
+def backfill_file(
+    path,
+    checkpoint_path=DEFAULT_CHECKPOINT_PATH,
+    batch_size=BACKFILL_BATCH_SIZE,
+    source="backfill",
+    file_format=None,
+):
+    """
+    Load one sale file into sold_listings, resuming from its checkpoint.
+    Returns a dict with "read", "inserted" and "skipped" counts.
+    """
+    key = os.path.abspath(path)
+    checkpoint = load_checkpoint(checkpoint_path)
+    state = checkpoint.get(key, {"offset": 0, "done": False})
+    stats = {"read": 0, "inserted": 0, "skipped": 0}
+    if state["done"]:
+        logging.info(f"Backfill of {path} already complete; skipping.")
+        return stats
+
+    engine = get_engine()
+    use_copy = engine.dialect.name == "postgresql"
+    conn = engine.connect() if use_copy else None
+    try:
+
+        def flush(batch, offset):
+            if batch and use_copy:
+                stats["inserted"] += _copy_batch(conn, batch)
+            elif batch:
+                stats["inserted"] += _insert_batch(batch)
+            state["offset"] = offset
+            checkpoint[key] = state
+            save_checkpoint(checkpoint_path, checkpoint)
+
+        batch = []
+        offset = state["offset"]
+        for record, offset in iter_records(path, state["offset"], file_format):
+            stats["read"] += 1
+            sale = to_sold_listing(record, source)
+            if sale is None:
+                stats["skipped"] += 1
+            else:
+                batch.append(sale)
+            if len(batch) >= batch_size:
+                flush(batch, offset)
+                batch = []
+        state["done"] = True
+        flush(batch, offset)
+    finally:
+        if conn is not None:
+            conn.close()
+
+    logging.info(
+        f"Backfilled {path}: {stats['read']} read, {stats['inserted']} inserted, "
+        f"{stats['skipped']} skipped."
+    )
+    return stats
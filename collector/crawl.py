@@ -0,0 +1,164 @@
+# collector/crawl.py
+"""
+Concurrent crawl of many saved queries over one pooled HTTP session.
+
+All queries share one long-lived aiohttp ClientSession, so TCP and TLS
+connections to api.ebay.com are set up once and kept alive between pages
+and queries. Requests in flight across every query are capped by one
+semaphore sized to the shared rate limiter's burst: more concurrency than
+the bucket can admit at once would only queue inside the limiter while
+holding connections. Each query's listings are stored as soon as they
+arrive, so database writes overlap the other queries' requests.
+
+Crawls are deltas: each query keeps a watermark in scrape_tracker (the
+newest listing time it has stored) and fetches newest-first only until it
+reaches that time, so a query with nothing new costs one request. Since
+a delta never revisits older listings, a query gets a full sweep of every
+page when it has no watermark yet or its last sweep is older than
+FULL_SWEEP_INTERVAL; that sweep picks up price changes.
+"""
+import asyncio
+import math
+import os
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+from collector.adapters.ebay import _listed_at, fetch_card_pages, fetch_new_cards
+from collector.rate_limit import BROWSE_SEARCH, DEFAULT_RATES
+from database.models import (
+    async_bulk_upsert_active_listings,
+    async_resolve_card_ids,
+    get_async_session,
+    get_last_run_timestamp,
+    update_last_run_timestamp,
+)
+
+# Requests in flight across all queries; defaults to the search bucket size
+CRAWL_CONCURRENCY = int(
+    os.getenv("CRAWL_CONCURRENCY", math.ceil(DEFAULT_RATES[BROWSE_SEARCH][1]))
+)
+# Seconds an idle keep-alive connection and a DNS answer are reused
+KEEPALIVE_TIMEOUT = float(os.getenv("CRAWL_KEEPALIVE_TIMEOUT", 60))
+DNS_CACHE_TTL = int(os.getenv("CRAWL_DNS_CACHE_TTL", 300))
+REQUEST_TIMEOUT = float(os.getenv("CRAWL_REQUEST_TIMEOUT", 30))
+FULL_SWEEP_INTERVAL = timedelta(hours=float(os.getenv("CRAWL_FULL_SWEEP_HOURS", 24)))
+# Deltas re-read this much before the watermark, for listings that show up
+# in search a little after their creation time
+WATERMARK_OVERLAP = timedelta(minutes=float(os.getenv("CRAWL_WATERMARK_OVERLAP", 5)))
+# scrape_tracker keys; one row per query and kind
+TRACKER_SITE = "eBay"
+WATERMARK_TYPE = "newly_listed:{query}"
+FULL_SWEEP_TYPE = "full_sweep:{query}"
+
+
+def crawl_session(concurrency=CRAWL_CONCURRENCY):
+    """A ClientSession with a keep-alive, DNS-caching connection pool."""
+    connector = TCPConnector(
+        limit=concurrency,
+        limit_per_host=concurrency,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        enable_cleanup_closed=True,
+    )
+    return ClientSession(
+        connector=connector, timeout=ClientTimeout(total=REQUEST_TIMEOUT)
+    )
+
+
+async def store_listings(listings):
+    """Resolve card ids and upsert listings; returns the upsert counts."""
+    card_ids = await async_resolve_card_ids(listings)
+    rows = [
+        {**listing, "card_id": card_id} for listing, card_id in zip(listings, card_ids)
+    ]
+    async with get_async_session() as session:
+        return await async_bulk_upsert_active_listings(session, rows)
+
+
+def _parse_timestamp(value):
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def load_crawl_state(query):
+    """(watermark, last full sweep) for one query, each a datetime or None."""
+    return (
+        _parse_timestamp(
+            get_last_run_timestamp(TRACKER_SITE, WATERMARK_TYPE.format(query=query))
+        ),
+        _parse_timestamp(
+            get_last_run_timestamp(TRACKER_SITE, FULL_SWEEP_TYPE.format(query=query))
+        ),
+    )
+
+
+def save_crawl_state(query, watermark, full_sweep_at=None):
+    """Record a query's new watermark and, after a sweep, its time."""
+    if watermark is not None:
+        update_last_run_timestamp(
+            TRACKER_SITE, WATERMARK_TYPE.format(query=query), watermark.isoformat()
+        )
+    if full_sweep_at is not None:
+        update_last_run_timestamp(
+            TRACKER_SITE, FULL_SWEEP_TYPE.format(query=query), full_sweep_at.isoformat()
+        )
+
+
+async def crawl_query(query, session, semaphore, limit=100, full=False):
+    """
+    Crawl one query, as a delta from its watermark or as a full sweep, and
+    store what it returns. Returns the upsert counts plus "full_sweep".
+    """
+    started_at = datetime.now(timezone.utc)
+    watermark, last_sweep = await asyncio.to_thread(load_crawl_state, query)
+    full = (
+        full
+        or watermark is None
+        or last_sweep is None
+        or started_at - last_sweep >= FULL_SWEEP_INTERVAL
+    )
+    if full:
+        # A sweep with a failed page does not count; the next crawl retries it
+        listings, complete = await fetch_card_pages(
+            query, limit, session=session, semaphore=semaphore, sort="newlyListed"
+        )
+    else:
+        listings, complete = await fetch_new_cards(
+            query,
+            watermark - WATERMARK_OVERLAP,
+            limit,
+            session=session,
+            semaphore=semaphore,
+        )
+    counts = {"inserted": 0, "updated": 0}
+    if listings:
+        counts = await store_listings(listings)
+    if complete:
+        # The newest listing stored; the watermark never moves back
+        listed = [_listed_at({"itemCreationDate": c["listing_date"]}) for c in listings]
+        candidates = [t for t in listed + [watermark] if t is not None]
+        newest = max(candidates) if candidates else None
+        await asyncio.to_thread(
+            save_crawl_state, query, newest, started_at if full else None
+        )
+    return {**counts, "full_sweep": full}
+
+
+async def crawl_queries(queries, limit=100, concurrency=CRAWL_CONCURRENCY, full=False):
+    """
+    Crawl every query concurrently on one pooled session; `full` forces a
+    full sweep of each. Returns {query: crawl_query's result, or the
+    exception that query raised}.
+    """
+    queries = list(dict.fromkeys(queries))
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async with crawl_session(concurrency) as session:
+        results = await asyncio.gather(
+            *(crawl_query(query, session, semaphore, limit, full) for query in queries),
+            return_exceptions=True,
+        )
+    return dict(zip(queries, results))
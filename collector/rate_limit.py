@@ -0,0 +1,199 @@
+# collector/rate_limit.py
+"""
+Token-bucket rate limiting shared by every eBay call.
+
+Each endpoint has its own bucket of `burst` tokens that refills at `rate`
+tokens per second; a call takes one token or waits until one is due. The
+buckets live in a small SQLite file (EBAY_RATE_LIMIT_PATH), updated under
+BEGIN IMMEDIATE, so concurrent queries, worker processes and cron jobs on
+one host all draw from the same budget. A 429 blocks the endpoint's bucket
+for every caller until the server's Retry-After has passed, and waits are
+jittered so callers do not wake up in lockstep.
+
+    limiter = get_rate_limiter()
+    await limiter.acquire_async(BROWSE_SEARCH)   # or limiter.acquire(...)
+"""
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+# Endpoint names; each gets its own bucket
+BROWSE_SEARCH = "browse_search"
+BROWSE_ITEM = "browse_item"
+FINDING = "finding"
+OAUTH = "oauth"
+
+# Calls per second and bucket size for the eBay APIs. These only pace the
+# calls: eBay's quotas are daily call counts per application (5,000 Browse
+# API calls a day by default), so set EBAY_RATE_PER_SECOND to spread the
+# daily budget, e.g. 0.05 for 5,000 calls a day. The OAuth endpoint is only
+# hit on token refresh.
+EBAY_RATE_PER_SECOND = float(os.getenv("EBAY_RATE_PER_SECOND", 10))
+EBAY_RATE_BURST = float(os.getenv("EBAY_RATE_BURST", EBAY_RATE_PER_SECOND))
+DEFAULT_RATES = {
+    BROWSE_SEARCH: (EBAY_RATE_PER_SECOND, EBAY_RATE_BURST),
+    BROWSE_ITEM: (EBAY_RATE_PER_SECOND, EBAY_RATE_BURST),
+    FINDING: (EBAY_RATE_PER_SECOND, EBAY_RATE_BURST),
+    OAUTH: (1.0, 2.0),
+}
+# Back-off after a 429 without a usable Retry-After header
+DEFAULT_RETRY_AFTER = 60.0
+RATE_LIMIT_PATH = os.getenv(
+    "EBAY_RATE_LIMIT_PATH",
+    os.path.join(tempfile.gettempdir(), "card_deals_rate_limit.db"),
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0
+)
+"""
+
+
+def _jitter(wait):
+    return wait + random.uniform(0, wait * 0.1) if wait > 0 else 0.0
+
+
+class TokenBucketLimiter:
+    """
+    Per-endpoint token buckets. With a `path` the buckets are kept in a
+    SQLite file shared by every process that opens it; without one (or if
+    the file cannot be used) they are local to this process.
+    """
+
+    def __init__(self, path=RATE_LIMIT_PATH, rates=None):
+        self.path = path
+        self.rates = dict(DEFAULT_RATES if rates is None else rates)
+        self._local = threading.local()
+        self._memory = {}
+        self._memory_lock = threading.Lock()
+
+    def _connection(self):
+        # One connection per thread and process; never reuse one across fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute(_SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _update(self, name, change):
+        """
+        Atomically replace one bucket's (tokens, updated, blocked_until)
+        state with change(state_or_None, now) -> (new_state, result) and
+        return the result.
+        """
+        now = time.time()
+        if self.path:
+            try:
+                conn = self._connection()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = conn.execute(
+                        "SELECT tokens, updated, blocked_until FROM buckets "
+                        "WHERE name = ?",
+                        (name,),
+                    ).fetchone()
+                    state, result = change(row, now)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO buckets "
+                        "(name, tokens, updated, blocked_until) VALUES (?, ?, ?, ?)",
+                        (name, *state),
+                    )
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                return result
+            except sqlite3.Error as e:
+                logging.warning(
+                    f"Rate limit store {self.path} unavailable ({e}); "
+                    "limiting within this process only"
+                )
+                self.path = None
+        with self._memory_lock:
+            state, result = change(self._memory.get(name), now)
+            self._memory[name] = state
+            return result
+
+    def try_acquire(self, name):
+        """
+        Take a token from `name`'s bucket. Returns 0 when one was taken,
+        otherwise the seconds to wait before trying again.
+        """
+        rate, burst = self.rates[name]
+
+        def take(row, now):
+            tokens, updated, blocked_until = row or (burst, now, 0.0)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            if now < blocked_until:
+                return (tokens, now, blocked_until), blocked_until - now
+            if tokens >= 1:
+                return (tokens - 1, now, blocked_until), 0.0
+            return (tokens, now, blocked_until), (1 - tokens) / rate
+
+        return self._update(name, take)
+
+    def acquire(self, name):
+        """Block until a token for `name` is available."""
+        while (wait := self.try_acquire(name)) > 0:
+            time.sleep(_jitter(wait))
+
+    async def try_acquire_async(self, name):
+        """try_acquire, with the shared store's locking off the event loop."""
+        if self.path:
+            return await asyncio.to_thread(self.try_acquire, name)
+        return self.try_acquire(name)
+
+    async def acquire_async(self, name):
+        """Wait, without blocking the event loop, for a token for `name`."""
+        while (wait := await self.try_acquire_async(name)) > 0:
+            await asyncio.sleep(_jitter(wait))
+
+    def block(self, name, retry_after=None):
+        """
+        Stop every caller from using `name` for `retry_after` seconds (after
+        a 429) and empty its bucket so calls resume at the refill rate.
+        """
+        delay = DEFAULT_RETRY_AFTER if retry_after is None else retry_after
+
+        def drain(row, now):
+            blocked_until = row[2] if row else 0.0
+            return (0.0, now, max(blocked_until, now + delay)), None
+
+        logging.warning(f"{name} rate-limited; pausing for {delay:.0f}s")
+        self._update(name, drain)
+
+    async def block_async(self, name, retry_after=None):
+        """block, with the shared store's locking off the event loop."""
+        await asyncio.to_thread(self.block, name, retry_after)
+
+
+def retry_after_seconds(headers):
+    """The Retry-After header in seconds, or None if absent or unparsable."""
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """The process-wide limiter over RATE_LIMIT_PATH."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = TokenBucketLimiter()
+    return _limiter
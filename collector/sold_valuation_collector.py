@@ -7,11 +7,12 @@ import os
 import pytz
 
 from database.models import (
-    add_card_definition,
-    add_sold_listing_to_db,
-    add_valuation,
+    BULK_CHUNK_SIZE,
+    bulk_add_sold_listings,
+    bulk_add_valuations,
     get_last_run_timestamp,
     get_session,
+    resolve_card_ids,
     update_last_run_timestamp,
 )
 
@@ -19,6 +20,8 @@ CONFIG_FILE_PATH = (
     "sites_config.json"  # Assuming same config file, potentially with new sections/keys
 )
 LOG_FILE_PATH = "sold_valuation_collector_log.txt"
+# Rows per INSERT statement when writing sold items and valuations
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", BULK_CHUNK_SIZE))
 
 # Configure logging
 logging.basicConfig(
@@ -43,17 +46,21 @@ def load_sites_config():
         return []
 
 
-def process_sold_item_data(sold_item_data, site_name_from_config):
+def build_sold_listing_row(sold_item_data, site_name_from_config, card_id):
+    """
+    Map a sold item and its resolved card_id to a sold_listings row.
+    Returns None when the card could not be defined.
+    """
     logging.debug(
         f"Processing SOLD item: {sold_item_data.get('raw_title', 'N/A')} from {site_name_from_config}"
     )
-    card_id = add_card_definition(sold_item_data)
     if card_id is None:
         logging.warning(
             f"Could not define card for SOLD item: {sold_item_data.get('raw_title')}. Skipping DB add."
         )
-        return False
-    sale_data_for_model = {
+        return None
+    return {
+        "card_id": card_id,
         "sale_price": sold_item_data["sale_price"],
         "currency": sold_item_data.get("currency", "USD"),
         "sale_date": sold_item_data["sale_date"],
@@ -63,35 +70,34 @@ def process_sold_item_data(sold_item_data, site_name_from_config):
         "grade": sold_item_data.get("grade"),
         "grading_company": sold_item_data.get("grading_company"),
     }
-    return add_sold_listing_to_db(get_session(), card_id, sale_data_for_model)
 
 
-def process_valuation_entry_data(valuation_data, site_name_from_config):
-    logging.debug(
-        f"Processing VALUATION entry: {
-            valuation_data.get(
-                'raw_card_name_from_source',
-                'N/A')} from {site_name_from_config}"
-    )
-    card_id = add_card_definition(valuation_data)
+def build_valuation_row(valuation_data, site_name_from_config, card_id):
+    """
+    Map a valuation entry and its resolved card_id to a card_valuations row.
+    Returns None when the card could not be defined.
+    """
+    raw_name = valuation_data.get("raw_card_name_from_source", "N/A")
+    logging.debug(f"Processing VALUATION entry: {raw_name} from {site_name_from_config}")
     if card_id is None:
         logging.warning(
-            f"Could not define card for VALUATION entry: {
-                valuation_data.get('raw_card_name_from_source')}. Skipping DB add."
+            f"Could not define card for VALUATION entry: {raw_name}. Skipping DB add."
         )
-        return False
-    return add_valuation(
-        card_id=card_id,
-        estimated_value=valuation_data["estimated_value"],
-        currency=valuation_data.get("currency", "USD"),
-        valuation_date=valuation_data["valuation_date"],
-        source=site_name_from_config,
-        valuation_type=valuation_data.get("valuation_type"),
-        source_url_to_valuation_info=valuation_data.get("source_url_to_valuation_info"),
-        grade=valuation_data.get("grade"),
-        grading_company=valuation_data.get("grading_company"),
-        raw_card_name_from_source=valuation_data.get("raw_card_name_from_source"),
-    )
+        return None
+    return {
+        "card_id": card_id,
+        "estimated_value": valuation_data["estimated_value"],
+        "currency": valuation_data.get("currency", "USD"),
+        "valuation_date": valuation_data["valuation_date"],
+        "source": site_name_from_config,
+        "valuation_type": valuation_data.get("valuation_type"),
+        "source_url_to_valuation_info": valuation_data.get(
+            "source_url_to_valuation_info"
+        ),
+        "grade": valuation_data.get("grade"),
+        "grading_company": valuation_data.get("grading_company"),
+        "raw_card_name_from_source": valuation_data.get("raw_card_name_from_source"),
+    }
 
 
 def process_site(site_config):
@@ -102,9 +108,16 @@ def process_site(site_config):
             function_name = collector["function"]
             module = importlib.import_module(module_name)
             collect_function = getattr(module, function_name)
-            for sale in collect_function():
-                card_id = add_card_definition(sale)
-                add_sold_listing_to_db(get_session(), card_id, sale)
+            sales = list(collect_function())
+            rows = [
+                {**sale, "card_id": card_id}
+                for sale, card_id in zip(sales, resolve_card_ids(sales))
+            ]
+            session = get_session()
+            try:
+                bulk_add_sold_listings(session, rows, INGEST_CHUNK_SIZE)
+            finally:
+                session.close()
 
 
 def collect_all_sold_and_valuations():
@@ -214,7 +227,7 @@ def process_fetched_data(
 
 def process_sold_items(site_name, sold_items_from_site):
     logging.info(f"Received {len(sold_items_from_site)} SOLD items from {site_name}")
-    new_sold_added_count = 0
+    valid_items = []
     for item_data in sold_items_from_site:
         if not all(
             k in item_data
@@ -230,16 +243,33 @@ def process_sold_items(site_name, sold_items_from_site):
                 f"Skipping SOLD item from {site_name} due to missing essential fields: {item_data.get('source_item_id', 'N/A')}"
             )
             continue
-        if process_sold_item_data(item_data, site_name):
-            new_sold_added_count += 1
-    logging.info(f"{new_sold_added_count} new SOLD items added to DB from {site_name}.")
+        valid_items.append(item_data)
+
+    rows = []
+    for item_data, card_id in zip(valid_items, resolve_card_ids(valid_items)):
+        row = build_sold_listing_row(item_data, site_name, card_id)
+        if row is not None:
+            rows.append(row)
+
+    session = get_session()
+    try:
+        new_sold_added_count = bulk_add_sold_listings(
+            session, rows, INGEST_CHUNK_SIZE
+        )
+    finally:
+        session.close()
+    logging.info(
+        f"{new_sold_added_count} new SOLD items added to DB from {site_name} "
+        f"({len(rows) - new_sold_added_count} already stored)."
+    )
+    return True
 
 
 def process_valuation_entries(site_name, valuation_entries_from_site):
     logging.info(
         f"Received {len(valuation_entries_from_site)} VALUATION entries from {site_name}"
     )
-    new_valuations_added_count = 0
+    valid_entries = []
     for val_data in valuation_entries_from_site:
         if not all(
             k in val_data
@@ -253,11 +283,24 @@ def process_valuation_entries(site_name, valuation_entries_from_site):
                 f"Skipping VALUATION entry from {site_name} due to missing essential fields: {val_data.get('raw_card_name_from_source', 'N/A')}"
             )
             continue
-        if process_valuation_entry_data(val_data, site_name):
-            new_valuations_added_count += 1
+        valid_entries.append(val_data)
+
+    rows = []
+    for val_data, card_id in zip(valid_entries, resolve_card_ids(valid_entries)):
+        row = build_valuation_row(val_data, site_name, card_id)
+        if row is not None:
+            rows.append(row)
+
+    session = get_session()
+    try:
+        counts = bulk_add_valuations(session, rows, INGEST_CHUNK_SIZE)
+    finally:
+        session.close()
     logging.info(
-        f"{new_valuations_added_count} new VALUATION entries added to DB from {site_name}."
+        f"{counts['new']} new VALUATION entries added to DB from {site_name} "
+        f"({counts['duplicate']} duplicates skipped)."
     )
+    return True
 
 
 def log_and_notify_config_error(site_name, data_type_to_collect):
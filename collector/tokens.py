@@ -0,0 +1,175 @@
+# collector/tokens.py
+"""
+eBay OAuth access tokens for every adapter.
+
+The token and its expiry are cached in memory and in a small JSON file
+(EBAY_TOKEN_PATH) shared by all processes on the host, so a token refreshed
+by one crawl is picked up by the others. A token is refreshed shortly
+before it expires (REFRESH_MARGIN), and refreshes are single-flight: when
+many requests see a 401 at once, the first refreshes and the rest wait for
+it and reuse the new token. Before refreshing, the shared file is re-read
+in case another process already did.
+
+With no token cached yet, EBAY_ACCESS_TOKEN from the environment is used
+until it is rejected.
+
+    manager = get_token_manager()
+    headers = await manager.headers(session)
+    ...on 401: await manager.refresh(session, stale_token=token)
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import weakref
+
+import aiohttp
+
+from collector.rate_limit import OAUTH, get_rate_limiter
+
+OAUTH_URL = "https://api.ebay.com/identity/v1/oauth2/token"
+OAUTH_SCOPES = (
+    "https://api.ebay.com/oauth/api_scope "
+    "https://api.ebay.com/oauth/api_scope/buy.marketplace.insight "
+    "https://api.ebay.com/oauth/api_scope/buy.item.summary "
+    "https://api.ebay.com/oauth/api_scope/buy.item.bulk"
+)
+# Refresh this many seconds before the token expires
+REFRESH_MARGIN = float(os.getenv("EBAY_TOKEN_REFRESH_MARGIN", 300))
+TOKEN_PATH = os.getenv(
+    "EBAY_TOKEN_PATH", os.path.join(tempfile.gettempdir(), "card_deals_ebay_token.json")
+)
+
+
+class TokenRefreshException(Exception):
+    """Custom exception for token refresh errors."""
+
+
+class TokenManager:
+    """Cached, proactively refreshed eBay access token."""
+
+    def __init__(self, path=TOKEN_PATH, url=OAUTH_URL):
+        self.path = path
+        self.url = url
+        self.token = None
+        self.expires_at = None  # epoch seconds; None when unknown
+        self._locks = weakref.WeakKeyDictionary()  # one asyncio.Lock per loop
+        self._thread_lock = threading.Lock()
+
+    def _fresh(self):
+        return self.token is not None and (
+            self.expires_at is None or time.time() < self.expires_at - REFRESH_MARGIN
+        )
+
+    def _load(self):
+        """Adopt the shared store's token if it is fresher than ours."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+        token, expires_at = stored.get("access_token"), stored.get("expires_at")
+        if token and token != self.token:
+            if expires_at is None or time.time() < expires_at - REFRESH_MARGIN:
+                self.token, self.expires_at = token, expires_at
+
+    def save(self, token, expires_in=None):
+        """Cache `token` here and in the shared store."""
+        self.token = token
+        self.expires_at = time.time() + expires_in if expires_in else None
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            # The token is a credential: readable by this user only
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, "w", encoding="utf-8") as f:
+                json.dump({"access_token": token, "expires_at": self.expires_at}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"Could not write eBay token store {self.path}: {e}")
+
+    def _lock(self):
+        loop = asyncio.get_running_loop()
+        with self._thread_lock:
+            lock = self._locks.get(loop)
+            if lock is None:
+                lock = self._locks[loop] = asyncio.Lock()
+        return lock
+
+    async def get_token(self, session=None):
+        """A valid access token, refreshing it first if it is about to expire."""
+        if self._fresh():
+            return self.token
+        self._load()
+        if self.token is None:
+            self.token = os.getenv("EBAY_ACCESS_TOKEN") or None
+        if self._fresh():
+            return self.token
+        return await self.refresh(session, stale_token=self.token)
+
+    async def headers(self, session=None):
+        """Authorization headers for an eBay API request."""
+        return {"Authorization": f"Bearer {await self.get_token(session)}"}
+
+    async def refresh(self, session=None, stale_token=None, force=False):
+        """
+        Replace `stale_token` with a new token. Callers that pass the same
+        stale token while a refresh is running get its result instead of
+        refreshing again. With `force`, the token endpoint is always called.
+        """
+        async with self._lock():
+            if not force:
+                self._load()
+                if self.token != stale_token and self._fresh():
+                    return self.token
+            if session is None:
+                async with aiohttp.ClientSession() as own_session:
+                    return await self._request_token(own_session)
+            return await self._request_token(session)
+
+    async def _request_token(self, session):
+        refresh_token = os.getenv("EBAY_OAUTH_REFRESH_TOKEN")
+        if not refresh_token:
+            raise TokenRefreshException("EBAY_OAUTH_REFRESH_TOKEN is not set.")
+        auth = aiohttp.BasicAuth(
+            os.getenv("EBAY_APP_ID") or "",
+            os.getenv("EBAY_CERT_ID") or os.getenv("EBAY_CLIENT_SECRET") or "",
+        )
+        data = {
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "scope": OAUTH_SCOPES,
+        }
+        await get_rate_limiter().acquire_async(OAUTH)
+        async with session.post(self.url, data=data, auth=auth) as response:
+            if response.status != 200:
+                print("Failed to refresh token. Response:", await response.text())
+            response.raise_for_status()
+            payload = await response.json()
+        if not payload.get("access_token"):
+            raise TokenRefreshException("Failed to refresh eBay access token.")
+        self.save(payload["access_token"], payload.get("expires_in"))
+        print("Access token refreshed successfully.")
+        return self.token
+
+    def headers_sync(self):
+        """headers() for synchronous adapters; must not run inside a loop."""
+        if self._fresh():
+            return {"Authorization": f"Bearer {self.token}"}
+        return asyncio.run(self.headers())
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_token_manager():
+    """The process-wide token manager over TOKEN_PATH."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = TokenManager()
+    return _manager
@@ -1,4 +1,3 @@
-import asyncio
 import json
 import os
 import re
@@ -10,20 +9,17 @@ from sqlalchemy import text
 
 # --- Import your existing functions ---
 # Note: Adjust imports based on your project structure and async needs
-from collector.adapters.ebay import fetch_cards
+from collector.adapters.ebay import fetch_card_pages
+from collector.crawl import crawl_queries
+from collector.tokens import get_token_manager
 from database.models import SoldListing  # Added SoldListing import
 from database.models import (
     ActiveListing,
     Card,
-    add_active_listing_to_db,
-    add_card_definition,
     get_session,
+    run_async,
 )
-
-
-# --- Helper to run async functions in Streamlit ---
-def run_async(func):
-    return asyncio.run(func)
+from database.sketches import TDigest, read_window_sketches
 
 
 # --- Simple NLP ---
@@ -76,29 +72,23 @@ def scan_tab():
 
 if st.button("Run Scan for Saved Queries (Example)"):
     with st.spinner("Scanning saved queries..."):
-        session = get_session()
+        saved_queries = [
+            "PSA 10 Griffey UD 1989",
+            "PSA 9 Jordan Rookie",
+        ]  # Example saved queries
         try:
-            saved_queries = [
-                "PSA 10 Griffey UD 1989",
-                "PSA 9 Jordan Rookie",
-            ]  # Example saved queries
-            for query in saved_queries:
-                st.write(f"Fetching for: {query}")
-                listings = run_async(fetch_cards(query))  # Use run_async
-                for listing_data in listings:  # Renamed to avoid conflict
-                    card_id = add_card_definition(
-                        listing_data
-                    )  # add_card_definition manages its own session
-                    add_active_listing_to_db(
-                        session, card_id, listing_data
-                    )  # Pass existing session
-            session.commit()  # Commit once after processing all queries
+            results = run_async(crawl_queries(saved_queries))
+            for query, result in results.items():
+                if isinstance(result, Exception):
+                    st.error(f"Error scanning '{query}': {result}")
+                else:
+                    st.write(
+                        f"{query}: {result['inserted']} new, "
+                        f"{result['updated']} updated listings."
+                    )
             st.success("Scan complete for saved queries.")
         except Exception as e:
-            session.rollback()
             st.error(f"Error during scan: {e}")
-        finally:
-            session.close()
 
 
 def deals_tab():
@@ -156,11 +146,13 @@ with tabs[0]:
     limit = st.slider("Limit", min_value=1, max_value=100, value=10)
     if st.button("Run Scan"):
         with st.spinner("Scanning..."):
-            # Assuming fetch_cards returns data that can be directly displayed
+            # Assuming fetch_card_pages returns data that can be directly displayed
             # and that database saving happens separately or is triggered here.
             # For now, just fetching and displaying.
-            results = run_async(fetch_cards(query, limit=limit))  # Pass limit
+            results, complete = run_async(fetch_card_pages(query, limit=limit))
             st.success(f"Found {len(results)} listings.")
+            if not complete:
+                st.warning("Some result pages could not be fetched.")
             st.dataframe(pd.DataFrame(results))
 
 # --- Deals Tab ---
@@ -198,6 +190,7 @@ with tabs[1]:
                     "Source Item ID": listing.source_item_id,
                     "URL": listing.source_url,
                     "Last Seen": listing.last_seen_at,
+                    "Analyzed At": listing.analyzed_at,
                 }
             )
         df = pd.DataFrame(deals_data)
@@ -391,6 +384,34 @@ with tabs[3]:
             )
             grade_options = sorted([g[0] for g in grades if g[0]])
             grade = st.selectbox("Grade", grade_options)
+            # Any window's comps come from merging the daily sketches
+            window_days = st.slider(
+                "Comp Window (days)",
+                min_value=7,
+                max_value=180,
+                value=int(float(os.getenv("HISTORICAL_DAYS", 90))),
+            )
+            companies = (
+                session.query(SoldListing.grading_company)
+                .filter(SoldListing.card_id == card_id, SoldListing.grade == grade)
+                .distinct()
+                .all()
+            )
+            window = TDigest()
+            for sketch in read_window_sketches(
+                session, [(card_id, grade, c[0]) for c in companies], window_days
+            ).values():
+                window.merge(sketch)
+            if window.count:
+                st.subheader(f"Comps over the last {window_days} days")
+                cols = st.columns(4)
+                cols[0].metric("Sales", window.count)
+                cols[1].metric("Median", f"${window.quantile(0.5):,.2f}")
+                cols[2].metric(
+                    "25th-75th Percentile",
+                    f"${window.quantile(0.25):,.2f} - ${window.quantile(0.75):,.2f}",
+                )
+                cols[3].metric("Average", f"${window.price_sum / window.count:,.2f}")
             # Query comps
             comps = (
                 session.query(SoldListing)
@@ -498,6 +519,7 @@ with tabs[5]:
     )
     if st.button("Save eBay Token") and new_ebay_token:
         set_key(env_path, "EBAY_ACCESS_TOKEN", new_ebay_token)
+        get_token_manager().save(new_ebay_token)
         st.success("eBay Access Token updated in .env.")
     # Thresholds
     st.subheader("Analysis Thresholds")
@@ -0,0 +1,274 @@
+# database/comp_window.py
+"""
+Rolling comp aggregates over the last COMP_WINDOW_DAYS of sales.
+
+Each (card_id, grade, grading_company) keeps one comp_window_aggregates row
+with a t-digest of its in-window sale prices next to their exact count,
+sum, sum of squares, min and max, the median taken from the digest and the
+oldest sale. Every sold-ingest path calls record_window_sales in the same
+transaction as the insert, which adds the new prices to the row, so the
+analyzer reads a card's comps from one row instead of rescanning the
+window.
+
+A t-digest cannot drop prices, so expire_comp_windows rebuilds the rows
+holding sales that aged out by merging the daily sketches of the days
+still in the window (database/sketches.py). Between expiry passes a row
+can still count sales that aged out since the last one; run_analysis and
+the sold-listing maintenance expire them before they matter.
+"""
+import logging
+import math
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, insert, select, update
+
+from database.models import (
+    _COMP_WINDOW_UC_COLUMNS,
+    CompWindowAggregate,
+    SoldListing,
+    _as_datetime,
+    _conflict_target,
+    _insert,
+    chunked,
+    get_engine,
+    key_condition,
+)
+from database.sketches import TDigest, read_window_sketches
+
+COMP_WINDOW_DAYS = int(os.getenv("COMP_WINDOW_DAYS", 90))
+# Keys per locking lookup and rebuild
+COMP_WINDOW_CHUNK_SIZE = 200
+
+_aggregates = CompWindowAggregate.__table__
+_SALE_KEY = (SoldListing.card_id, SoldListing.grade, SoldListing.grading_company)
+
+
+def _naive_utc(value):
+    value = _as_datetime(value)
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def window_cutoff(now=None):
+    now = now or datetime.now(timezone.utc)
+    return _naive_utc(now) - timedelta(days=COMP_WINDOW_DAYS)
+
+
+def _window_values(sketch, oldest_sale_date):
+    """Column values for storing a window's sketch."""
+    return {
+        **sketch.to_values(),
+        "median_price": sketch.quantile(0.5),
+        "oldest_sale_date": oldest_sale_date,
+    }
+
+
+def _lock_windows(conn, keys):
+    """
+    The window rows of `keys`, created empty where missing and locked in id
+    order, so concurrent writers update them one after another.
+    """
+    conn.execute(
+        _insert(conn, CompWindowAggregate)
+        .values(
+            [dict(zip(("card_id", "grade", "grading_company"), key)) for key in keys]
+        )
+        .on_conflict_do_nothing(
+            **_conflict_target(conn, "_comp_window_uc", _COMP_WINDOW_UC_COLUMNS)
+        )
+    )
+    return (
+        conn.execute(
+            select(_aggregates)
+            .where(key_condition(_COMP_WINDOW_UC_COLUMNS, keys))
+            .order_by(_aggregates.c.id)
+            .with_for_update()
+        )
+        .mappings()
+        .all()
+    )
+
+
+def record_window_sales(session, sales):
+    """
+    Add newly inserted sales to their windows. `sales` are dicts with
+    card_id, grade, grading_company, sale_price and sale_date; sales
+    already older than the window are ignored. Runs in the caller's
+    transaction and only reads the touched rows, not their sales.
+    """
+    cutoff = window_cutoff()
+    prices, oldest = {}, {}
+    for sale in sales:
+        sale_date = _naive_utc(sale["sale_date"])
+        if sale["card_id"] is None or sale["sale_price"] is None:
+            continue
+        if sale_date is None or sale_date < cutoff:
+            continue
+        key = (sale["card_id"], sale.get("grade"), sale.get("grading_company"))
+        prices.setdefault(key, []).append(sale["sale_price"])
+        oldest[key] = min(oldest.get(key, sale_date), sale_date)
+    for chunk in chunked(sorted(prices, key=repr), COMP_WINDOW_CHUNK_SIZE):
+        for row in _lock_windows(session, chunk):
+            key = (row["card_id"], row["grade"], row["grading_company"])
+            sketch = TDigest.from_row(row)
+            for price in prices[key]:
+                sketch.add(price)
+            stored = _naive_utc(row["oldest_sale_date"])
+            session.execute(
+                update(_aggregates)
+                .where(_aggregates.c.id == row["id"])
+                .values(
+                    **_window_values(sketch, min(oldest[key], stored or oldest[key]))
+                )
+            )
+
+
+def _oldest_sales(conn, keys, cutoff):
+    return {
+        tuple(key): _naive_utc(oldest)
+        for *key, oldest in conn.execute(
+            select(*_SALE_KEY, func.min(SoldListing.sale_date))
+            .where(key_condition(_SALE_KEY, keys), SoldListing.sale_date >= cutoff)
+            .group_by(*_SALE_KEY)
+        )
+    }
+
+
+def expire_comp_windows(engine=None):
+    """
+    Drop sales older than COMP_WINDOW_DAYS from the windows holding any:
+    each is rebuilt from the daily sketches of its remaining days, and
+    those left empty are deleted. Returns the number of windows touched.
+    """
+    engine = engine or get_engine()
+    now = datetime.now(timezone.utc)
+    cutoff = window_cutoff(now)
+    with engine.begin() as conn:
+        keys = [
+            tuple(key)
+            for key in conn.execute(
+                select(*_COMP_WINDOW_UC_COLUMNS).where(
+                    _aggregates.c.oldest_sale_date < cutoff
+                )
+            )
+        ]
+        for chunk in chunked(sorted(keys, key=repr), COMP_WINDOW_CHUNK_SIZE):
+            rows = _lock_windows(conn, chunk)
+            sketches = read_window_sketches(conn, chunk, COMP_WINDOW_DAYS, now)
+            oldest = _oldest_sales(conn, chunk, cutoff)
+            for row in rows:
+                key = (row["card_id"], row["grade"], row["grading_company"])
+                sketch = sketches.get(key)
+                if sketch is None or not sketch.count:
+                    conn.execute(
+                        delete(_aggregates).where(_aggregates.c.id == row["id"])
+                    )
+                    continue
+                conn.execute(
+                    update(_aggregates)
+                    .where(_aggregates.c.id == row["id"])
+                    .values(**_window_values(sketch, oldest.get(key, cutoff)))
+                )
+    logging.info(f"Expired sales older than {cutoff} from {len(keys)} comp window(s).")
+    return len(keys)
+
+
+def rebuild_comp_windows(conn):
+    """
+    Recompute every window from sold_listings, streaming the in-window
+    sales in key order. Used by schema migration 5 and to repair windows
+    after sales were written around the ingest paths. Returns the number
+    of windows.
+    """
+    sales = conn.execute(
+        select(*_SALE_KEY, SoldListing.sale_date, SoldListing.sale_price)
+        .where(
+            SoldListing.sale_date >= window_cutoff(),
+            SoldListing.card_id.is_not(None),
+            SoldListing.sale_price.is_not(None),
+        )
+        .order_by(*_SALE_KEY, SoldListing.sale_date)
+        .execution_options(yield_per=5000)
+    )
+    conn.execute(delete(_aggregates))
+    columns = ("card_id", "grade", "grading_company")
+    pending, written = [], 0
+    key, sketch, oldest = None, None, None
+    for card_id, grade, grading_company, sale_date, sale_price in sales:
+        row_key = (card_id, grade, grading_company)
+        if row_key != key:
+            if sketch is not None:
+                pending.append(dict(zip(columns, key)) | _window_values(sketch, oldest))
+            key, sketch, oldest = row_key, TDigest(), _naive_utc(sale_date)
+        sketch.add(sale_price)
+        if len(pending) >= 500:
+            conn.execute(insert(_aggregates), pending)
+            written += len(pending)
+            pending = []
+    if sketch is not None:
+        pending.append(dict(zip(columns, key)) | _window_values(sketch, oldest))
+    if pending:
+        conn.execute(insert(_aggregates), pending)
+        written += len(pending)
+    return written
+
+
+def read_comp_windows(session, keys):
+    """
+    Read the windows for (card_id, grade, grading_company) keys, one row
+    each. Returns {key: {"comp_stats": ..., "stdev": ...}} for keys with a
+    window; comp_stats has calculate_comp_stats' format.
+    """
+    found = {}
+    for chunk in chunked(list(keys), COMP_WINDOW_CHUNK_SIZE):
+        rows = session.execute(
+            select(
+                _aggregates.c.card_id,
+                _aggregates.c.grade,
+                _aggregates.c.grading_company,
+                _aggregates.c.sales_count,
+                _aggregates.c.price_sum,
+                _aggregates.c.price_sum_sq,
+                _aggregates.c.min_price,
+                _aggregates.c.max_price,
+                _aggregates.c.median_price,
+            ).where(key_condition(_COMP_WINDOW_UC_COLUMNS, chunk))
+        ).mappings()
+        for row in rows:
+            key = (row["card_id"], row["grade"], row["grading_company"])
+            found[key] = _window_stats(row)
+    return found
+
+
+def _window_stats(row):
+    count = row["sales_count"]
+    if not count:
+        return {
+            "comp_stats": {
+                "median_price": None,
+                "average_price": None,
+                "min_price": None,
+                "max_price": None,
+                "sales_count": 0,
+            },
+            "stdev": 0,
+        }
+    mean = row["price_sum"] / count
+    variance = (
+        (row["price_sum_sq"] - row["price_sum"] * mean) / (count - 1)
+        if count > 1
+        else 0
+    )
+    return {
+        "comp_stats": {
+            "median_price": row["median_price"],
+            "average_price": mean,
+            "min_price": row["min_price"],
+            "max_price": row["max_price"],
+            "sales_count": count,
+        },
+        # Clamp tiny negative values left by floating-point cancellation
+        "stdev": math.sqrt(max(variance, 0.0)),
+    }
@@ -0,0 +1,255 @@
+# database/migrations.py
+"""
+Versioned, in-place schema migrations.
+
+`init_db()` only creates missing tables, so changes to existing tables
+(indexes, constraints, new columns) are written here as numbered
+migrations. Applied versions are recorded in `schema_migrations`, and
+`run_migrations()` applies whatever is pending in version order.
+
+Register a migration with the `migration` decorator. The function receives
+a SQLAlchemy connection; transactional migrations run inside a transaction
+together with their version bookkeeping, and non-transactional ones (for
+example `CREATE INDEX CONCURRENTLY`) run in autocommit mode.
+"""
+import logging
+
+from sqlalchemy import inspect, text
+
+from database.models import current_utc_time, get_engine
+
+# Arbitrary key for the advisory lock that serializes concurrent runners
+MIGRATION_LOCK_ID = 748_213_001
+
+MIGRATIONS = []
+
+
+def migration(version, description, transactional=True):
+    """Register the decorated function as schema migration `version`."""
+
+    def register(upgrade):
+        MIGRATIONS.append(
+            {
+                "version": version,
+                "description": description,
+                "upgrade": upgrade,
+                "transactional": transactional,
+            }
+        )
+        MIGRATIONS.sort(key=lambda m: m["version"])
+        return upgrade
+
+    return register
+
+
+def _ensure_version_table(conn):
+    conn.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            " version INTEGER PRIMARY KEY,"
+            " description VARCHAR NOT NULL,"
+            " applied_at TIMESTAMP WITH TIME ZONE NOT NULL)"
+        )
+    )
+
+
+def _record_version(conn, entry):
+    conn.execute(
+        text(
+            "INSERT INTO schema_migrations (version, description, applied_at) "
+            "VALUES (:version, :description, :applied_at)"
+        ),
+        {
+            "version": entry["version"],
+            "description": entry["description"],
+            "applied_at": current_utc_time(),
+        },
+    )
+
+
+def applied_versions(conn):
+    _ensure_version_table(conn)
+    return {
+        row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))
+    }
+
+
+def current_version(engine=None):
+    """Return the highest applied migration version, or 0."""
+    engine = engine or get_engine()
+    with engine.begin() as conn:
+        return max(applied_versions(conn), default=0)
+
+
+def run_migrations(engine=None):
+    """
+    Apply all pending migrations in order.
+    Returns the list of versions that were applied.
+    """
+    engine = engine or get_engine()
+    applied = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        is_postgres = lock_conn.dialect.name == "postgresql"
+        if is_postgres:
+            # Only one process migrates at a time; others wait, then see
+            # the versions already recorded and skip them.
+            lock_conn.execute(
+                text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID}
+            )
+        try:
+            with engine.begin() as conn:
+                done = applied_versions(conn)
+            for entry in MIGRATIONS:
+                if entry["version"] in done:
+                    continue
+                logging.info(
+                    f"Applying migration {entry['version']}: {entry['description']}"
+                )
+                if entry["transactional"]:
+                    with engine.begin() as conn:
+                        entry["upgrade"](conn)
+                        _record_version(conn, entry)
+                else:
+                    with engine.connect().execution_options(
+                        isolation_level="AUTOCOMMIT"
+                    ) as conn:
+                        entry["upgrade"](conn)
+                        _record_version(conn, entry)
+                applied.append(entry["version"])
+        finally:
+            if is_postgres:
+                lock_conn.execute(
+                    text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID}
+                )
+    return applied
+
+
+# --- Migrations ---
+
+
+@migration(1, "composite comp-lookup index on sold_listings", transactional=False)
+def _sold_listings_comp_index(conn):
+    from database.partitions import is_partitioned
+
+    # A partitioned parent cannot be indexed concurrently
+    concurrently = (
+        "CONCURRENTLY "
+        if conn.dialect.name == "postgresql" and not is_partitioned(conn)
+        else ""
+    )
+    conn.execute(
+        text(
+            f"CREATE INDEX {concurrently}IF NOT EXISTS ix_sold_listings_comp "
+            "ON sold_listings (card_id, grade, grading_company, sale_date DESC)"
+        )
+    )
+
+
+@migration(2, "card/grade index on active_listings", transactional=False)
+def _active_listings_card_grade_index(conn):
+    concurrently = "CONCURRENTLY " if conn.dialect.name == "postgresql" else ""
+    conn.execute(
+        text(
+            f"CREATE INDEX {concurrently}IF NOT EXISTS ix_active_listings_card_grade "
+            "ON active_listings (card_id, grade)"
+        )
+    )
+
+
+@migration(3, "NULLS NOT DISTINCT card and valuation identity constraints")
+def _nulls_not_distinct_identity_constraints(conn):
+    if conn.dialect.name != "postgresql":
+        return
+    # Repointing valuations below can make them collide, so the constraint
+    # is rebuilt only after duplicates are removed.
+    conn.execute(
+        text("ALTER TABLE card_valuations DROP CONSTRAINT IF EXISTS _valuation_uc")
+    )
+    # Merge cards that only differed by NULL columns onto the lowest id,
+    # repointing every reference before the duplicates are removed.
+    card_dupes = (
+        "SELECT id, min(id) OVER (PARTITION BY player, year, set_name, card_num, "
+        "attributes) AS keep_id FROM cards"
+    )
+    for table in ("active_listings", "sold_listings", "card_valuations"):
+        conn.execute(
+            text(
+                f"UPDATE {table} t SET card_id = d.keep_id "
+                f"FROM ({card_dupes}) d "
+                "WHERE t.card_id = d.id AND d.id <> d.keep_id"
+            )
+        )
+    conn.execute(
+        text(
+            "DELETE FROM card_valuations WHERE id IN ("
+            " SELECT id FROM (SELECT id, row_number() OVER (PARTITION BY card_id,"
+            " source, valuation_date, valuation_type, grade, grading_company"
+            " ORDER BY id) AS rn FROM card_valuations) v WHERE rn > 1)"
+        )
+    )
+    conn.execute(
+        text(
+            f"DELETE FROM cards WHERE id IN (SELECT id FROM ({card_dupes}) d "
+            "WHERE d.id <> d.keep_id)"
+        )
+    )
+    conn.execute(text("ALTER TABLE cards DROP CONSTRAINT IF EXISTS _card_uc"))
+    conn.execute(
+        text(
+            "ALTER TABLE cards ADD CONSTRAINT _card_uc UNIQUE NULLS NOT DISTINCT "
+            "(player, year, set_name, card_num, attributes)"
+        )
+    )
+    conn.execute(
+        text(
+            "ALTER TABLE card_valuations ADD CONSTRAINT _valuation_uc UNIQUE "
+            "NULLS NOT DISTINCT (card_id, source, valuation_date, valuation_type, "
+            "grade, grading_company)"
+        )
+    )
+
+
+@migration(4, "partition sold_listings by sale_date month")
+def _partition_sold_listings(conn):
+    from database.partitions import partition_sold_listings
+
+    partition_sold_listings(conn)
+
+
+@migration(5, "rolling comp window aggregates")
+def _comp_window_aggregates(conn):
+    from database.comp_window import rebuild_comp_windows
+    from database.models import CompWindowAggregate
+
+    CompWindowAggregate.__table__.create(conn, checkfirst=True)
+    rebuild_comp_windows(conn)
+
+
+@migration(6, "daily sold price quantile sketches")
+def _sold_listing_daily_sketches(conn):
+    from database.models import SoldListingDailySketch
+    from database.sketches import rebuild_daily_sketches
+
+    SoldListingDailySketch.__table__.create(conn, checkfirst=True)
+    rebuild_daily_sketches(conn)
+
+
+@migration(7, "analyzed_at timestamp on active_listings")
+def _active_listings_analyzed_at(conn):
+    columns = {c["name"] for c in inspect(conn).get_columns("active_listings")}
+    if "analyzed_at" not in columns:
+        conn.execute(
+            text("ALTER TABLE active_listings ADD COLUMN analyzed_at TIMESTAMP")
+        )
+
+
+@migration(8, "updated_at indexes for incremental analysis", transactional=False)
+def _comp_updated_at_indexes(conn):
+    concurrently = "CONCURRENTLY " if conn.dialect.name == "postgresql" else ""
+    for table in ("comp_window_aggregates", "sold_listing_daily_sketches"):
+        conn.execute(
+            text(
+                f"CREATE INDEX {concurrently}IF NOT EXISTS ix_{table}_updated_at "
+                f"ON {table} (updated_at)"
+            )
+        )
@@ -1,20 +1,38 @@
 # database/models.py
+import asyncio
 import os
+import threading
+import weakref
 from datetime import datetime, timezone
 
+from cachetools import LRUCache, TTLCache
 from dotenv import load_dotenv
 from sqlalchemy import (
     Boolean,
     Column,
+    Date,
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
+    LargeBinary,
     String,
     Text,
     UniqueConstraint,
+    and_,
+    case,
     create_engine,
+    event,
+    func,
+    literal_column,
+    null,
+    or_,
+    select,
 )
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 load_dotenv()
@@ -22,44 +40,235 @@ load_dotenv()
 Base = declarative_base()
 
 # Database connection setup
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-# Update the DATABASE_URL to use psycopg driver explicitly
-DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+psycopg://")
+# The engine is created on first use, so importing the models never opens a
+# connection and does not require DATABASE_URL to be set.
+# Pool settings; size them for the number of concurrent collectors.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # seconds
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# 0 disables the server-side statement timeout
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+# How long a SQLite writer waits for the database lock before failing
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 30_000))
 
 _engine = None  # Module-level variable to store the engine
+_engine_pid = None  # Process that created _engine
+# Async connections belong to the event loop that opened them, so each loop
+# gets its own async engine; run_async disposes it when the loop ends.
+_async_engines = weakref.WeakKeyDictionary()
+
+# Rows per INSERT ... ON CONFLICT statement in the bulk write paths
+BULK_CHUNK_SIZE = int(os.getenv("DB_BULK_CHUNK_SIZE", 500))
+
+
+def get_database_url():
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise ValueError("DATABASE_URL environment variable is not set.")
+    # Use the psycopg (v3) driver explicitly
+    return database_url.replace("postgresql://", "postgresql+psycopg://")
+
+
+def get_async_database_url():
+    # psycopg serves both engines; SQLite needs the aiosqlite driver
+    return get_database_url().replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+
+def _engine_options(database_url):
+    if database_url.startswith("sqlite"):
+        # Pool sizing and statement timeouts are server settings; a SQLite
+        # file only needs a busy timeout so concurrent writers wait.
+        return {
+            "connect_args": {
+                "check_same_thread": False,
+                "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000,
+            }
+        }
+    connect_args = {}
+    if DB_STATEMENT_TIMEOUT_MS:
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "connect_args": connect_args,
+    }
+
+
+def _enable_sqlite_wal(engine):
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers (dashboard, analyzer) run while a collector writes
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+
+def _create_engine():
+    database_url = get_database_url()
+    engine = create_engine(database_url, **_engine_options(database_url))
+    if engine.dialect.name == "sqlite":
+        _enable_sqlite_wal(engine)
+    return engine
 
 
 def get_engine():
-    global _engine
-    if _engine is None:  # Initialize engine only once
-        if not DATABASE_URL:
-            raise ValueError("DATABASE_URL environment variable is not set.")
-        _engine = create_engine(DATABASE_URL)
+    global _engine, _engine_pid
+    if _engine is not None and _engine_pid != os.getpid():
+        # Inherited across fork() without the at-fork hook; drop the parent's
+        # pooled connections without closing sockets the parent still uses.
+        _engine.dispose(close=False)
+        _engine = None
+    if _engine is None:  # Initialize engine only once per process
+        _engine = _create_engine()
+        _engine_pid = os.getpid()
+        SessionLocal.configure(bind=_engine)
     return _engine
 
 
-# Define SessionLocal for consistent session management
-# Bind SessionLocal once using the engine
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+def get_async_engine():
+    """Return the async engine for the running event loop, creating it."""
+    loop = asyncio.get_running_loop()
+    engine = _async_engines.get(loop)
+    if engine is None:
+        database_url = get_async_database_url()
+        engine = create_async_engine(database_url, **_engine_options(database_url))
+        if engine.dialect.name == "sqlite":
+            _enable_sqlite_wal(engine.sync_engine)
+        _async_engines[loop] = engine
+    return engine
+
+
+async def dispose_async_engine():
+    """Close the running loop's async engine and its pooled connections."""
+    engine = _async_engines.pop(asyncio.get_running_loop(), None)
+    if engine is not None:
+        await engine.dispose()
+
+
+def run_async(coro):
+    """
+    asyncio.run() for coroutines that use the async engine. The new loop's
+    engine is disposed before the loop closes, so repeated runs (scheduler
+    ticks, dashboard actions) do not each leave a connection pool behind.
+    """
+
+    async def main():
+        try:
+            return await coro
+        finally:
+            await dispose_async_engine()
+
+    return asyncio.run(main())
+
+
+def _reset_engine_after_fork():
+    global _engine
+    if _engine is not None:
+        _engine.dispose(close=False)
+        _engine = None
+    _async_engines.clear()
+
+
+# Process-pool and gunicorn workers build their own engine on first use
+os.register_at_fork(after_in_child=_reset_engine_after_fork)
+
+# Define SessionLocal for consistent session management.
+# It is bound to the engine the first time get_engine() runs.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
 
-# Update SessionLocal to use the helper function.
 def get_session():
-    # Simply return a new session from the globally configured SessionLocal
+    get_engine()
     return SessionLocal()
 
 
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)
+
+
+def get_async_session():
+    """
+    Session for code running inside an event loop. Database I/O is awaited,
+    so in-flight HTTP requests keep progressing during writes.
+    """
+    return AsyncSessionLocal(bind=get_async_engine())
+
+
 # Update init_db to use the helper function.
 def init_db():
+    """
+    Create any missing tables, then apply pending schema migrations.
+    """
+    from database.migrations import run_migrations
+
     engine = get_engine()
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
 
 
 def current_utc_time():
     return datetime.now(timezone.utc)
 
 
+def chunked(rows, chunk_size):
+    """Consecutive slices of `rows`, each at most `chunk_size` long."""
+    for start in range(0, len(rows), chunk_size):
+        yield rows[start : start + chunk_size]
+
+
+def _as_datetime(value):
+    """Parse ISO timestamp strings; SQLite's DateTime only accepts datetimes."""
+    if not value:
+        return None
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value
+
+
+def is_sqlite(session):
+    """Whether a Session or Connection is bound to SQLite."""
+    dialect = getattr(session, "dialect", None) or session.get_bind().dialect
+    return dialect.name == "sqlite"
+
+
+def _insert(session, model):
+    """INSERT construct with ON CONFLICT support for the session's backend."""
+    return (sqlite_insert if is_sqlite(session) else pg_insert)(model)
+
+
+def key_condition(columns, keys):
+    """Match rows whose `columns` equal any of the value tuples in `keys`."""
+    # `column == None` compiles to IS NULL, so NULL grades match
+    return or_(
+        *[and_(*[col == value for col, value in zip(columns, key)]) for key in keys]
+    )
+
+
+def _null_safe(column):
+    return func.ifnull(column, literal_column("''"))
+
+
+def _sqlite_nulls_not_distinct_index(name, *columns):
+    """
+    SQLite has no NULLS NOT DISTINCT, so mirror such a constraint with a
+    unique index over ifnull()-wrapped columns, created only on SQLite.
+    """
+    return Index(name, *map(_null_safe, columns), unique=True).ddl_if(dialect="sqlite")
+
+
+def _conflict_target(session, constraint, columns):
+    """
+    ON CONFLICT arguments for a NULLS NOT DISTINCT constraint: the named
+    constraint on PostgreSQL, the matching ifnull() index on SQLite.
+    """
+    if is_sqlite(session):
+        return {"index_elements": list(map(_null_safe, columns))}
+    return {"constraint": constraint}
+
+
 class Card(Base):
     __tablename__ = "cards"
     id = Column(Integer, primary_key=True)
@@ -77,6 +286,8 @@ class Card(Base):
             "card_num",
             "attributes",
             name="_card_uc",
+            # Cards without attributes must still collide on ON CONFLICT
+            postgresql_nulls_not_distinct=True,
         ),
     )
 
@@ -115,6 +326,8 @@ class CardValuation(Base):
             "grade",
             "grading_company",
             name="_valuation_uc",
+            # Most feeds leave type/grade empty; those rows must still collide
+            postgresql_nulls_not_distinct=True,
         ),
     )
 
@@ -136,6 +349,10 @@ class ActiveListing(Base):
     last_seen_at = Column(DateTime)
     comp_value = Column(Float)  # Median or average comp value
     is_undervalued = Column(Boolean)  # Indicates if the listing is undervalued
+    # When comp_value/is_undervalued were written; cleared when the
+    # listing's price or grade changes, so the listing is analyzed again
+    analyzed_at = Column(DateTime)
+    __table_args__ = (Index("ix_active_listings_card_grade", "card_id", "grade"),)
 
 
 class SoldListing(Base):
@@ -147,59 +364,414 @@ class SoldListing(Base):
     currency = Column(String)
     sale_date = Column(DateTime)
     source = Column(String)
-    source_item_id = Column(String, unique=True, index=True)
+    source_item_id = Column(String, index=True)
     source_url = Column(String)
     grade = Column(String)
     grading_company = Column(String)
+    # On PostgreSQL the table is range-partitioned by sale_date month
+    # (see database/partitions.py), so uniqueness has to include sale_date;
+    # the ingest paths skip a source_item_id already stored before inserting.
+    __table_args__ = (
+        UniqueConstraint("source_item_id", "sale_date", name="_sold_item_uc"),
+    )
+
+
+class SoldListingDailySummary(Base):
+    """Per card/grade/day rollup of sold_listings rows past retention."""
+
+    __tablename__ = "sold_listing_daily_summaries"
+
+    id = Column(Integer, primary_key=True)
+    card_id = Column(Integer, nullable=False)
+    grade = Column(String)
+    grading_company = Column(String)
+    sale_day = Column(Date, nullable=False)
+    sales_count = Column(Integer, nullable=False)
+    min_price = Column(Float)
+    max_price = Column(Float)
+    # Count-weighted mean of the medians of each rollup pass: approximate
+    # once a day is rolled up more than once (see database/partitions.py)
+    median_price = Column(Float)
+    total_price = Column(Float)
+    __table_args__ = (
+        UniqueConstraint(
+            "card_id",
+            "grade",
+            "grading_company",
+            "sale_day",
+            name="_sold_summary_uc",
+            postgresql_nulls_not_distinct=True,
+        ),
+    )
 
 
-def add_card_definition(listing):
+class CompWindowAggregate(Base):
     """
-    Add or retrieve a card definition based on the listing details.
-    Returns the card_id.
+    Rolling comp aggregate over the last COMP_WINDOW_DAYS of sales for one
+    card/grade/company, kept current on ingest (see database/comp_window.py).
+    """
+
+    __tablename__ = "comp_window_aggregates"
+
+    id = Column(Integer, primary_key=True)
+    card_id = Column(Integer, nullable=False)
+    grade = Column(String)
+    grading_company = Column(String)
+    sales_count = Column(Integer, nullable=False, default=0)
+    price_sum = Column(Float, nullable=False, default=0.0)
+    price_sum_sq = Column(Float, nullable=False, default=0.0)
+    min_price = Column(Float)
+    max_price = Column(Float)
+    median_price = Column(Float)
+    # t-digest centroids of the window's prices, packed like the sketches'
+    centroids = Column(LargeBinary, nullable=False, default=b"")
+    # Oldest sale still in the window; the expiry pass looks for old ones
+    oldest_sale_date = Column(DateTime, index=True)
+    # Set on every change; the incremental analyzer looks for recent ones
+    updated_at = Column(DateTime, default=current_utc_time, index=True)
+    __table_args__ = (
+        UniqueConstraint(
+            "card_id",
+            "grade",
+            "grading_company",
+            name="_comp_window_uc",
+            postgresql_nulls_not_distinct=True,
+        ),
+    )
+
+
+class SoldListingDailySketch(Base):
+    """
+    Mergeable quantile sketch of one card/grade/company's sale prices on one
+    day, kept current on ingest (see database/sketches.py). Any window's
+    comps are answered by merging the sketches of its days.
+    """
+
+    __tablename__ = "sold_listing_daily_sketches"
+
+    id = Column(Integer, primary_key=True)
+    card_id = Column(Integer, nullable=False)
+    grade = Column(String)
+    grading_company = Column(String)
+    sale_day = Column(Date, nullable=False, index=True)
+    sales_count = Column(Integer, nullable=False, default=0)
+    price_sum = Column(Float, nullable=False, default=0.0)
+    price_sum_sq = Column(Float, nullable=False, default=0.0)
+    min_price = Column(Float)
+    max_price = Column(Float)
+    # t-digest centroids packed as float64 (mean, weight) pairs
+    centroids = Column(LargeBinary, nullable=False, default=b"")
+    updated_at = Column(DateTime, default=current_utc_time, index=True)
+    __table_args__ = (
+        UniqueConstraint(
+            "card_id",
+            "grade",
+            "grading_company",
+            "sale_day",
+            name="_daily_sketch_uc",
+            postgresql_nulls_not_distinct=True,
+        ),
+    )
+
+
+class AnalyzerRun(Base):
+    """
+    One analyzer run. The start of the last finished run is the watermark
+    from which the next incremental run looks for changed comps.
+    """
+
+    __tablename__ = "analyzer_runs"
+
+    id = Column(Integer, primary_key=True)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime)
+    full = Column(Boolean, nullable=False, default=False)
+    listings_analyzed = Column(Integer, nullable=False, default=0)
+
+
+# Comp lookups filter on card/grade/company and scan recent sales first.
+# Declared here so create_all() builds it; migration 1 adds it to old schemas.
+Index(
+    "ix_sold_listings_comp",
+    SoldListing.card_id,
+    SoldListing.grade,
+    SoldListing.grading_company,
+    SoldListing.sale_date.desc(),
+)
+
+_CARD_UC_COLUMNS = (
+    Card.player,
+    Card.year,
+    Card.set_name,
+    Card.card_num,
+    Card.attributes,
+)
+_VALUATION_UC_COLUMNS = (
+    CardValuation.card_id,
+    CardValuation.source,
+    CardValuation.valuation_date,
+    CardValuation.valuation_type,
+    CardValuation.grade,
+    CardValuation.grading_company,
+)
+_SOLD_SUMMARY_UC_COLUMNS = (
+    SoldListingDailySummary.card_id,
+    SoldListingDailySummary.grade,
+    SoldListingDailySummary.grading_company,
+    SoldListingDailySummary.sale_day,
+)
+_sqlite_nulls_not_distinct_index("_card_uc_sqlite", *_CARD_UC_COLUMNS)
+_sqlite_nulls_not_distinct_index("_valuation_uc_sqlite", *_VALUATION_UC_COLUMNS)
+_COMP_WINDOW_UC_COLUMNS = (
+    CompWindowAggregate.card_id,
+    CompWindowAggregate.grade,
+    CompWindowAggregate.grading_company,
+)
+_sqlite_nulls_not_distinct_index("_sold_summary_uc_sqlite", *_SOLD_SUMMARY_UC_COLUMNS)
+_sqlite_nulls_not_distinct_index("_comp_window_uc_sqlite", *_COMP_WINDOW_UC_COLUMNS)
+_DAILY_SKETCH_UC_COLUMNS = (
+    SoldListingDailySketch.card_id,
+    SoldListingDailySketch.grade,
+    SoldListingDailySketch.grading_company,
+    SoldListingDailySketch.sale_day,
+)
+_sqlite_nulls_not_distinct_index("_daily_sketch_uc_sqlite", *_DAILY_SKETCH_UC_COLUMNS)
+
+
+# --- Card identity cache ---
+# Maps card_key(listing) -> cards.id so repeat cards skip the database.
+CARD_CACHE_SIZE = int(os.getenv("CARD_CACHE_SIZE", 100_000))
+# Keys per OR-ed lookup when resolving cache misses
+CARD_LOOKUP_CHUNK_SIZE = 200
+
+_card_cache = LRUCache(maxsize=CARD_CACHE_SIZE)
+_card_cache_lock = threading.Lock()
+_card_cache_warmed = False
+
+_CARD_KEY_COLUMNS = ("player", "year", "set_name", "card_num", "attributes")
+
+
+def card_key(listing):
+    """
+    Build the (player, year, set_name, card_num, attributes) identity of the
+    card a listing refers to, normalized the way it is stored in `cards`.
+    """
+    year = listing.get("card_year")
+    if isinstance(year, str) and year.isdigit():
+        year = int(year)
+    attributes = listing.get("attributes")
+    if isinstance(attributes, (list, tuple)):
+        attributes = ", ".join(attributes)
+    return (
+        listing.get("player_name"),
+        year,
+        listing.get("card_set"),
+        listing.get("card_number"),
+        attributes,
+    )
+
+
+def _recent_cards(session):
+    return (
+        session.query(Card.id, *[getattr(Card, c) for c in _CARD_KEY_COLUMNS])
+        .order_by(Card.id.desc())
+        .limit(CARD_CACHE_SIZE)
+        .all()
+    )
+
+
+def _fill_card_cache(cards):
+    global _card_cache_warmed
+    with _card_cache_lock:
+        # Oldest first, so the newest cards are the last to be evicted
+        for card_id, *key in reversed(cards):
+            _card_cache[tuple(key)] = card_id
+        _card_cache_warmed = True
+
+
+def warm_card_cache():
+    """
+    Load the most recently created cards into the card identity cache.
     """
     session = get_session()
     try:
-        # Extract card details from the listing
-        player = listing.get("player_name")
-        year = listing.get("card_year")
-        set_name = listing.get("card_set")
-        card_num = listing.get("card_number")
-        attributes = listing.get("attributes")
-
-        # Check if the card already exists
-        card = (
-            session.query(Card)
-            .filter_by(
-                player=player,
-                year=year,
-                set_name=set_name,
-                card_num=card_num,
-                attributes=attributes,
+        _fill_card_cache(_recent_cards(session))
+    finally:
+        session.close()
+
+
+def clear_card_cache():
+    global _card_cache_warmed
+    with _card_cache_lock:
+        _card_cache.clear()
+        _card_cache_warmed = False
+
+
+def _lookup_card_ids(session, keys):
+    """Fetch ids for existing cards matching any of the given keys."""
+    found = {}
+    columns = [getattr(Card, c) for c in _CARD_KEY_COLUMNS]
+    for chunk in chunked(keys, CARD_LOOKUP_CHUNK_SIZE):
+        for card_id, *key in session.query(Card.id, *columns).filter(
+            key_condition(columns, chunk)
+        ):
+            found[tuple(key)] = card_id
+    return found
+
+
+def _cached_card_ids(keys):
+    """Split keys into ({key: card_id} cache hits, unique misses)."""
+    ids = {}
+    with _card_cache_lock:
+        for key in set(keys):
+            card_id = _card_cache.get(key)
+            if card_id is not None:
+                ids[key] = card_id
+    return ids, [key for key in dict.fromkeys(keys) if key not in ids]
+
+
+def _remember_card_ids(ids):
+    with _card_cache_lock:
+        for key, card_id in ids.items():
+            _card_cache[key] = card_id
+
+
+def _create_missing_cards(session, misses):
+    """
+    Look up the missed keys and insert the cards that do not exist yet.
+    Commits and returns {key: card_id}.
+    """
+    ids = _lookup_card_ids(session, misses)
+    missing = [key for key in misses if key not in ids]
+    for chunk in chunked(missing, BULK_CHUNK_SIZE):
+        stmt = (
+            _insert(session, Card)
+            .values([dict(zip(_CARD_KEY_COLUMNS, key)) for key in chunk])
+            .on_conflict_do_nothing(
+                **_conflict_target(session, "_card_uc", _CARD_UC_COLUMNS)
             )
-            .first()
+            .returning(Card.id, *[getattr(Card, c) for c in _CARD_KEY_COLUMNS])
         )
+        for card_id, *key in session.execute(stmt):
+            ids[tuple(key)] = card_id
+    # Cards another worker inserted first are not returned above
+    missing = [key for key in missing if key not in ids]
+    if missing:
+        ids.update(_lookup_card_ids(session, missing))
+    session.commit()
+    return ids
 
-        if not card:
-            # Create a new card entry if it doesn't exist
-            card = Card(
-                player=player,
-                year=year,
-                set_name=set_name,
-                card_num=card_num,
-                attributes=attributes,
-            )
-            session.add(card)
-            session.commit()
 
-        return card.id
+def resolve_card_ids(listings):
+    """
+    Return the card_id for each listing, in order, creating missing cards.
+    Cache misses are looked up in one query and new cards are created with
+    INSERT ... ON CONFLICT (_card_uc) DO NOTHING RETURNING id, so concurrent
+    workers creating the same card end up with the same id.
+    """
+    if not _card_cache_warmed:
+        warm_card_cache()
 
-    except Exception as e:
-        session.rollback()
-        raise e
+    keys = [card_key(listing) for listing in listings]
+    ids, misses = _cached_card_ids(keys)
+    if misses:
+        session = get_session()
+        try:
+            created = _create_missing_cards(session, misses)
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+        _remember_card_ids(created)
+        ids.update(created)
+    return [ids.get(key) for key in keys]
 
-    finally:
-        session.close()
+
+async def async_resolve_card_ids(listings):
+    """
+    Awaitable resolve_card_ids for use inside an event loop. Shares the
+    card identity cache with the synchronous version.
+    """
+    keys = [card_key(listing) for listing in listings]
+    async with get_async_session() as session:
+        if not _card_cache_warmed:
+            _fill_card_cache(await session.run_sync(_recent_cards))
+        ids, misses = _cached_card_ids(keys)
+        if misses:
+            try:
+                created = await session.run_sync(_create_missing_cards, misses)
+            except Exception:
+                await session.rollback()
+                raise
+            _remember_card_ids(created)
+            ids.update(created)
+    return [ids.get(key) for key in keys]
+
+
+# --- Comp stats cache ---
+# Maps (card_id, grade, grading_company, historical_days) -> the comp summary
+# the analyzer computed from that sales window. Sold-ingest paths in this
+# process drop the affected keys; COMP_CACHE_TTL bounds how long sales
+# written by other processes can go unseen.
+COMP_CACHE_SIZE = int(os.getenv("COMP_CACHE_SIZE", 50_000))
+COMP_CACHE_TTL = int(os.getenv("COMP_CACHE_TTL", 900))  # seconds
+
+_comp_cache = TTLCache(maxsize=COMP_CACHE_SIZE, ttl=COMP_CACHE_TTL)
+_comp_cache_lock = threading.Lock()
+_comp_cache_counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def get_cached_comps(key):
+    """Return the cached comp summary for key, or None, counting hits/misses."""
+    with _comp_cache_lock:
+        summary = _comp_cache.get(key)
+        _comp_cache_counters["hits" if summary is not None else "misses"] += 1
+    return summary
+
+
+def cache_comps(key, summary):
+    with _comp_cache_lock:
+        _comp_cache[key] = summary
+
+
+def invalidate_comps(card_keys):
+    """
+    Drop cached comps for the given (card_id, grade, grading_company) keys,
+    for every historical_days window.
+    """
+    card_keys = set(card_keys)
+    if not card_keys:
+        return
+    with _comp_cache_lock:
+        for key in [k for k in list(_comp_cache.keys()) if k[:3] in card_keys]:
+            _comp_cache.pop(key, None)
+            _comp_cache_counters["invalidations"] += 1
+
+
+def clear_comp_cache():
+    with _comp_cache_lock:
+        _comp_cache.clear()
+        for name in _comp_cache_counters:
+            _comp_cache_counters[name] = 0
+
+
+def comp_cache_info():
+    """Hit/miss/invalidation counters and current size of the comp cache."""
+    with _comp_cache_lock:
+        return {**_comp_cache_counters, "size": len(_comp_cache)}
+
+
+def _sale_card_key(sale_data):
+    return (sale_data["card_id"], sale_data["grade"], sale_data["grading_company"])
+
+
+def add_card_definition(listing):
+    """
+    Add or retrieve a card definition based on the listing details.
+    Returns the card_id.
+    """
+    return resolve_card_ids([listing])[0]
 
 
 # New function to add or update an active listing
@@ -211,7 +783,17 @@ def add_active_listing_to_db(session, card_id, listing_data):
             .first()
         )
         if listing:
-            # Update existing listing
+            # Update existing listing; a new price or grade needs a new verdict
+            if (
+                listing.listing_price,
+                listing.grade,
+                listing.grading_company,
+            ) != (
+                listing_data["listing_price"],
+                listing_data["grade"],
+                listing_data["grading_company"],
+            ):
+                listing.analyzed_at = None
             listing.listing_price = listing_data["listing_price"]
             listing.currency = listing_data["currency"]
             listing.listing_date = listing_data["listing_date"]
@@ -241,8 +823,121 @@ def add_active_listing_to_db(session, card_id, listing_data):
         raise e
 
 
+def bulk_upsert_active_listings(session, listings, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Insert or update many active listings at once.
+    Each listing dict must carry its resolved "card_id". Rows are written with
+    one INSERT ... ON CONFLICT (source_item_id) DO UPDATE per chunk and the
+    session is committed once at the end. A change of price or grade clears
+    analyzed_at so the incremental analyzer picks the listing up again.
+    Returns a dict with "inserted" and "updated" counts.
+    """
+    seen_at = current_utc_time()
+    # A statement may not touch the same row twice, so keep the last copy
+    # of any listing that appears more than once in the batch.
+    rows_by_item_id = {}
+    for listing_data in listings:
+        rows_by_item_id[listing_data["source_item_id"]] = {
+            "card_id": listing_data["card_id"],
+            "listing_price": listing_data["listing_price"],
+            "currency": listing_data.get("currency", "USD"),
+            # fetch_cards blanks missing values to "", which is not a timestamp
+            "listing_date": _as_datetime(listing_data.get("listing_date")),
+            "source": listing_data["source"],
+            "source_item_id": listing_data["source_item_id"],
+            "source_url": listing_data.get("source_url"),
+            "grade": listing_data.get("grade"),
+            "grading_company": listing_data.get("grading_company"),
+            "last_seen_at": seen_at,
+        }
+    rows = list(rows_by_item_id.values())
+
+    counts = {"inserted": 0, "updated": 0}
+    sqlite = is_sqlite(session)
+    try:
+        for chunk in chunked(rows, chunk_size):
+            if sqlite:
+                # SQLite has no xmax; count the rows that already exist first
+                existing = session.query(ActiveListing.source_item_id).filter(
+                    ActiveListing.source_item_id.in_(
+                        [row["source_item_id"] for row in chunk]
+                    )
+                )
+                updated = existing.count()
+                counts["updated"] += updated
+                counts["inserted"] += len(chunk) - updated
+            stmt = _insert(session, ActiveListing).values(chunk)
+            changed = or_(
+                *[
+                    column.is_distinct_from(stmt.excluded[column.key])
+                    for column in (
+                        ActiveListing.listing_price,
+                        ActiveListing.grade,
+                        ActiveListing.grading_company,
+                    )
+                ]
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ActiveListing.source_item_id],
+                set_={
+                    "listing_price": stmt.excluded.listing_price,
+                    "currency": stmt.excluded.currency,
+                    "listing_date": stmt.excluded.listing_date,
+                    "source": stmt.excluded.source,
+                    "source_url": stmt.excluded.source_url,
+                    "grade": stmt.excluded.grade,
+                    "grading_company": stmt.excluded.grading_company,
+                    "last_seen_at": stmt.excluded.last_seen_at,
+                    "analyzed_at": case(
+                        (changed, null()), else_=ActiveListing.analyzed_at
+                    ),
+                },
+            )
+            if sqlite:
+                session.execute(stmt)
+                continue
+            # xmax is zero only for rows this statement inserted
+            stmt = stmt.returning(literal_column("xmax = 0").label("inserted"))
+            for (inserted,) in session.execute(stmt):
+                counts["inserted" if inserted else "updated"] += 1
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    return counts
+
+
+async def async_bulk_upsert_active_listings(
+    session, listings, chunk_size=BULK_CHUNK_SIZE
+):
+    """
+    bulk_upsert_active_listings for an AsyncSession; the same statements
+    run on the async connection without blocking the event loop.
+    """
+    return await session.run_sync(bulk_upsert_active_listings, listings, chunk_size)
+
+
 # New function to add a sold listing
+def _stored_sold_item_ids(session, item_ids):
+    """The source_item_ids among `item_ids` that sold_listings already has."""
+    stored = set()
+    for chunk in chunked(list(item_ids), BULK_CHUNK_SIZE):
+        stored.update(
+            session.execute(
+                select(SoldListing.source_item_id).where(
+                    SoldListing.source_item_id.in_(chunk)
+                )
+            ).scalars()
+        )
+    return stored
+
+
 def add_sold_listing_to_db(session, card_id, sale_data):
+    # The same item is the same sale, whatever sale_date it comes back with
+    if sale_data["source_item_id"] is not None and _stored_sold_item_ids(
+        session, [sale_data["source_item_id"]]
+    ):
+        return
     try:
         sold_listing = SoldListing(
             card_id=card_id,
@@ -256,10 +951,86 @@ def add_sold_listing_to_db(session, card_id, sale_data):
             grading_company=sale_data["grading_company"],
         )
         session.add(sold_listing)
+        session.flush()
+        from database.comp_window import record_window_sales
+        from database.sketches import record_daily_sketches
+
+        new_sales = [{**sale_data, "card_id": card_id}]
+        record_window_sales(session, new_sales)
+        record_daily_sketches(session, new_sales)
         session.commit()
     except Exception as e:
         session.rollback()
         raise e
+    invalidate_comps([(card_id, sale_data["grade"], sale_data["grading_company"])])
+
+
+def bulk_add_sold_listings(session, sales, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Insert many sold listings at once, skipping any source_item_id already
+    stored or repeated in `sales`, even with a different sale_date. Each
+    sale dict must carry its resolved "card_id". Rows are written with one
+    INSERT ... ON CONFLICT DO NOTHING per chunk and the session is committed
+    once at the end. Returns the number of rows that were actually new.
+    """
+    stored = _stored_sold_item_ids(
+        session, {sale["source_item_id"] for sale in sales} - {None}
+    )
+    unique_sales, seen = [], set()
+    for sale_data in sales:
+        item_id = sale_data["source_item_id"]
+        if item_id is not None:
+            if item_id in stored or item_id in seen:
+                continue
+            seen.add(item_id)
+        unique_sales.append(sale_data)
+    rows = [
+        {
+            "card_id": sale_data["card_id"],
+            "sale_price": sale_data["sale_price"],
+            "currency": sale_data.get("currency", "USD"),
+            "sale_date": _as_datetime(sale_data["sale_date"]),
+            "source": sale_data["source"],
+            "source_item_id": sale_data["source_item_id"],
+            "source_url": sale_data.get("source_url"),
+            "grade": sale_data.get("grade"),
+            "grading_company": sale_data.get("grading_company"),
+        }
+        for sale_data in unique_sales
+    ]
+
+    from database.comp_window import record_window_sales
+    from database.sketches import record_daily_sketches
+
+    new_count = 0
+    try:
+        for chunk in chunked(rows, chunk_size):
+            stmt = (
+                _insert(session, SoldListing)
+                .values(chunk)
+                .on_conflict_do_nothing(
+                    index_elements=[SoldListing.source_item_id, SoldListing.sale_date]
+                )
+                .returning(
+                    SoldListing.card_id,
+                    SoldListing.grade,
+                    SoldListing.grading_company,
+                    SoldListing.sale_price,
+                    SoldListing.sale_date,
+                )
+            )
+            new_sales = [row._asdict() for row in session.execute(stmt)]
+            new_count += len(new_sales)
+            # Same transaction, so the comp windows and sketches never drift
+            record_window_sales(session, new_sales)
+            record_daily_sketches(session, new_sales)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise e
+    if new_count:
+        invalidate_comps(map(_sale_card_key, rows))
+    return new_count
 
 
 def get_last_run_timestamp(site_name, data_type):
@@ -297,6 +1068,50 @@ def update_last_run_timestamp(site_name, data_type, timestamp_iso):
         session.close()
 
 
+def bulk_add_valuations(session, valuations, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Insert many card valuations in one transaction, relying on the
+    _valuation_uc constraint with ON CONFLICT DO NOTHING to skip duplicates.
+    Each valuation dict must carry its resolved "card_id".
+    Returns a dict with "new" and "duplicate" counts for the batch.
+    """
+    rows = [
+        {
+            "card_id": valuation["card_id"],
+            "estimated_value": valuation["estimated_value"],
+            "currency": valuation.get("currency", "USD"),
+            "valuation_date": valuation["valuation_date"],
+            "source": valuation["source"],
+            "valuation_type": valuation.get("valuation_type"),
+            "source_url_to_valuation_info": valuation.get(
+                "source_url_to_valuation_info"
+            ),
+            "grade": valuation.get("grade"),
+            "grading_company": valuation.get("grading_company"),
+            "raw_card_name_from_source": valuation.get("raw_card_name_from_source"),
+        }
+        for valuation in valuations
+    ]
+
+    new_count = 0
+    try:
+        for chunk in chunked(rows, chunk_size):
+            stmt = (
+                _insert(session, CardValuation)
+                .values(chunk)
+                .on_conflict_do_nothing(
+                    **_conflict_target(session, "_valuation_uc", _VALUATION_UC_COLUMNS)
+                )
+                .returning(CardValuation.id)
+            )
+            new_count += len(session.execute(stmt).all())
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    return {"new": new_count, "duplicate": len(rows) - new_count}
+
+
 def add_valuation(
     card_id,
     estimated_value,
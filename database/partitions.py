@@ -0,0 +1,351 @@
+# database/partitions.py
+"""
+Monthly partitions for sold_listings and rollup-based retention.
+
+On PostgreSQL, sold_listings is range-partitioned by sale_date month
+(migration 4 converts existing tables). Rows without a matching month, and
+rows with no sale_date, land in the default partition. Queries that filter
+on sale_date, like the analyzer's comp lookups, only scan the newest
+partitions.
+
+Raw sales older than SOLD_RETENTION_DAYS are rolled up into
+sold_listing_daily_summaries (one row per card/grade/company/day) and then
+dropped, so the hot table stays roughly the size of the retention window.
+A day's median_price is exact when its sales are rolled up in one pass;
+when a later pass adds more sales to the same day, the two medians are
+averaged weighted by their counts, which only approximates the median.
+For quantiles of old days use the daily sketches (database/sketches.py).
+On SQLite the table stays unpartitioned and only the rollup applies.
+"""
+import logging
+import os
+import statistics
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database.models import (
+    _SOLD_SUMMARY_UC_COLUMNS,
+    SoldListing,
+    SoldListingDailySummary,
+    _null_safe,
+    get_engine,
+)
+
+# Raw sold rows older than this are compacted into daily summaries.
+# Keep it above the longest comp window the analyzer or dashboard offers.
+SOLD_RETENTION_DAYS = int(os.getenv("SOLD_RETENTION_DAYS", 365))
+# Months ahead of the current one that always have a partition ready
+PARTITION_MONTHS_AHEAD = int(os.getenv("SOLD_PARTITION_MONTHS_AHEAD", 3))
+
+DEFAULT_PARTITION = "sold_listings_default"
+
+_ROLLUP_SQL = """
+INSERT INTO sold_listing_daily_summaries AS s (
+    card_id, grade, grading_company, sale_day,
+    sales_count, min_price, max_price, median_price, total_price
+)
+SELECT card_id, grade, grading_company, CAST(sale_date AS DATE),
+       count(*), min(sale_price), max(sale_price),
+       percentile_cont(0.5) WITHIN GROUP (ORDER BY sale_price),
+       sum(sale_price)
+FROM {table}
+WHERE {where} AND card_id IS NOT NULL AND sale_date IS NOT NULL
+GROUP BY card_id, grade, grading_company, CAST(sale_date AS DATE)
+ON CONFLICT (card_id, grade, grading_company, sale_day) DO UPDATE SET
+    sales_count = s.sales_count + excluded.sales_count,
+    min_price = least(s.min_price, excluded.min_price),
+    max_price = greatest(s.max_price, excluded.max_price),
+    -- exact medians do not merge; weight the two by their sale counts
+    median_price = (s.median_price * s.sales_count
+                    + excluded.median_price * excluded.sales_count)
+                   / (s.sales_count + excluded.sales_count),
+    total_price = s.total_price + excluded.total_price
+"""
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"sold_listings_{month:%Y_%m}"
+
+
+def _month_of_partition(name):
+    """Parse the month back out of a sold_listings_YYYY_MM table name."""
+    try:
+        return datetime.strptime(name, "sold_listings_%Y_%m").date()
+    except ValueError:
+        return None
+
+
+def is_partitioned(conn):
+    if conn.dialect.name != "postgresql":
+        return False
+    return conn.execute(
+        text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+            "JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = 'sold_listings')"
+        )
+    ).scalar()
+
+
+def list_month_partitions(conn):
+    """Return the months that have a partition, oldest first."""
+    names = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'sold_listings'"
+        )
+    ).scalars()
+    return sorted(m for m in map(_month_of_partition, names) if m is not None)
+
+
+def _create_month_partition(conn, month):
+    """
+    Create and attach the partition for `month`, first moving any rows that
+    already landed in the default partition for that range.
+    """
+    name = partition_name(month)
+    bounds = {"lower": month, "upper": next_month(month)}
+    conn.execute(text(f"CREATE TABLE {name} (LIKE sold_listings INCLUDING DEFAULTS)"))
+    conn.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            "WHERE sale_date >= :lower AND sale_date < :upper RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ),
+        bounds,
+    )
+    conn.execute(
+        text(
+            f"ALTER TABLE sold_listings ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{bounds['lower']}') TO ('{bounds['upper']}')"
+        )
+    )
+
+
+def ensure_sold_listing_partitions(
+    engine=None, months_ahead=PARTITION_MONTHS_AHEAD, days=()
+):
+    """
+    Make sure partitions exist from the current month through `months_ahead`,
+    and for the month of every date in `days` (e.g. the sales a backfill is
+    about to load, so they do not pile up in the default partition).
+    Returns the months that were created.
+    """
+    engine = engine or get_engine()
+    created = []
+    months = {month_start(day) for day in days}
+    month = month_start(datetime.now(timezone.utc).date())
+    for _ in range(months_ahead + 1):
+        months.add(month)
+        month = next_month(month)
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return created
+        existing = set(list_month_partitions(conn))
+        for month in sorted(months - existing):
+            _create_month_partition(conn, month)
+            created.append(month)
+    return created
+
+
+def partition_sold_listings(conn, months_ahead=PARTITION_MONTHS_AHEAD):
+    """
+    Convert a plain sold_listings table into one range-partitioned by
+    sale_date month, copying existing rows. Used by schema migration 4.
+    """
+    if conn.dialect.name != "postgresql" or is_partitioned(conn):
+        return
+    sequence = conn.execute(
+        text("SELECT pg_get_serial_sequence('sold_listings', 'id')")
+    ).scalar()
+    months = set(
+        conn.execute(
+            text(
+                "SELECT DISTINCT CAST(date_trunc('month', sale_date) AS DATE) "
+                "FROM sold_listings WHERE sale_date IS NOT NULL"
+            )
+        ).scalars()
+    )
+    month = month_start(datetime.now(timezone.utc).date())
+    for _ in range(months_ahead + 1):
+        months.add(month)
+        month = next_month(month)
+
+    # The id sequence must survive dropping the old table
+    conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+    conn.execute(
+        text(
+            "CREATE TABLE sold_listings_partitioned "
+            "(LIKE sold_listings INCLUDING DEFAULTS) PARTITION BY RANGE (sale_date)"
+        )
+    )
+    conn.execute(
+        text(
+            f"CREATE TABLE {DEFAULT_PARTITION} "
+            "PARTITION OF sold_listings_partitioned DEFAULT"
+        )
+    )
+    for month in sorted(months):
+        conn.execute(
+            text(
+                f"CREATE TABLE {partition_name(month)} PARTITION OF "
+                "sold_listings_partitioned "
+                f"FOR VALUES FROM ('{month}') TO ('{next_month(month)}')"
+            )
+        )
+    conn.execute(
+        text("INSERT INTO sold_listings_partitioned SELECT * FROM sold_listings")
+    )
+    conn.execute(text("DROP TABLE sold_listings"))
+    conn.execute(text("ALTER TABLE sold_listings_partitioned RENAME TO sold_listings"))
+    conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY sold_listings.id"))
+
+    # Unique constraints on a partitioned table must include sale_date
+    conn.execute(
+        text(
+            "ALTER TABLE sold_listings ADD CONSTRAINT sold_listings_id_sale_date_key "
+            "UNIQUE (id, sale_date)"
+        )
+    )
+    conn.execute(
+        text(
+            "ALTER TABLE sold_listings ADD CONSTRAINT _sold_item_uc "
+            "UNIQUE (source_item_id, sale_date)"
+        )
+    )
+    conn.execute(text("CREATE INDEX ix_sold_listings_id ON sold_listings (id)"))
+    conn.execute(
+        text("CREATE INDEX ix_sold_listings_card_id ON sold_listings (card_id)")
+    )
+    conn.execute(
+        text(
+            "CREATE INDEX ix_sold_listings_source_item_id "
+            "ON sold_listings (source_item_id)"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE INDEX ix_sold_listings_comp ON sold_listings "
+            "(card_id, grade, grading_company, sale_date DESC)"
+        )
+    )
+
+
+def _rollup_sqlite(conn, cutoff):
+    """
+    SQLite has no percentile_cont, so group old rows and take medians in
+    Python, then merge them into the summaries like _ROLLUP_SQL does.
+    """
+    groups = {}
+    rows = conn.execute(
+        select(
+            SoldListing.card_id,
+            SoldListing.grade,
+            SoldListing.grading_company,
+            SoldListing.sale_date,
+            SoldListing.sale_price,
+        ).where(
+            SoldListing.sale_date < datetime.combine(cutoff, datetime.min.time()),
+            SoldListing.card_id.is_not(None),
+            SoldListing.sale_date.is_not(None),
+        )
+    )
+    for card_id, grade, company, sale_date, price in rows:
+        groups.setdefault((card_id, grade, company, sale_date.date()), []).append(price)
+    if not groups:
+        return
+    summary = SoldListingDailySummary.__table__
+    stmt = sqlite_insert(summary).values(
+        [
+            {
+                "card_id": card_id,
+                "grade": grade,
+                "grading_company": company,
+                "sale_day": sale_day,
+                "sales_count": len(prices),
+                "min_price": min(prices),
+                "max_price": max(prices),
+                "median_price": statistics.median(prices),
+                "total_price": sum(prices),
+            }
+            for (card_id, grade, company, sale_day), prices in groups.items()
+        ]
+    )
+    new = stmt.excluded
+    conn.execute(
+        stmt.on_conflict_do_update(
+            index_elements=list(map(_null_safe, _SOLD_SUMMARY_UC_COLUMNS)),
+            set_={
+                "sales_count": summary.c.sales_count + new.sales_count,
+                "min_price": func.min(summary.c.min_price, new.min_price),
+                "max_price": func.max(summary.c.max_price, new.max_price),
+                "median_price": (
+                    summary.c.median_price * summary.c.sales_count
+                    + new.median_price * new.sales_count
+                )
+                / (summary.c.sales_count + new.sales_count),
+                "total_price": summary.c.total_price + new.total_price,
+            },
+        )
+    )
+
+
+def compact_sold_listings(horizon_days=SOLD_RETENTION_DAYS, engine=None):
+    """
+    Roll sold rows older than `horizon_days` up into
+    sold_listing_daily_summaries, then drop the raw rows. Whole monthly
+    partitions past the horizon are dropped outright.
+    Returns a dict with the months dropped and the rows rolled up.
+    """
+    engine = engine or get_engine()
+    cutoff = datetime.now(timezone.utc).date() - timedelta(days=horizon_days)
+    result = {"partitions_dropped": [], "rows_compacted": 0}
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            for month in list_month_partitions(conn):
+                if next_month(month) > cutoff:
+                    break
+                name = partition_name(month)
+                result["rows_compacted"] += conn.execute(
+                    text(f"SELECT count(*) FROM {name}")
+                ).scalar()
+                conn.execute(text(_ROLLUP_SQL.format(table=name, where="TRUE")))
+                conn.execute(text(f"DROP TABLE {name}"))
+                result["partitions_dropped"].append(month)
+            # Old rows can also sit in the default partition
+            leftover_table = DEFAULT_PARTITION
+        else:
+            leftover_table = "sold_listings"
+
+        if conn.dialect.name == "sqlite":
+            _rollup_sqlite(conn, cutoff)
+        else:
+            conn.execute(
+                text(
+                    _ROLLUP_SQL.format(
+                        table=leftover_table, where="sale_date < :cutoff"
+                    )
+                ),
+                {"cutoff": cutoff},
+            )
+        result["rows_compacted"] += conn.execute(
+            text(f"DELETE FROM {leftover_table} WHERE sale_date < :cutoff"),
+            {"cutoff": cutoff},
+        ).rowcount
+    logging.info(
+        f"Compacted {result['rows_compacted']} sold rows older than {cutoff}; "
+        f"dropped {len(result['partitions_dropped'])} partition(s)."
+    )
+    return result
@@ -0,0 +1,383 @@
+# database/sketches.py
+"""
+Mergeable daily quantile sketches of sale prices.
+
+Every (card_id, grade, grading_company, sale_day) keeps a t-digest of that
+day's sale prices next to the exact count, sum, sum of squares, min and max.
+Sketches merge without losing the exact figures, so the comps for a window
+of N days (median, any percentile, count, mean, stdev) come from merging at
+most N small sketches instead of rescanning sold_listings. A day's sketch
+is exact until it holds a couple of hundred sales; past that, quantiles
+carry the usual t-digest error of well under 1% of rank.
+
+Sold-ingest paths call record_daily_sketches in the same transaction as the
+insert. A window of N days starts N*24 hours ago, like a scan of the sales:
+its whole UTC days come from sketches and the part of its first day from
+sold_listings. Sketches outlive the raw rows that compaction drops and are
+pruned after SKETCH_RETENTION_DAYS.
+"""
+import bisect
+import math
+import os
+from array import array
+from datetime import datetime, time, timedelta, timezone
+from itertools import chain
+
+from sqlalchemy import delete, select, update
+
+from database.models import (
+    _DAILY_SKETCH_UC_COLUMNS,
+    SoldListing,
+    SoldListingDailySketch,
+    _as_datetime,
+    _conflict_target,
+    _insert,
+    chunked,
+    current_utc_time,
+    get_engine,
+    key_condition,
+)
+
+# Higher keeps more centroids per sketch: more accurate, larger rows
+SKETCH_COMPRESSION = int(os.getenv("SKETCH_COMPRESSION", 100))
+# Keys per locking lookup when recording sales
+SKETCH_CHUNK_SIZE = 200
+# Sketches of older days are deleted; keep it above the longest window
+SKETCH_RETENTION_DAYS = int(os.getenv("SKETCH_RETENTION_DAYS", 730))
+
+_sketches = SoldListingDailySketch.__table__
+
+
+class TDigest:
+    """
+    A t-digest of prices plus their exact count, sum, sum of squares, min
+    and max. Add prices with add(), combine sketches with merge().
+    """
+
+    def __init__(self, compression=SKETCH_COMPRESSION):
+        self.compression = compression
+        self.centroids = []  # (mean, weight) pairs sorted by mean
+        self.count = 0
+        self.price_sum = 0.0
+        self.price_sum_sq = 0.0
+        self.min = None
+        self.max = None
+        self._buffer = []
+
+    @classmethod
+    def from_row(cls, row, compression=SKETCH_COMPRESSION):
+        """Load a sketch from a sold_listing_daily_sketches row mapping."""
+        sketch = cls(compression)
+        packed = array("d")
+        packed.frombytes(row["centroids"] or b"")
+        sketch.centroids = list(zip(packed[::2], packed[1::2]))
+        sketch.count = row["sales_count"]
+        sketch.price_sum = row["price_sum"]
+        sketch.price_sum_sq = row["price_sum_sq"]
+        sketch.min = row["min_price"]
+        sketch.max = row["max_price"]
+        return sketch
+
+    def to_values(self):
+        """Column values for storing the sketch."""
+        self._compress()
+        return {
+            "sales_count": self.count,
+            "price_sum": self.price_sum,
+            "price_sum_sq": self.price_sum_sq,
+            "min_price": self.min,
+            "max_price": self.max,
+            "centroids": array("d", chain.from_iterable(self.centroids)).tobytes(),
+            "updated_at": current_utc_time(),
+        }
+
+    def add(self, price):
+        price = float(price)
+        self._buffer.append((price, 1))
+        self.count += 1
+        self.price_sum += price
+        self.price_sum_sq += price * price
+        self.min = price if self.min is None else min(self.min, price)
+        self.max = price if self.max is None else max(self.max, price)
+        if len(self._buffer) > 5 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        if not other.count:
+            return self
+        self._buffer.extend(other.centroids)
+        self._buffer.extend(other._buffer)
+        self.count += other.count
+        self.price_sum += other.price_sum
+        self.price_sum_sq += other.price_sum_sq
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        if len(self._buffer) > 5 * self.compression:
+            self._compress()
+        return self
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        points = sorted(self.centroids + self._buffer)
+        self._buffer = []
+        total = sum(weight for _, weight in points)
+        merged = [list(points[0])]
+        before = 0  # weight of the centroids ahead of merged[-1]
+        for mean, weight in points[1:]:
+            last = merged[-1]
+            # Centroids near the median may grow, those in the tails stay small
+            q = (before + (last[1] + weight) / 2) / total
+            limit = 4 * total * q * (1 - q) / self.compression
+            if last[1] + weight <= max(1, limit):
+                last[1] += weight
+                last[0] += (mean - last[0]) * weight / last[1]
+            else:
+                before += last[1]
+                merged.append([mean, weight])
+        self.centroids = [tuple(c) for c in merged]
+
+    def quantile(self, q):
+        """
+        The q-quantile (0 <= q <= 1), interpolated between neighbouring
+        ranks like statistics.median for the middle of an even count.
+        """
+        self._compress()
+        if not self.count:
+            return None
+        # Each centroid sits at the mean rank of the prices it holds
+        anchors, ranks, seen = [self.min], [0.0], 0
+        for mean, weight in self.centroids:
+            anchors.append(mean)
+            ranks.append(seen + (weight - 1) / 2)
+            seen += weight
+        anchors.append(self.max)
+        ranks.append(seen - 1)
+        rank = q * (self.count - 1)
+        i = bisect.bisect_right(ranks, rank)
+        if i >= len(ranks):
+            return self.max
+        lo, hi = ranks[i - 1], ranks[i]
+        if hi == lo:
+            return anchors[i]
+        return anchors[i - 1] + (anchors[i] - anchors[i - 1]) * (rank - lo) / (hi - lo)
+
+    def stdev(self):
+        """Sample standard deviation of the prices, 0 below two sales."""
+        if self.count < 2:
+            return 0
+        mean = self.price_sum / self.count
+        variance = (self.price_sum_sq - self.price_sum * mean) / (self.count - 1)
+        # Clamp tiny negative values left by floating-point cancellation
+        return math.sqrt(max(variance, 0.0))
+
+    def comp_stats(self):
+        """The comp_stats dict in calculate_comp_stats' format."""
+        if not self.count:
+            return {
+                "median_price": None,
+                "average_price": None,
+                "min_price": None,
+                "max_price": None,
+                "sales_count": 0,
+            }
+        return {
+            "median_price": self.quantile(0.5),
+            "average_price": self.price_sum / self.count,
+            "min_price": self.min,
+            "max_price": self.max,
+            "sales_count": self.count,
+        }
+
+
+def _sale_day(value):
+    value = _as_datetime(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.date()
+
+
+def window_start(days, now=None):
+    """The naive UTC time a window of `days` days starts at."""
+    now = _as_datetime(now) or datetime.now(timezone.utc)
+    if now.tzinfo is not None:
+        now = now.astimezone(timezone.utc).replace(tzinfo=None)
+    return now - timedelta(days=days)
+
+
+def first_window_day(days, now=None):
+    """The oldest sale_day a window of `days` days covers in full."""
+    return window_start(days, now).date() + timedelta(days=1)
+
+
+def record_daily_sketches(session, sales):
+    """
+    Add newly inserted sales to their daily sketches. `sales` are dicts with
+    card_id, grade, grading_company, sale_price and sale_date. Runs in the
+    caller's transaction and locks the affected sketch rows.
+    """
+    prices_by_key = {}
+    for sale in sales:
+        if sale["card_id"] is None or sale["sale_price"] is None:
+            continue
+        if sale["sale_date"] is None:
+            continue
+        key = (
+            sale["card_id"],
+            sale.get("grade"),
+            sale.get("grading_company"),
+            _sale_day(sale["sale_date"]),
+        )
+        prices_by_key.setdefault(key, []).append(sale["sale_price"])
+    columns = ("card_id", "grade", "grading_company", "sale_day")
+    for chunk in chunked(sorted(prices_by_key, key=repr), SKETCH_CHUNK_SIZE):
+        # Make sure every key has a row to lock, then lock them in id order
+        session.execute(
+            _insert(session, SoldListingDailySketch)
+            .values([dict(zip(columns, key)) for key in chunk])
+            .on_conflict_do_nothing(
+                **_conflict_target(
+                    session, "_daily_sketch_uc", _DAILY_SKETCH_UC_COLUMNS
+                )
+            )
+        )
+        rows = session.execute(
+            select(_sketches)
+            .where(key_condition(_DAILY_SKETCH_UC_COLUMNS, chunk))
+            .order_by(_sketches.c.id)
+            .with_for_update()
+        ).mappings()
+        for row in rows.all():
+            prices = prices_by_key.get(tuple(row[c] for c in columns))
+            if not prices:
+                continue
+            sketch = TDigest.from_row(row)
+            for price in prices:
+                sketch.add(price)
+            session.execute(
+                update(_sketches)
+                .where(_sketches.c.id == row["id"])
+                .values(**sketch.to_values())
+            )
+
+
+def rebuild_daily_sketches(conn):
+    """
+    Recompute the daily sketches of every day that still has sales in
+    sold_listings. Used by schema migration 6. Days whose raw rows were
+    compacted away keep their sketches. Sales are streamed in key order so
+    only one day's sketch is held at a time. Returns the number of
+    sketches written.
+    """
+    sales = conn.execute(
+        select(
+            SoldListing.card_id,
+            SoldListing.grade,
+            SoldListing.grading_company,
+            SoldListing.sale_date,
+            SoldListing.sale_price,
+        )
+        .where(
+            SoldListing.card_id.is_not(None),
+            SoldListing.sale_price.is_not(None),
+            SoldListing.sale_date.is_not(None),
+        )
+        .order_by(
+            SoldListing.card_id,
+            SoldListing.grade,
+            SoldListing.grading_company,
+            SoldListing.sale_date,
+        )
+        .execution_options(yield_per=5000)
+    )
+    columns = ("card_id", "grade", "grading_company", "sale_day")
+    pending, written = [], 0
+    key, sketch = None, None
+    for card_id, grade, grading_company, sale_date, sale_price in sales:
+        row_key = (card_id, grade, grading_company, _sale_day(sale_date))
+        if row_key != key:
+            if sketch is not None:
+                pending.append(dict(zip(columns, key)) | sketch.to_values())
+            key, sketch = row_key, TDigest()
+        sketch.add(sale_price)
+        if len(pending) >= 500:
+            _replace_sketches(conn, pending)
+            written += len(pending)
+            pending = []
+    if sketch is not None:
+        pending.append(dict(zip(columns, key)) | sketch.to_values())
+    if pending:
+        _replace_sketches(conn, pending)
+        written += len(pending)
+    return written
+
+
+def _replace_sketches(conn, rows):
+    stmt = _insert(conn, SoldListingDailySketch).values(rows)
+    key_names = {column.name for column in _DAILY_SKETCH_UC_COLUMNS}
+    conn.execute(
+        stmt.on_conflict_do_update(
+            **_conflict_target(conn, "_daily_sketch_uc", _DAILY_SKETCH_UC_COLUMNS),
+            set_={
+                name: stmt.excluded[name] for name in rows[0] if name not in key_names
+            },
+        )
+    )
+
+
+def prune_daily_sketches(retention_days=SKETCH_RETENTION_DAYS, engine=None):
+    """Delete sketches of days older than `retention_days`; returns how many."""
+    engine = engine or get_engine()
+    with engine.begin() as conn:
+        return conn.execute(
+            delete(_sketches).where(
+                _sketches.c.sale_day < first_window_day(retention_days)
+            )
+        ).rowcount
+
+
+def read_window_sketches(session, keys, days, now=None):
+    """
+    Merge the sketches of the last `days` days for each
+    (card_id, grade, grading_company) key, plus the sales on the window's
+    first, partial day. Returns {key: TDigest} for keys with any sales in
+    the window.
+    """
+    merged = {}
+    start = window_start(days, now)
+    first_day = first_window_day(days, now)
+    for chunk in chunked(list(keys), SKETCH_CHUNK_SIZE):
+        rows = session.execute(
+            select(_sketches)
+            .where(
+                key_condition(_DAILY_SKETCH_UC_COLUMNS[:3], chunk),
+                _sketches.c.sale_day >= first_day,
+            )
+            .order_by(_sketches.c.sale_day)
+        ).mappings()
+        for row in rows:
+            key = (row["card_id"], row["grade"], row["grading_company"])
+            merged.setdefault(key, TDigest()).merge(TDigest.from_row(row))
+        sales = session.execute(
+            select(
+                SoldListing.card_id,
+                SoldListing.grade,
+                SoldListing.grading_company,
+                SoldListing.sale_price,
+            ).where(
+                key_condition(
+                    (
+                        SoldListing.card_id,
+                        SoldListing.grade,
+                        SoldListing.grading_company,
+                    ),
+                    chunk,
+                ),
+                SoldListing.sale_date >= start,
+                SoldListing.sale_date < datetime.combine(first_day, time()),
+                SoldListing.sale_price.is_not(None),
+            )
+        )
+        for *key, sale_price in sales:
+            merged.setdefault(tuple(key), TDigest()).add(sale_price)
+    return merged
@@ -1,37 +1,44 @@
-import asyncio
+import logging
 import time
 from datetime import datetime  # Removed timedelta as it is unused
 
 from aiohttp import ClientSession
 from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy import select
 
-from collector.adapters.ebay import fetch_cards  # Import _call
+from collector.crawl import crawl_queries
+from database.comp_window import expire_comp_windows
 from database.models import ActiveListing  # Added imports
-from database.models import add_active_listing_to_db, add_card_definition, get_session
+from database.models import get_async_session, run_async
+from database.partitions import compact_sold_listings, ensure_sold_listing_partitions
+from database.sketches import prune_daily_sketches
 
 
 async def fetch_new_listings(saved_queries):  # Make async
     """
     Fetch new listings from saved searches and add them to the database.
+    Queries run concurrently on one pooled HTTP session (see
+    collector.crawl), so one query's database writes overlap the others'
+    eBay requests.
 
     Args:
         saved_queries (list): A list of search queries.
+
+    Returns:
+        dict: {query: exception} for the queries that failed.
     """
-    session = get_session()  # This session is for synchronous DB operations
-    try:
-        for query in saved_queries:
-            listings = await fetch_cards(
-                query
-            )  # Await async call, ensure fetch_cards returns standardized dicts
-            for listing in listings:
-                card_id = add_card_definition(listing)
-                add_active_listing_to_db(session, card_id, listing)
-        session.commit()
-    except Exception as e:
-        session.rollback()
-        raise e
-    finally:
-        session.close()
+    results = await crawl_queries(saved_queries)
+    failures = {}
+    for query, result in results.items():
+        if isinstance(result, Exception):
+            logging.error(f"Error crawling query '{query}'", exc_info=result)
+            failures[query] = result
+        else:
+            print(
+                f"Query '{query}': {result['inserted']} new, "
+                f"{result['updated']} updated listings."
+            )
+    return failures
 
 
 async def refresh_existing_listings():  # Make async
@@ -39,11 +46,10 @@ async def refresh_existing_listings():  # Make async
     Refresh existing listings by querying the ActiveListing table.
     Update listing_price and last_seen_at, and remove inactive listings.
     """
-    session = get_session()
     # Create an aiohttp session for async eBay calls
-    async with ClientSession() as http_session:
+    async with ClientSession() as http_session, get_async_session() as session:
         try:
-            active_listings = session.query(ActiveListing).all()
+            active_listings = (await session.scalars(select(ActiveListing))).all()
             for listing in active_listings:
                 # Define fetch_item_details inline as a placeholder
                 async def fetch_item_details(http_session, source_item_id):
@@ -54,19 +60,20 @@ async def refresh_existing_listings():  # Make async
                     http_session, listing.source_item_id
                 )
                 if response and response.get("price"):
-                    listing.listing_price = float(response["price"]["value"])
+                    price = float(response["price"]["value"])
+                    if price != listing.listing_price:
+                        # A new price needs a new verdict
+                        listing.analyzed_at = None
+                    listing.listing_price = price
                     listing.last_seen_at = datetime.utcnow()
-                    session.add(listing)
                 else:
                     print(f"Listing {listing.source_item_id} not found. Deleting.")
-                    session.delete(listing)
-            session.commit()
+                    await session.delete(listing)
+            await session.commit()
         except Exception as e:
-            session.rollback()
+            await session.rollback()
             print(f"Error refreshing listings: {e}")  # Log error
             # raise e # Optionally re-raise
-        finally:
-            session.close()
 
 
 async def run_daily_sync():
@@ -75,22 +82,45 @@ async def run_daily_sync():
         "psa 10 griffey rookie",
         "psa 10 topps chrome",
     ]  # Example queries
-    await fetch_new_listings(saved_queries)
+    failures = await fetch_new_listings(saved_queries)
     await refresh_existing_listings()
+    if failures:
+        # Fail the job so the scheduler reports it
+        raise RuntimeError(
+            f"{len(failures)} of {len(saved_queries)} saved queries failed: "
+            + ", ".join(failures)
+        )
 
 
 def run_daily_sync_sync():
     """Synchronous wrapper for the async run_daily_sync function."""
-    asyncio.run(run_daily_sync())
+    run_async(run_daily_sync())
+
+
+def run_sold_listing_maintenance():
+    """
+    Keep sold_listings partitions ahead of time, compact old sales, drop
+    aged-out sales from the rolling comp windows and prune old sketches.
+    """
+    ensure_sold_listing_partitions()
+    compact_sold_listings()
+    expire_comp_windows()
+    prune_daily_sketches()
 
 
 def schedule_jobs():
-    """Schedule the daily sync job."""
+    """Schedule the daily sync and sold-listing maintenance jobs."""
     scheduler = BackgroundScheduler()
     # Run once immediately then at interval
     scheduler.add_job(
         run_daily_sync_sync, "interval", days=1, next_run_time=datetime.now()
     )
+    scheduler.add_job(
+        run_sold_listing_maintenance,
+        "interval",
+        days=1,
+        next_run_time=datetime.now(),
+    )
     scheduler.start()
 
     print("Scheduler started. Press Ctrl+C to exit.")
@@ -0,0 +1,118 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import database.models as models
+from database.models import bulk_add_sold_listings, get_session, init_db
+
+
+def _use_database(monkeypatch, database_url):
+    monkeypatch.setenv("DATABASE_URL", database_url)
+    models._reset_engine_after_fork()
+    models.clear_card_cache()
+    init_db()
+
+
+def _release_database():
+    models._reset_engine_after_fork()
+    models.clear_card_cache()
+
+
+def _postgres_url():
+    database_url = os.getenv("TEST_DATABASE_URL")
+    if not database_url:
+        pytest.skip("TEST_DATABASE_URL (a disposable PostgreSQL database) is not set")
+    return database_url
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """Point the models at a fresh SQLite file for one test."""
+    _use_database(monkeypatch, f"sqlite:///{tmp_path / 'cards.db'}")
+    yield
+    _release_database()
+
+
+@pytest.fixture
+def postgres_db(monkeypatch):
+    """
+    Point the models at TEST_DATABASE_URL, a disposable PostgreSQL database,
+    for one test; skipped when it is not set. Never the configured database.
+    """
+    _use_database(monkeypatch, _postgres_url())
+    yield
+    _release_database()
+
+
+@pytest.fixture(scope="module", params=["sqlite", "postgresql"])
+def module_db(request, tmp_path_factory):
+    """
+    A throwaway database shared by a module's tests, which run once on a
+    fresh SQLite file and once on TEST_DATABASE_URL (skipped if unset).
+    """
+    if request.param == "sqlite":
+        database_url = f"sqlite:///{tmp_path_factory.mktemp('db') / 'cards.db'}"
+    else:
+        database_url = _postgres_url()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        _use_database(monkeypatch, database_url)
+        yield
+        _release_database()
+
+
+def in_session(call, *args):
+    """call(session, *args) on a fresh session, which is then closed."""
+    session = get_session()
+    try:
+        return call(session, *args)
+    finally:
+        session.close()
+
+
+def sold_sales(
+    card_id,
+    prices,
+    ages=None,
+    grade="PSA 10",
+    grading_company="PSA",
+    prefix="s",
+    now=None,
+):
+    """
+    Sold listing dicts for one card, one per price, sold `ages` (days or
+    timedeltas; by default 1, 2, 3... days) before `now` (naive UTC by
+    default).
+    """
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    ages = range(1, len(prices) + 1) if ages is None else ages
+    return [
+        {
+            "card_id": card_id,
+            "grade": grade,
+            "grading_company": grading_company,
+            "sale_price": price,
+            "sale_date": now
+            - (age if isinstance(age, timedelta) else timedelta(days=age)),
+            "source": "ebay",
+            "source_item_id": f"{prefix}-{card_id}-{i}",
+        }
+        for i, (price, age) in enumerate(zip(prices, ages))
+    ]
+
+
+def add_sold(sales):
+    """Store sales through bulk_add_sold_listings; returns rows inserted."""
+    return in_session(bulk_add_sold_listings, sales)
+
+
+def active_listing(card_id, price, grade="PSA 10"):
+    """An eBay active listing dict for bulk_upsert_active_listings."""
+    return {
+        "card_id": card_id,
+        "listing_price": price,
+        "source": "ebay",
+        "source_item_id": f"a-{card_id}",
+        "grade": grade,
+        "grading_company": "PSA",
+    }
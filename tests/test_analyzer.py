@@ -1,7 +1,11 @@
+from datetime import datetime
+from unittest.mock import patch
+
 import pytest
 
 from analyzer.analyzer import calculate_comp_stats
-from database.models import SoldListing, get_session
+from database.models import SoldListing, SoldListingDailySketch, get_engine, get_session
+from database.sketches import rebuild_daily_sketches
 
 
 # Mock analyze_listing for testing
@@ -23,11 +27,13 @@ def analyze_listing(listing_details):
 
 
 @pytest.fixture(scope="module", autouse=True)
-def setup_mock_data():
+def setup_mock_data(module_db):
     session = get_session()
     try:
-        # Clear existing data
+        # Clear earlier runs' data; rebuilds keep sketches of days with no
+        # raw rows
         session.query(SoldListing).delete()
+        session.query(SoldListingDailySketch).delete()
 
         # Add mock data for card_id 1
         session.add_all(
@@ -37,28 +43,28 @@ def setup_mock_data():
                     grade="PSA 9",
                     grading_company="PSA",
                     sale_price=1500,
-                    sale_date="2025-05-01",
+                    sale_date=datetime(2025, 5, 1),
                 ),
                 SoldListing(
                     card_id=1,
                     grade="PSA 9",
                     grading_company="PSA",
                     sale_price=1600,
-                    sale_date="2025-04-25",
+                    sale_date=datetime(2025, 4, 25),
                 ),
                 SoldListing(
                     card_id=1,
                     grade="PSA 9",
                     grading_company="PSA",
                     sale_price=1550,
-                    sale_date="2025-04-20",
+                    sale_date=datetime(2025, 4, 20),
                 ),
                 SoldListing(
                     card_id=1,
                     grade="PSA 9",
                     grading_company="PSA",
                     sale_price=1620,
-                    sale_date="2025-04-15",
+                    sale_date=datetime(2025, 4, 15),
                 ),
             ]
         )
@@ -71,7 +77,7 @@ def setup_mock_data():
                     grade="PSA 8",
                     grading_company="PSA",
                     sale_price=50,
-                    sale_date="2025-04-10",
+                    sale_date=datetime(2025, 4, 10),
                 ),
             ]
         )
@@ -79,6 +85,9 @@ def setup_mock_data():
         session.commit()
     finally:
         session.close()
+    # The mock sales bypass the ingest paths, so derive the stored comps
+    with get_engine().begin() as conn:
+        rebuild_daily_sketches(conn)
 
 
 # Test calculate_comp_stats
@@ -167,3 +176,289 @@ def test_calculate_comp_stats(sales_history, expected):
 def test_analyze_listing(listing_details, expected_message):
     result = analyze_listing(listing_details)
     assert expected_message in result["message"]
+
+
+def test_analyze_listings_matches_analyze_listing():
+    from analyzer.analyzer import analyze_listing as real_analyze_listing
+    from analyzer.analyzer import analyze_listings
+
+    listings = [
+        {
+            "card_id": 1,
+            "listing_price": 1300,
+            "grade": "PSA 9",
+            "grading_company": "PSA",
+        },
+        {
+            "card_id": 1,
+            "listing_price": 1650,
+            "grade": "PSA 9",
+            "grading_company": "PSA",
+        },
+        {
+            "card_id": 999,
+            "listing_price": 50,
+            "grade": "PSA 8",
+            "grading_company": "PSA",
+        },
+        {"card_id": 1, "listing_price": 200, "grade": "Raw", "grading_company": None},
+    ]
+    batch = analyze_listings(listings, historical_days=3650)
+    single = [real_analyze_listing(dict(x), historical_days=3650) for x in listings]
+    assert [r["message"] for r in batch] == [r["message"] for r in single]
+    assert batch[0]["is_potentially_undervalued"] is True
+    assert batch[1]["is_potentially_undervalued"] is False
+
+    from analyzer.parallel import analyze_listings_parallel
+
+    sharded = analyze_listings_parallel(listings, workers=2, historical_days=3650)
+    assert [(r["message"], r["comp_stats"]) for r in sharded] == [
+        (r["message"], r["comp_stats"]) for r in batch
+    ]
+
+
+def test_analyze_listings_writes_back_by_listing_id():
+    from analyzer.analyzer import analyze_listings
+    from database.models import ActiveListing
+
+    session = get_session()
+    try:
+        session.query(ActiveListing).filter(
+            ActiveListing.source_item_id.in_(["batch-1", "batch-2"])
+        ).delete()
+        listings = [
+            ActiveListing(
+                card_id=1,
+                listing_price=price,
+                grade="PSA 9",
+                grading_company="PSA",
+                source_item_id=source_item_id,
+            )
+            for price, source_item_id in ((1300, "batch-1"), (1650, "batch-2"))
+        ]
+        session.add_all(listings)
+        session.commit()
+        listing_ids = [listing.id for listing in listings]
+    finally:
+        session.close()
+
+    listing = {"card_id": 1, "grade": "PSA 9", "grading_company": "PSA"}
+    analyze_listings(
+        [
+            {**listing, "id": listing_ids[0], "listing_price": 1300},
+            # Listings without an id are matched on source_item_id
+            {**listing, "source_item_id": "batch-2", "listing_price": 1650},
+        ],
+        historical_days=3650,
+    )
+    session = get_session()
+    try:
+        stored = [session.get(ActiveListing, i) for i in listing_ids]
+        assert [(s.comp_value, s.is_undervalued) for s in stored] == [
+            (1575, True),
+            (1575, False),
+        ]
+        # One run, one timestamp
+        assert stored[0].analyzed_at is not None
+        assert stored[0].analyzed_at == stored[1].analyzed_at
+    finally:
+        session.close()
+
+
+def test_listing_without_a_key_updates_nothing():
+    from analyzer.analyzer import analyze_listing as real_analyze_listing
+    from database.models import ActiveListing
+
+    session = get_session()
+    try:
+        session.query(ActiveListing).filter_by(source_item_id="keyless-1").delete()
+        stored = ActiveListing(
+            card_id=1,
+            listing_price=1300,
+            grade="PSA 9",
+            grading_company="PSA",
+            source_item_id="keyless-1",
+        )
+        session.add(stored)
+        session.commit()
+        listing_id = stored.id
+    finally:
+        session.close()
+
+    result = real_analyze_listing(
+        {
+            "card_id": 1,
+            "listing_price": 1300,
+            "grade": "PSA 9",
+            "grading_company": "PSA",
+        },
+        historical_days=3650,
+    )
+    assert result["is_potentially_undervalued"] is True
+    session = get_session()
+    try:
+        # Same card, grade and price, but not the listing that was analyzed
+        stored = session.get(ActiveListing, listing_id)
+        assert (stored.comp_value, stored.analyzed_at) == (None, None)
+    finally:
+        session.close()
+
+
+def test_comp_cache_hits_and_invalidation():
+    from analyzer.analyzer import analyze_listings
+    from database.models import (
+        bulk_add_sold_listings,
+        clear_comp_cache,
+        comp_cache_info,
+    )
+
+    clear_comp_cache()
+    listing = {
+        "card_id": 999,
+        "listing_price": 50,
+        "grade": "PSA 8",
+        "grading_company": "PSA",
+    }
+    analyze_listings([listing, listing], historical_days=3650)
+    analyze_listings([listing], historical_days=3650)
+    assert comp_cache_info()["hits"] == 1
+    assert comp_cache_info()["misses"] == 1
+
+    session = get_session()
+    try:
+        bulk_add_sold_listings(
+            session,
+            [
+                {
+                    "card_id": 999,
+                    "grade": "PSA 8",
+                    "grading_company": "PSA",
+                    "sale_price": 70,
+                    "sale_date": "2025-04-11T00:00:00",
+                    "source": "test",
+                    "source_item_id": "comp-cache-1",
+                }
+            ],
+        )
+    finally:
+        session.close()
+    assert comp_cache_info()["size"] == 0
+    result = analyze_listings([listing], historical_days=3650)[0]
+    assert result["comp_stats"]["sales_count"] == 2
+
+
+def test_pushdown_matches_python_analysis():
+    from analyzer.analyzer import analyze_listings
+    from analyzer.pushdown import analyze_in_database
+    from database.models import ActiveListing
+
+    if get_engine().dialect.name != "postgresql":
+        pytest.skip("SQL push-down needs PostgreSQL")
+    session = get_session()
+    try:
+        session.query(ActiveListing).delete()
+        listings = [
+            ActiveListing(
+                card_id=card_id,
+                listing_price=price,
+                grade=grade,
+                grading_company="PSA",
+                source_item_id=f"pushdown-{i}",
+            )
+            for i, (card_id, grade, price) in enumerate(
+                [(1, "PSA 9", 1300), (1, "PSA 9", 1650), (999, "PSA 8", 10)]
+            )
+        ]
+        session.add_all(listings)
+        session.commit()
+        details = [
+            {
+                "id": listing.id,
+                "card_id": listing.card_id,
+                "listing_price": listing.listing_price,
+                "grade": listing.grade,
+                "grading_company": listing.grading_company,
+            }
+            for listing in listings
+        ]
+    finally:
+        session.close()
+
+    outcome = analyze_in_database(historical_days=3650)
+    expected = [
+        r
+        for r in analyze_listings(details, historical_days=3650)
+        if r["is_potentially_undervalued"]
+    ]
+    assert outcome["analyzed"] == 3
+    assert len(expected) == 2
+    assert [(r["listing_details"]["id"], r["message"]) for r in outcome["flagged"]] == [
+        (r["listing_details"]["id"], r["message"]) for r in expected
+    ]
+
+
+def test_pushdown_stores_what_the_python_path_stores():
+    from analyzer.blacklist import BlacklistIndex
+    from analyzer.incremental import run_analysis
+    from analyzer.pushdown import analyze_in_database
+    from database.models import ActiveListing
+
+    if get_engine().dialect.name != "postgresql":
+        pytest.skip("SQL push-down needs PostgreSQL")
+    listings = [
+        # (card_id, grade, price, comp_value, is_undervalued) before the run
+        (1, "PSA 9", 1300, None, None),
+        (1, "PSA 9", 1650, None, None),
+        (999, "PSA 8", 10, None, None),
+        (1, "Raw", 200, None, None),
+        # Flagged by an earlier run, before it was blacklisted
+        (1, "PSA 10", 100, 900.0, True),
+    ]
+
+    def reset():
+        session = get_session()
+        try:
+            session.query(ActiveListing).delete()
+            session.add_all(
+                ActiveListing(
+                    card_id=card_id,
+                    grade=grade,
+                    grading_company="PSA",
+                    listing_price=price,
+                    comp_value=comp_value,
+                    is_undervalued=flagged,
+                    source_item_id=f"parity-{i}",
+                )
+                for i, (card_id, grade, price, comp_value, flagged) in enumerate(
+                    listings
+                )
+            )
+            session.commit()
+        finally:
+            session.close()
+
+    def stored():
+        session = get_session()
+        try:
+            return {
+                listing.source_item_id: (
+                    listing.comp_value,
+                    listing.is_undervalued,
+                    listing.analyzed_at is not None,
+                )
+                for listing in session.query(ActiveListing)
+            }
+        finally:
+            session.close()
+
+    blacklist = BlacklistIndex([{"card_id": 1, "grade": "PSA 10"}])
+    reset()
+    with patch("analyzer.pushdown.load_blacklist", return_value=blacklist):
+        analyze_in_database(historical_days=3650)
+    pushed_down = stored()
+    reset()
+    with patch("analyzer.analyzer.load_blacklist", return_value=blacklist):
+        run_analysis(full=True, workers=1, historical_days=3650)
+    assert pushed_down == stored()
+    assert pushed_down["parity-4"] == (900.0, True, True)
+    assert pushed_down["parity-3"] == (None, None, True)
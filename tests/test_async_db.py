@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy import text
+
+import database.models as models
+from database.models import (
+    async_bulk_upsert_active_listings,
+    async_resolve_card_ids,
+    clear_card_cache,
+    get_async_session,
+    resolve_card_ids,
+    run_async,
+)
+
+
+@pytest.mark.asyncio
+async def test_async_resolve_matches_sync(sqlite_db):
+    clear_card_cache()
+    listing = {"player_name": "Async Player", "card_year": 2020, "card_set": "Topps"}
+    async_ids = await async_resolve_card_ids([listing, listing])
+    clear_card_cache()
+    assert resolve_card_ids([listing]) == async_ids[:1]
+    assert async_ids[0] == async_ids[1]
+
+
+@pytest.mark.asyncio
+async def test_async_bulk_upsert_active_listings(sqlite_db):
+    row = {
+        "card_id": 1,
+        "listing_price": 12.0,
+        "source": "eBay",
+        "source_item_id": "async-upsert-1",
+    }
+    async with get_async_session() as session:
+        await async_bulk_upsert_active_listings(session, [row])
+        counts = await async_bulk_upsert_active_listings(
+            session, [{**row, "listing_price": 11.0}]
+        )
+    assert counts == {"inserted": 0, "updated": 1}
+
+
+def test_run_async_disposes_the_loops_engine(sqlite_db):
+    pools = []
+
+    async def query():
+        pools.append(models.get_async_engine().sync_engine.pool)
+        async with get_async_session() as session:
+            return (await session.execute(text("SELECT 1"))).scalar()
+
+    assert [run_async(query()) for _ in range(3)] == [1, 1, 1]
+    # Each run's pooled connection was closed with its loop
+    assert [pool.checkedin() for pool in pools] == [0, 0, 0]
@@ -0,0 +1,51 @@
+import os
+
+from analyzer.blacklist import BlacklistIndex, get_blacklist_index
+
+
+def test_index_matches_card_player_set_and_grade_ranges():
+    index = BlacklistIndex(
+        [
+            {"card_id": 1, "grade": "PSA 9"},
+            {"card_id": 2},
+            {"player": "Mike Trout", "max_grade": 7},
+            {"set": "2011 Topps Update", "grading_company": "BGS", "min_grade": 9},
+            {"grade": None, "min_grade": "bad"},
+        ]
+    )
+    assert index.needs_card_details
+    assert index.matches(1, " psa  9 ")
+    assert not index.matches(1, "PSA 10")
+    # No grade condition: only listings without a grade, as before
+    assert index.matches(2, None)
+    assert not index.matches(2, "Raw")
+    assert not index.matches(2, "PSA 10")
+    assert index.matches(3, "PSA 6", "PSA", player="mike trout")
+    assert not index.matches(3, "PSA 8", "PSA", player="Mike Trout")
+    assert index.matches(4, "BGS 9.5", card_set="2011 Topps Update")
+    assert not index.matches(4, "PSA 10", "PSA", card_set="2011 Topps Update")
+    assert not index.matches(5, "PSA 9")
+
+
+def test_entries_without_a_scope_match_nothing():
+    index = BlacklistIndex([{"grade": "PSA 10"}, {"max_grade": 7}])
+    assert len(index) == 0
+    assert not index.matches(555, "PSA 10")
+    assert not index.matches(999, "PSA 6")
+
+
+def test_index_reloads_only_when_file_changes(tmp_path):
+    path = tmp_path / "blacklist.yaml"
+    path.write_text("- card_id: 1\n  grade: PSA 9\n")
+    first = get_blacklist_index(str(path))
+    assert get_blacklist_index(str(path)) is first
+    assert first.matches(1, "PSA 9")
+
+    path.write_text("- card_id: 2\n  grade: PSA 9\n")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+    reloaded = get_blacklist_index(str(path))
+    assert reloaded is not first
+    assert reloaded.matches(2, "PSA 9") and not reloaded.matches(1, "PSA 9")
+
+    path.unlink()
+    assert len(get_blacklist_index(str(path))) == 0
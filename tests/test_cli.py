@@ -10,12 +10,8 @@ from cli import cli
     "query, limit, token_present, expected_output",
     [
         ("psa 10 topps chrome", 5, True, "Successfully fetched"),
-        (
-            "psa 10 topps chrome",
-            5,
-            False,
-            "Error: EBAY_ACCESS_TOKEN environment variable not set.",
-        ),
+        # The token manager can get a token from EBAY_OAUTH_REFRESH_TOKEN
+        ("psa 10 topps chrome", 5, False, "Successfully fetched"),
     ],
 )
 def test_crawl(query, limit, token_present, expected_output):
@@ -28,17 +24,15 @@ def test_crawl(query, limit, token_present, expected_output):
             {"EBAY_ACCESS_TOKEN": "mocked_token"} if token_present else {},
         ),
     ):
-        if token_present:
-            mock_fetch_cards.return_value = [
-                "Card1",
-                "Card2",
-            ]  # Mocked response
+        mock_fetch_cards.return_value = [
+            "Card1",
+            "Card2",
+        ]  # Mocked response
 
         result = runner.invoke(cli, ["crawl", "--query", query, "--limit", str(limit)])
 
         assert expected_output in result.output
-        if token_present:
-            mock_fetch_cards.assert_called_once_with(query, limit=limit)
+        mock_fetch_cards.assert_called_once_with(query, limit=limit)
 
 
 @pytest.mark.parametrize(
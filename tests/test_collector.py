@@ -1,5 +1,7 @@
+import asyncio
 import os
-from unittest.mock import MagicMock, patch
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
@@ -9,11 +11,12 @@ except ImportError:
     aioresponses = None
 
 from collector import active_listings_collector as alc
+from collector import crawl
 from collector.active_listings_collector import (
     process_site,
     send_dashboard_notification,
 )
-from collector.adapters.ebay import fetch_cards
+from collector.adapters.ebay import fetch_card_pages, fetch_cards
 from collector.adapters.ebay_sold_collector import fetch_sold_items
 from collector.adapters.ebay_valuation_collector import fetch_valuations
 from collector.adapters.sportscardspro_sold_collector import (
@@ -22,7 +25,6 @@ from collector.adapters.sportscardspro_sold_collector import (
 from collector.adapters.sportscardspro_valuation_collector import (
     fetch_valuations as scp_fetch_valuations,
 )
-from database.models import Card, Session
 
 
 @patch("collector.active_listings_collector.load_config")
@@ -42,10 +44,14 @@ def test_load_config(mock_load_config):
 
 
 @patch("collector.active_listings_collector.importlib.import_module")
-@patch("collector.active_listings_collector.add_card_definition")
-@patch("collector.active_listings_collector.add_active_listing_to_db")
+@patch("collector.active_listings_collector.resolve_card_ids")
+@patch("collector.active_listings_collector.get_session")
+@patch("collector.active_listings_collector.bulk_upsert_active_listings")
 def test_process_site(
-    mock_add_active_listing_to_db, mock_add_card_definition, mock_import_module
+    mock_bulk_upsert_active_listings,
+    mock_get_session,
+    mock_resolve_card_ids,
+    mock_import_module,
 ):
     mock_site_function = MagicMock()
     mock_site_function.return_value = [
@@ -69,7 +75,8 @@ def test_process_site(
     mock_module.collect_ebay_listings = mock_site_function
     mock_import_module.return_value = mock_module
 
-    mock_add_card_definition.return_value = 1
+    mock_resolve_card_ids.return_value = [1]
+    mock_bulk_upsert_active_listings.return_value = {"inserted": 1, "updated": 0}
 
     site_config = {
         "name": "eBay",
@@ -83,8 +90,12 @@ def test_process_site(
     }
 
     process_site(site_config)
-    mock_add_card_definition.assert_called_once()
-    mock_add_active_listing_to_db.assert_called_once()
+    mock_resolve_card_ids.assert_called_once()
+    mock_bulk_upsert_active_listings.assert_called_once()
+    _, rows = mock_bulk_upsert_active_listings.call_args.args
+    assert len(rows) == 1
+    assert rows[0]["card_id"] == 1
+    assert rows[0]["source_item_id"] == "12345"
 
 
 @patch("builtins.print")
@@ -113,35 +124,7 @@ async def test_fetch_cards():
         ]
     }
 
-    mock_session = MagicMock(spec=Session)
-    added_cards_in_session_scope = []
-
-    def side_effect_for_add(card_instance):
-        added_cards_in_session_scope.append(card_instance)
-
-    mock_session.add.side_effect = side_effect_for_add
-
-    current_mock_pk_id = 1
-
-    def side_effect_for_flush():
-        nonlocal current_mock_pk_id
-        for card_obj in added_cards_in_session_scope:
-            if isinstance(card_obj, Card) and getattr(card_obj, "id", None) is None:
-                card_obj.id = current_mock_pk_id
-                current_mock_pk_id += 1
-
-    mock_session.flush = MagicMock(side_effect=side_effect_for_flush)
-    actual_commit_action_mock = MagicMock(name="ActualCommitActionMock")
-
-    def side_effect_for_commit(*args, **kwargs):
-        mock_session.flush()
-        actual_commit_action_mock(*args, **kwargs)
-
-    mock_session.commit = MagicMock(side_effect=side_effect_for_commit)
-    mock_session.close = MagicMock()
-
     with (
-        patch("collector.adapters.ebay.get_session", return_value=mock_session),
         patch.dict(os.environ, {"EBAY_ACCESS_TOKEN": "mocked_token"}),
         aioresponses() as m,
     ):
@@ -158,19 +141,167 @@ async def test_fetch_cards():
     assert cards[0]["source_item_id"] == "1234567890"
     assert cards[1]["source_item_id"] == "0987654321"
 
-    assert mock_session.add.call_count == 2
-    assert len(added_cards_in_session_scope) == 2
-    mock_session.flush.assert_called_once()
 
-    assigned_ids = set()
-    for card_in_mock_db in added_cards_in_session_scope:
-        assert isinstance(card_in_mock_db, Card)
-        assert card_in_mock_db.id is not None
-        assigned_ids.add(card_in_mock_db.id)
-    assert len(assigned_ids) == len(added_cards_in_session_scope)
+@pytest.mark.asyncio
+async def test_fetch_cards_fetches_remaining_pages_concurrently():
+    url = "https://api.ebay.com/buy/browse/v1/item_summary/search?q=topps&limit=2"
+    pages = {
+        0: ["a", "b"],
+        2: ["c", "b"],  # "b" slid onto the next page while paging
+        4: ["d"],
+    }
+    with aioresponses() as m:
+        for offset, item_ids in pages.items():
+            m.get(
+                f"{url}&offset={offset}",
+                payload={
+                    "total": 5,
+                    "itemSummaries": [{"itemId": i, "title": i} for i in item_ids],
+                },
+            )
+
+        cards = await fetch_cards("topps", limit=10, page_size=2, concurrency=2)
+
+    assert [card["source_item_id"] for card in cards] == ["a", "b", "c", "d"]
+    assert sum(len(calls) for calls in m.requests.values()) == 3
+
+
+@pytest.mark.asyncio
+async def test_fetch_card_pages_reports_failed_pages():
+    async def call(session, params):
+        if params["offset"] == 2:
+            raise RuntimeError("still failing after retries")
+        item_id = str(params["offset"])
+        return {"total": 6, "itemSummaries": [{"itemId": item_id, "title": item_id}]}
+
+    with patch("collector.adapters.ebay._call", side_effect=call):
+        cards, complete = await fetch_card_pages("topps", limit=10, page_size=2)
+        assert [card["source_item_id"] for card in cards] == ["0", "4"]
+        assert complete is False
+
+        assert await fetch_cards("topps", limit=10, page_size=2) == cards
+
+
+@pytest.mark.asyncio
+async def test_fetch_card_pages_follows_the_next_link_without_a_total():
+    async def call(session, params):
+        offset = params["offset"]
+        page = {
+            "href": f"https://api.ebay.com/search?q=next+gen&offset={offset}",
+            "itemSummaries": [{"itemId": str(offset), "title": str(offset)}],
+        }
+        if params["q"] == "paged" and offset == 0:
+            page["next"] = f"https://api.ebay.com/search?offset={offset + 2}"
+        return page
+
+    with patch("collector.adapters.ebay._call", side_effect=call) as calls:
+        # A "next" in the href alone is not a next page
+        cards, complete = await fetch_card_pages("single", limit=6, page_size=2)
+        assert [card["source_item_id"] for card in cards] == ["0"]
+        assert calls.call_count == 1
+
+        cards, complete = await fetch_card_pages("paged", limit=6, page_size=2)
+        assert [card["source_item_id"] for card in cards] == ["0", "2", "4"]
+        assert complete is True
+
+
+@pytest.mark.asyncio
+async def test_crawl_queries_share_one_session():
+    url = "https://api.ebay.com/buy/browse/v1/item_summary/search"
+    stored = {}
+
+    async def store(listings):
+        if listings[0]["source_item_id"] == "b-1":
+            raise RuntimeError("db down")
+        stored[listings[0]["source_item_id"]] = len(listings)
+        return {"inserted": len(listings), "updated": 0}
+
+    with (
+        patch.dict(os.environ, {"EBAY_ACCESS_TOKEN": "mocked_token"}),
+        patch("collector.crawl.store_listings", side_effect=store),
+        patch("collector.crawl.load_crawl_state", return_value=(None, None)),
+        patch("collector.crawl.save_crawl_state"),
+        patch("collector.crawl.ClientSession", wraps=crawl.ClientSession) as session,
+        aioresponses() as m,
+    ):
+        for query in ("a", "b"):
+            m.get(
+                f"{url}?q={query}&limit=50&offset=0&sort=newlyListed",
+                payload={"total": 1, "itemSummaries": [{"itemId": f"{query}-1"}]},
+            )
+
+        results = await crawl.crawl_queries(["a", "b", "a"], concurrency=2)
+
+    assert session.call_count == 1
+    assert results["a"] == {"inserted": 1, "updated": 0, "full_sweep": True}
+    assert isinstance(results["b"], RuntimeError)
+    assert stored == {"a-1": 1}
+
+
+@pytest.mark.asyncio
+async def test_delta_crawl_stops_at_the_watermark():
+    url = (
+        "https://api.ebay.com/buy/browse/v1/item_summary/search"
+        "?q=topps&limit=50&offset=0&sort=newlyListed"
+    )
+    watermark = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+    page = [
+        {"itemId": "new-2", "itemCreationDate": "2025-01-01T14:00:00.000Z"},
+        {"itemId": "new-1", "itemCreationDate": "2025-01-01T13:00:00.000Z"},
+        # Inside the overlap window: re-stored, harmlessly
+        {"itemId": "recent", "itemCreationDate": "2025-01-01T11:58:00.000Z"},
+        {"itemId": "old", "itemCreationDate": "2025-01-01T11:50:00.000Z"},
+        {"itemId": "older", "itemCreationDate": "2025-01-01T10:00:00.000Z"},
+    ]
+    store = AsyncMock(return_value={"inserted": 2, "updated": 0})
+    with (
+        patch.dict(os.environ, {"EBAY_ACCESS_TOKEN": "mocked_token"}),
+        patch.object(crawl, "store_listings", store),
+        patch.object(crawl, "load_crawl_state", return_value=(watermark, watermark)),
+        patch.object(crawl, "save_crawl_state") as save,
+        patch.object(crawl, "FULL_SWEEP_INTERVAL", timedelta(days=36500)),
+        aioresponses() as m,
+    ):
+        m.get(url, payload={"total": 900, "itemSummaries": page})
+        async with crawl.crawl_session() as session:
+            result = await crawl.crawl_query(
+                "topps", session, asyncio.Semaphore(1), limit=10
+            )
+
+    assert result == {"inserted": 2, "updated": 0, "full_sweep": False}
+    assert sum(len(calls) for calls in m.requests.values()) == 1
+    listings = store.await_args.args[0]
+    assert [listing["source_item_id"] for listing in listings] == [
+        "new-2",
+        "new-1",
+        "recent",
+    ]
+    save.assert_called_once_with(
+        "topps", datetime(2025, 1, 1, 14, 0, tzinfo=timezone.utc), None
+    )
+
 
-    actual_commit_action_mock.assert_called_once()
-    mock_session.close.assert_called_once()
+@pytest.mark.asyncio
+async def test_failed_full_sweep_is_not_recorded():
+    async def call(session, params):
+        if params["offset"] > 0:
+            raise RuntimeError("still failing after retries")
+        return {"total": 80, "itemSummaries": [{"itemId": "a", "title": "a"}]}
+
+    store = AsyncMock(return_value={"inserted": 1, "updated": 0})
+    with (
+        patch("collector.adapters.ebay._call", side_effect=call),
+        patch.object(crawl, "store_listings", store),
+        patch.object(crawl, "load_crawl_state", return_value=(None, None)),
+        patch.object(crawl, "save_crawl_state") as save,
+    ):
+        async with crawl.crawl_session() as session:
+            result = await crawl.crawl_query(
+                "topps", session, asyncio.Semaphore(1), limit=100
+            )
+
+    assert result == {"inserted": 1, "updated": 0, "full_sweep": True}
+    save.assert_not_called()
 
 
 @pytest.mark.parametrize(
@@ -207,7 +338,10 @@ def test_ebay_sold_collector(config, expected_count):
     ],
 )
 def test_ebay_valuation_collector(config, expected_count):
-    with patch("collector.adapters.ebay_valuation_collector.requests.get") as mock_get:
+    with (
+        patch.dict(os.environ, {"EBAY_ACCESS_TOKEN": "mocked_token"}),
+        patch("collector.adapters.ebay_valuation_collector.requests.get") as mock_get,
+    ):
         mock_get.return_value.json.return_value = {"valuations": []}
         result = fetch_valuations(config)
         assert len(result["valuation_entries"]) == expected_count
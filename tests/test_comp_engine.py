@@ -0,0 +1,40 @@
+import random
+
+import pytest
+
+from analyzer.analyzer import (
+    DEFAULT_HISTORICAL_DAYS,
+    DEFAULT_UNDERVALUE_THRESHOLD,
+    calculate_comp_stats,
+    get_dynamic_undervalue_threshold,
+)
+from analyzer.comp_engine import summarize_groups
+
+
+def test_summarize_groups_matches_scalar_stats():
+    rng = random.Random(7)
+    histories = {
+        ("card", size): [
+            {"sale_price": round(rng.uniform(10, 500), 2)} for _ in range(size)
+        ]
+        for size in (0, 1, 2, 3, 4, 7, 50)
+    }
+    # Tight prices with enough volume keep the base threshold
+    histories[("steady", 10)] = [{"sale_price": 100.0 + i} for i in range(10)]
+
+    summaries = summarize_groups(
+        histories, DEFAULT_UNDERVALUE_THRESHOLD, DEFAULT_HISTORICAL_DAYS
+    )
+    for key, history in histories.items():
+        expected = calculate_comp_stats(history)
+        actual = summaries[key]["comp_stats"]
+        assert actual["sales_count"] == expected["sales_count"]
+        for stat in ("median_price", "average_price", "min_price", "max_price"):
+            assert actual[stat] == pytest.approx(expected[stat])
+        assert summaries[key]["dynamic_threshold"] == pytest.approx(
+            get_dynamic_undervalue_threshold(expected, history)
+        )
+
+
+def test_summarize_groups_empty():
+    assert summarize_groups({}, DEFAULT_UNDERVALUE_THRESHOLD, 90) == {}
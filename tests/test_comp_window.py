@@ -0,0 +1,103 @@
+import statistics
+
+import pytest
+
+import database.comp_window as comp_window
+from analyzer.analyzer import load_window_summaries, summarize_comps
+from database.comp_window import (
+    expire_comp_windows,
+    read_comp_windows,
+    rebuild_comp_windows,
+)
+from database.models import SoldListing, get_engine, get_session
+from tests.conftest import add_sold, sold_sales
+
+PRICES = (120.0, 95.5, 140.0, 101.25, 133.0)
+
+
+def _sales(days_ago):
+    return sold_sales(7, PRICES, days_ago, prefix="w")
+
+
+def test_window_matches_full_scan(sqlite_db):
+    sales = _sales([1, 5, 10, 30, 60])
+    add_sold(sales[:2])
+    add_sold(sales[2:])
+    add_sold(sales)  # duplicates are not counted twice
+
+    key = (7, "PSA 10", "PSA")
+    expected = summarize_comps(sales)
+    summary = load_window_summaries([key])[key]
+    assert summary["dynamic_threshold"] == expected["dynamic_threshold"]
+    for field, value in expected["comp_stats"].items():
+        assert summary["comp_stats"][field] == pytest.approx(value)
+
+    session = get_session()
+    try:
+        window = read_comp_windows(session, [key])[key]
+    finally:
+        session.close()
+    assert window["stdev"] == pytest.approx(statistics.stdev(PRICES))
+
+
+def test_expire_and_rebuild(sqlite_db, monkeypatch):
+    add_sold(_sales([1, 5, 10, 30, 60]))
+    key = (7, "PSA 10", "PSA")
+
+    monkeypatch.setattr(comp_window, "COMP_WINDOW_DAYS", 20)
+    assert expire_comp_windows() == 1
+    session = get_session()
+    try:
+        expired = read_comp_windows(session, [key])[key]["comp_stats"]
+    finally:
+        session.close()
+    assert expired["sales_count"] == 3
+    assert expired["median_price"] == 120.0
+
+    with get_engine().begin() as conn:
+        assert rebuild_comp_windows(conn) == 1
+    session = get_session()
+    try:
+        assert read_comp_windows(session, [key])[key]["comp_stats"] == expired
+    finally:
+        session.close()
+
+
+def test_sales_written_around_ingest_need_a_rebuild(sqlite_db):
+    sales = _sales([1, 5, 10, 30, 60])
+    add_sold(sales[:3])
+    key = (7, "PSA 10", "PSA")
+
+    session = get_session()
+    try:
+        session.add_all(SoldListing(**sale) for sale in sales[3:])
+        session.commit()
+        # Reads trust the row; only the ingest paths keep it current
+        assert read_comp_windows(session, [key])[key]["comp_stats"]["sales_count"] == 3
+    finally:
+        session.close()
+
+    with get_engine().begin() as conn:
+        rebuild_comp_windows(conn)
+    expected = summarize_comps(sales)["comp_stats"]
+    summary = load_window_summaries([key])[key]["comp_stats"]
+    for field, value in expected.items():
+        assert summary[field] == pytest.approx(value)
+
+
+def test_windows_are_read_until_expired(sqlite_db, monkeypatch):
+    add_sold(_sales([1, 5, 10, 30, 60]))
+    key = (7, "PSA 10", "PSA")
+
+    def sales_count():
+        session = get_session()
+        try:
+            return read_comp_windows(session, [key])[key]["comp_stats"]["sales_count"]
+        finally:
+            session.close()
+
+    # Two sales aged out since the last expiry: the row is still read as is
+    monkeypatch.setattr(comp_window, "COMP_WINDOW_DAYS", 20)
+    assert sales_count() == 5
+    expire_comp_windows()
+    assert sales_count() == 3
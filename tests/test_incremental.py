@@ -0,0 +1,112 @@
+from unittest.mock import patch
+
+import pytest
+
+from analyzer import incremental
+from analyzer.incremental import last_watermark, run_analysis
+from database.models import ActiveListing, bulk_upsert_active_listings, get_session
+from tests.conftest import active_listing, add_sold, in_session, sold_sales
+
+
+def _analyzed_card_ids():
+    listings, _ = run_analysis(workers=1)
+    return sorted(listing.card_id for listing in listings)
+
+
+def test_only_changed_listings_and_comps_are_reanalyzed(sqlite_db):
+    add_sold(sold_sales(7, [100, 110, 120, 130, 140]))
+    add_sold(sold_sales(8, [50, 55, 60, 65, 70]))
+    in_session(
+        bulk_upsert_active_listings, [active_listing(7, 60.0), active_listing(8, 58.0)]
+    )
+
+    assert in_session(last_watermark) is None
+    assert _analyzed_card_ids() == [7, 8]
+    assert in_session(last_watermark) is not None
+    assert _analyzed_card_ids() == []
+
+    # Seen again unchanged: still clean. A new price clears analyzed_at.
+    in_session(
+        bulk_upsert_active_listings, [active_listing(7, 60.0), active_listing(8, 40.0)]
+    )
+    assert _analyzed_card_ids() == [8]
+
+    # A new sale for card 7 dirties its listing through the comp window
+    add_sold(sold_sales(7, [125], prefix="new"))
+    assert _analyzed_card_ids() == [7]
+
+    session = get_session()
+    try:
+        assert session.query(ActiveListing).filter_by(analyzed_at=None).count() == 0
+    finally:
+        session.close()
+    listings, _ = run_analysis(full=True, workers=1)
+    assert len(listings) == 2
+
+
+def test_price_change_during_a_run_keeps_the_listing_dirty(sqlite_db):
+    add_sold(sold_sales(7, [100, 110, 120, 130, 140]))
+    in_session(bulk_upsert_active_listings, [active_listing(7, 60.0)])
+    analyze = incremental.analyze_listings_parallel
+
+    def reprice_then_analyze(listings, *args, **kwargs):
+        # The crawl sees a new price while the run is computing verdicts
+        in_session(bulk_upsert_active_listings, [active_listing(7, 200.0)])
+        return analyze(listings, *args, **kwargs)
+
+    with patch.object(incremental, "analyze_listings_parallel", reprice_then_analyze):
+        assert _analyzed_card_ids() == [7]
+    session = get_session()
+    try:
+        listing = session.query(ActiveListing).one()
+        assert listing.analyzed_at is None
+        assert listing.is_undervalued is None
+    finally:
+        session.close()
+    assert _analyzed_card_ids() == [7]
+
+
+def test_comp_change_seen_again_during_a_run_stays_dirty(sqlite_db):
+    add_sold(sold_sales(7, [100, 110, 120, 130, 140]))
+    in_session(bulk_upsert_active_listings, [active_listing(7, 60.0)])
+    assert _analyzed_card_ids() == [7]
+    add_sold(sold_sales(7, [125], prefix="new"))
+    analyze = incremental.analyze_listings_parallel
+
+    def see_again_then_analyze(listings, *args, **kwargs):
+        # The crawl sees the listing, unchanged, while the run is going
+        in_session(bulk_upsert_active_listings, [active_listing(7, 60.0)])
+        return analyze(listings, *args, **kwargs)
+
+    with patch.object(incremental, "analyze_listings_parallel", see_again_then_analyze):
+        assert _analyzed_card_ids() == [7]
+    # The verdict write skipped it, so the next run (past the comp change)
+    # still picks it up
+    assert _analyzed_card_ids() == [7]
+    assert _analyzed_card_ids() == []
+
+
+@pytest.mark.parametrize(
+    "failing",
+    [
+        "analyzer.analyzer.fetch_sales_histories",
+        "analyzer.analyzer._analysis_update_statements",
+    ],
+)
+def test_failed_run_is_not_stamped_or_recorded(sqlite_db, failing):
+    add_sold(sold_sales(7, [100, 110, 120, 130, 140]))
+    in_session(bulk_upsert_active_listings, [active_listing(7, 60.0)])
+
+    # Comps come from the sales scan, so a failing query is reached
+    with patch("analyzer.analyzer.load_window_summaries", return_value={}), patch(
+        failing, side_effect=RuntimeError("database went away")
+    ):
+        with pytest.raises(RuntimeError):
+            run_analysis(workers=1)
+    session = get_session()
+    try:
+        assert session.query(ActiveListing).one().analyzed_at is None
+    finally:
+        session.close()
+    assert in_session(last_watermark) is None
+    assert _analyzed_card_ids() == [7]
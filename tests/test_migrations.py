@@ -0,0 +1,41 @@
+from sqlalchemy import inspect, text
+
+from database.migrations import MIGRATIONS, current_version, run_migrations
+from database.models import get_engine
+
+
+def test_run_migrations_is_idempotent(sqlite_db):
+    assert current_version() == MIGRATIONS[-1]["version"]
+    # Everything is recorded, so a second run applies nothing
+    assert run_migrations() == []
+
+
+def test_comp_lookup_indexes_exist(sqlite_db):
+    inspector = inspect(get_engine())
+    sold_indexes = {ix["name"] for ix in inspector.get_indexes("sold_listings")}
+    active_indexes = {ix["name"] for ix in inspector.get_indexes("active_listings")}
+    assert "ix_sold_listings_comp" in sold_indexes
+    assert "ix_active_listings_card_grade" in active_indexes
+
+
+def test_migrations_apply_to_existing_schema(sqlite_db):
+    engine = get_engine()
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ix_sold_listings_comp"))
+        conn.execute(text("DELETE FROM schema_migrations WHERE version = 1"))
+    assert run_migrations() == [1]
+    inspector = inspect(engine)
+    assert "ix_sold_listings_comp" in {
+        ix["name"] for ix in inspector.get_indexes("sold_listings")
+    }
+
+
+def test_analyzed_at_column_is_added(sqlite_db):
+    engine = get_engine()
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE active_listings DROP COLUMN analyzed_at"))
+        conn.execute(text("DELETE FROM schema_migrations WHERE version = 7"))
+    assert run_migrations() == [7]
+    assert "analyzed_at" in {
+        c["name"] for c in inspect(engine).get_columns("active_listings")
+    }
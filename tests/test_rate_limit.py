@@ -0,0 +1,63 @@
+import asyncio
+import sqlite3
+from unittest.mock import patch
+
+import pytest
+
+from collector.rate_limit import TokenBucketLimiter, retry_after_seconds
+
+
+@pytest.fixture
+def clock():
+    now = [1000.0]
+    with patch("collector.rate_limit.time.time", side_effect=lambda: now[0]):
+        yield now
+
+
+def test_bucket_is_shared_through_the_store(tmp_path, clock):
+    path = str(tmp_path / "buckets.db")
+    first = TokenBucketLimiter(path, rates={"search": (2.0, 3.0)})
+    second = TokenBucketLimiter(path, rates={"search": (2.0, 3.0)})
+
+    assert [first.try_acquire("search") for _ in range(2)] == [0, 0]
+    assert second.try_acquire("search") == 0
+    assert first.try_acquire("search") == pytest.approx(0.5)
+
+    clock[0] += 0.5
+    assert second.try_acquire("search") == 0
+    assert first.try_acquire("search") == pytest.approx(0.5)
+
+
+def test_block_pauses_every_caller(tmp_path, clock):
+    path = str(tmp_path / "buckets.db")
+    first = TokenBucketLimiter(path, rates={"search": (1.0, 5.0)})
+    second = TokenBucketLimiter(path, rates={"search": (1.0, 5.0)})
+
+    first.block("search", retry_after_seconds({"Retry-After": "30"}))
+    assert second.try_acquire("search") == pytest.approx(30)
+    clock[0] += 31
+    assert second.try_acquire("search") == 0
+    assert retry_after_seconds({}) is None
+
+
+def test_without_a_store_buckets_are_per_process(clock):
+    limiter = TokenBucketLimiter(None, rates={"oauth": (1.0, 1.0)})
+    assert limiter.try_acquire("oauth") == 0
+    assert limiter.try_acquire("oauth") == pytest.approx(1.0)
+
+
+@pytest.mark.asyncio
+async def test_acquire_async_waits_for_the_store_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "buckets.db")
+    limiter = TokenBucketLimiter(path, rates={"search": (1.0, 2.0)})
+    assert limiter.try_acquire("search") == 0
+
+    # Another process holds the store's write lock
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")
+    acquire = asyncio.create_task(limiter.acquire_async("search"))
+    await asyncio.sleep(0.2)
+    assert not acquire.done()
+    holder.execute("COMMIT")
+    await asyncio.wait_for(acquire, timeout=5)
+    holder.close()
@@ -0,0 +1,110 @@
+import bisect
+import random
+import statistics
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from analyzer.analyzer import load_window_summaries, summarize_comps
+from database.models import get_engine, get_session
+from database.partitions import compact_sold_listings
+from database.sketches import (
+    TDigest,
+    prune_daily_sketches,
+    read_window_sketches,
+    rebuild_daily_sketches,
+)
+from tests.conftest import add_sold, sold_sales
+
+
+def test_small_sketches_are_exact_and_mergeable():
+    prices = [12.0, 7.5, 30.0, 18.25, 9.0, 22.0]
+    whole = TDigest()
+    for price in prices:
+        whole.add(price)
+    halves = TDigest(), TDigest()
+    for i, price in enumerate(prices):
+        halves[i % 2].add(price)
+    merged = TDigest().merge(halves[0]).merge(halves[1])
+
+    for sketch in (whole, merged):
+        assert sketch.quantile(0.5) == statistics.median(prices)
+        assert sketch.stdev() == pytest.approx(statistics.stdev(prices))
+        assert (sketch.min, sketch.max, sketch.count) == (7.5, 30.0, 6)
+
+
+def test_large_sketch_quantiles_are_close():
+    rng = random.Random(7)
+    prices = [rng.lognormvariate(4, 0.5) for _ in range(20_000)]
+    sketch = TDigest()
+    for start in range(0, len(prices), 1000):
+        day = TDigest()
+        for price in prices[start : start + 1000]:
+            day.add(price)
+        sketch.merge(TDigest.from_row(day.to_values()))
+    # A few hundred (mean, weight) pairs instead of 20k prices
+    assert len(sketch.to_values()["centroids"]) < 16 * 500
+    prices.sort()
+    for q in (0.01, 0.1, 0.5, 0.9, 0.99):
+        rank = bisect.bisect_left(prices, sketch.quantile(q))
+        assert abs(rank / len(prices) - q) < 0.005
+
+
+def test_window_comps_from_sketches(sqlite_db):
+    sales = sold_sales(
+        3,
+        [50.0, 55.0, 61.0, 48.0, 70.0, 90.0],
+        [timedelta(days=age, hours=1) for age in (1, 1, 4, 9, 20, 100)],
+        grade="PSA 9",
+        prefix="sk",
+    )
+    add_sold(sales)
+
+    key = (3, "PSA 9", "PSA")
+    summary = load_window_summaries([key], 30)[key]
+    assert summary == summarize_comps(sales[:5])
+
+    with get_engine().begin() as conn:
+        assert rebuild_daily_sketches(conn) == 5
+    session = get_session()
+    try:
+        sketch = read_window_sketches(session, [key], 180)[key]
+    finally:
+        session.close()
+    assert sketch.comp_stats() == summarize_comps(sales)["comp_stats"]
+
+
+def _add_sales(ages):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    prices = [10.0 * (i + 1) for i in range(len(ages))]
+    sales = sold_sales(4, prices, ages, grade="PSA 8", prefix="sk", now=now)
+    add_sold(sales)
+    return now, sales
+
+
+def _window(days, now=None):
+    session = get_session()
+    try:
+        return read_window_sketches(session, [(4, "PSA 8", "PSA")], days, now)
+    finally:
+        session.close()
+
+
+def test_window_starts_exactly_days_ago(sqlite_db):
+    now, sales = _add_sales(
+        [timedelta(days=2), timedelta(days=30, hours=-1), timedelta(days=30, hours=1)]
+    )
+    window = _window(30, now)[(4, "PSA 8", "PSA")]
+    assert window.comp_stats() == summarize_comps(sales[:2])["comp_stats"]
+
+
+def test_rebuild_keeps_compacted_days_and_prune_drops_them(sqlite_db):
+    _add_sales([timedelta(days=1), timedelta(days=4), timedelta(days=400)])
+    assert compact_sold_listings(horizon_days=365)["rows_compacted"] == 1
+
+    with get_engine().begin() as conn:
+        assert rebuild_daily_sketches(conn) == 2
+    assert _window(500)[(4, "PSA 8", "PSA")].count == 3
+
+    assert prune_daily_sketches(retention_days=365) == 1
+    assert _window(500)[(4, "PSA 8", "PSA")].count == 2
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import database.models as models
+from database.models import (
+    Card,
+    SoldListingDailySummary,
+    bulk_add_sold_listings,
+    bulk_add_valuations,
+    bulk_upsert_active_listings,
+    get_engine,
+    get_session,
+    resolve_card_ids,
+)
+from database.partitions import compact_sold_listings
+
+
+def test_sqlite_uses_wal(sqlite_db):
+    with get_engine().connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+
+
+def test_cards_without_attributes_are_not_duplicated(sqlite_db):
+    listing = {"player_name": "Mike Trout", "card_year": "2011", "card_set": "Topps"}
+    first = resolve_card_ids([listing])
+    models.clear_card_cache()
+    assert resolve_card_ids([listing]) == first
+    session = get_session()
+    try:
+        assert session.query(Card).count() == 1
+    finally:
+        session.close()
+
+
+def test_bulk_writers_dedupe(sqlite_db):
+    session = get_session()
+    try:
+        listing = {
+            "card_id": 1,
+            "listing_price": 10.0,
+            "source": "ebay",
+            "source_item_id": "a1",
+            "listing_date": "2024-05-01T10:00:00.000Z",
+        }
+        assert bulk_upsert_active_listings(session, [listing]) == {
+            "inserted": 1,
+            "updated": 0,
+        }
+        assert bulk_upsert_active_listings(
+            session, [listing, {**listing, "source_item_id": "a2"}]
+        ) == {"inserted": 1, "updated": 1}
+
+        sale = {
+            "card_id": 1,
+            "sale_price": 20.0,
+            "sale_date": "2024-05-02T10:00:00",
+            "source": "ebay",
+            "source_item_id": "s1",
+        }
+        assert bulk_add_sold_listings(session, [sale]) == 1
+        assert bulk_add_sold_listings(session, [sale]) == 0
+        # The same item with another or no sale_date is still the same sale
+        assert (
+            bulk_add_sold_listings(
+                session,
+                [
+                    {**sale, "sale_date": "2024-05-03T09:00:00"},
+                    {**sale, "sale_date": None},
+                    {**sale, "source_item_id": "s2", "sale_date": None},
+                    {**sale, "source_item_id": "s2"},
+                ],
+            )
+            == 1
+        )
+
+        valuation = {
+            "card_id": 1,
+            "estimated_value": 15.0,
+            "valuation_date": "2024-05-02",
+            "source": "feed",
+        }
+        assert bulk_add_valuations(session, [valuation])["new"] == 1
+        assert bulk_add_valuations(session, [valuation]) == {"new": 0, "duplicate": 1}
+    finally:
+        session.close()
+
+
+def test_compact_rolls_up_old_sales(sqlite_db):
+    old = datetime.now() - timedelta(days=400)
+    sales = [
+        {
+            "card_id": 1,
+            "sale_price": price,
+            "sale_date": old,
+            "source": "ebay",
+            "source_item_id": f"old-{price}",
+        }
+        for price in (10.0, 20.0, 60.0)
+    ]
+    session = get_session()
+    try:
+        bulk_add_sold_listings(session, sales)
+    finally:
+        session.close()
+
+    result = compact_sold_listings(horizon_days=365)
+    assert result["rows_compacted"] == 3
+    session = get_session()
+    try:
+        summary = session.query(SoldListingDailySummary).one()
+        assert (summary.sales_count, summary.median_price) == (3, 20.0)
+    finally:
+        session.close()
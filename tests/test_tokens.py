@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+import pytest
+from aioresponses import aioresponses
+
+from collector.tokens import OAUTH_URL, TokenManager
+
+
+@pytest.fixture
+def oauth_env(monkeypatch):
+    monkeypatch.setenv("EBAY_OAUTH_REFRESH_TOKEN", "refresh")
+    monkeypatch.setenv("EBAY_APP_ID", "app")
+    monkeypatch.setenv("EBAY_CERT_ID", "cert")
+    monkeypatch.delenv("EBAY_ACCESS_TOKEN", raising=False)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_refreshes_collapse_into_one(tmp_path, oauth_env):
+    manager = TokenManager(str(tmp_path / "token.json"))
+    manager.save("stale")
+    with aioresponses() as m:
+        m.post(OAUTH_URL, payload={"access_token": "fresh", "expires_in": 7200})
+        tokens = await asyncio.gather(
+            *[manager.refresh(stale_token="stale") for _ in range(10)]
+        )
+        assert sum(len(calls) for calls in m.requests.values()) == 1
+
+    assert tokens == ["fresh"] * 10
+    # Another process reads the refreshed token from the shared store
+    other = TokenManager(manager.path)
+    assert await other.headers() == {"Authorization": "Bearer fresh"}
+
+
+@pytest.mark.asyncio
+async def test_token_is_refreshed_before_it_expires(tmp_path, oauth_env):
+    manager = TokenManager(str(tmp_path / "token.json"))
+    manager.save("old", expires_in=60)
+    assert manager.expires_at < time.time() + 61
+    with aioresponses() as m:
+        m.post(OAUTH_URL, payload={"access_token": "new", "expires_in": 7200})
+        assert await manager.get_token() == "new"
+        assert await manager.get_token() == "new"
+        assert sum(len(calls) for calls in m.requests.values()) == 1
+
+
+@pytest.mark.asyncio
+async def test_forced_refresh_ignores_a_stored_token(tmp_path, oauth_env):
+    TokenManager(str(tmp_path / "token.json")).save("stored", expires_in=7200)
+    manager = TokenManager(str(tmp_path / "token.json"))
+    with aioresponses() as m:
+        m.post(OAUTH_URL, payload={"access_token": "forced", "expires_in": 7200})
+        assert await manager.refresh(force=True) == "forced"
+        assert sum(len(calls) for calls in m.requests.values()) == 1
+    assert await TokenManager(manager.path).get_token() == "forced"